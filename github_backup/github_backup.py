@@ -3,28 +3,60 @@
 from __future__ import print_function
 
 import argparse
+import asyncio
 import base64
-import calendar
 import codecs
+import copy
+import email.utils
 import errno
 import getpass
+import gzip
+import hashlib
 import json
 import logging
+import lzma
 import os
 import platform
+import queue
+import random
 import re
 import select
 import socket
+import sqlite3
 import ssl
 import subprocess
 import sys
+import tempfile
+import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from http.client import IncompleteRead
+from http.client import (
+    HTTPConnection,
+    HTTPException,
+    HTTPMessage,
+    HTTPSConnection,
+    IncompleteRead,
+)
+from io import BytesIO
 from urllib.error import HTTPError, URLError
 from urllib.parse import quote as urlquote
-from urllib.parse import urlencode, urlparse
-from urllib.request import HTTPRedirectHandler, Request, build_opener, urlopen
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse
+from urllib.request import (
+    HTTPRedirectHandler,
+    HTTPSHandler,
+    Request,
+    build_opener,
+    getproxies,
+    proxy_bypass,
+)
+from urllib.request import __version__ as urllib_version
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 try:
     from . import __version__
@@ -38,6 +70,31 @@ FILE_URI_PREFIX = "file://"
 logger = logging.getLogger(__name__)
 
 
+class RepositoryLogFilter(logging.Filter):
+    """
+    Prefixes log messages with the repository the current thread works on,
+    so interleaved output of concurrent repository workers stays readable.
+    """
+
+    def filter(self, record):
+        repository = getattr(_log_context, "repository", None)
+        if repository:
+            record.msg = "[{0}] {1}".format(repository, record.msg)
+        return True
+
+
+_log_context = threading.local()
+logger.addFilter(RepositoryLogFilter())
+
+
+def _run_with_log_context(repository, func, *args):
+    _log_context.repository = repository
+    try:
+        return func(*args)
+    finally:
+        _log_context.repository = None
+
+
 class RepositoryUnavailableError(Exception):
     """Raised when a repository is unavailable due to legal reasons (e.g., DMCA takedown)."""
 
@@ -75,6 +132,938 @@ else:
             )
 
 
+class _PooledResponse(object):
+    """
+    Response wrapper that hands its connection back to the ConnectionPool
+    once the body has been read to the end. Closing it before that closes
+    the connection.
+    """
+
+    def __init__(self, pool, key, connection, response, url):
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self.url = url
+
+    def read(self, amt=None):
+        data = self._response.read() if amt is None else self._response.read(amt)
+        if self._response.isclosed():
+            # Read to the end, the connection is ready for the next request
+            self._release()
+        return data
+
+    def close(self):
+        if self._connection is not None:
+            # Unread body left on the socket, the connection can't be reused
+            self._connection.close()
+            self._connection = None
+        self._response.close()
+
+    def _release(self):
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        if self._response.will_close:
+            connection.close()
+        else:
+            self._pool._release(self._key, connection)
+
+    def getcode(self):
+        return self._response.status
+
+    def geturl(self):
+        return self.url
+
+    @property
+    def headers(self):
+        return self._response.msg
+
+    @property
+    def status(self):
+        return self._response.status
+
+    @property
+    def reason(self):
+        return self._response.reason
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConnectionPool(object):
+    """
+    Keep-alive HTTP(S) connection pool shared by API requests and downloads.
+
+    urlopen() sends "Connection: close" and opens a new TCP + TLS connection
+    for every request. The pool keeps idle connections per (scheme, host, port)
+    and reuses them, so paginated API calls and downloads from the same host
+    only pay for the handshake once.
+
+    Redirects are followed with a urllib redirect handler, so handlers such as
+    S3HTTPRedirectHandler keep deciding which headers survive the redirect.
+    Requests that need an environment proxy are handed to a regular urllib
+    opener instead.
+    """
+
+    user_agent = "Python-urllib/" + urllib_version
+
+    def __init__(self, context=None, max_idle_per_host=8):
+        self.context = context
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._proxies = getproxies()
+        self.requests = 0
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+    def urlopen(self, request, redirect_handler=None):
+        if redirect_handler is None:
+            redirect_handler = HTTPRedirectHandler()
+
+        if self._uses_proxy(request):
+            opener = build_opener(HTTPSHandler(context=self.context), redirect_handler)
+            return opener.open(request)
+
+        for _ in range(HTTPRedirectHandler.max_redirections + 1):
+            response = self._send(request)
+            location = response.headers.get("Location") or response.headers.get("URI")
+            if response.status not in (301, 302, 303, 307, 308) or not location:
+                break
+
+            newurl = urljoin(request.full_url, location)
+            if urlparse(newurl).scheme not in ("http", "https"):
+                raise self._error(
+                    newurl,
+                    response,
+                    "Redirection to url '{0}' is not allowed".format(newurl),
+                )
+            new_request = redirect_handler.redirect_request(
+                request,
+                response,
+                response.status,
+                response.reason,
+                response.headers,
+                newurl,
+            )
+            if new_request is None:
+                break
+
+            # Drain the redirect body so the connection can go back to the pool
+            response.read()
+            request = new_request
+        else:
+            raise self._error(
+                request.full_url,
+                response,
+                HTTPRedirectHandler.inf_msg + response.reason,
+            )
+
+        if not 200 <= response.status < 300:
+            raise self._error(request.full_url, response, response.reason)
+        return response
+
+    @staticmethod
+    def _error(url, response, reason):
+        """
+        An HTTPError for response. Its body is read right away, so the
+        connection goes back to the pool now rather than whenever the error
+        is garbage collected, when its socket may be finalized already.
+        """
+        try:
+            body = response.read()
+        except (HTTPException, OSError):
+            response.close()
+            body = b""
+        return HTTPError(url, response.status, reason, response.headers, BytesIO(body))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "connections_reused": self.connections_reused,
+            }
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def _uses_proxy(self, request):
+        return request.type in self._proxies and not proxy_bypass(request.host)
+
+    def _send(self, request):
+        parsed = urlparse(request.full_url)
+        key = (parsed.scheme, parsed.hostname, parsed.port)
+
+        headers = dict(request.header_items())
+        if not request.has_header("User-agent"):
+            headers["User-Agent"] = self.user_agent
+
+        while True:
+            connection, reused = self._acquire(key)
+            try:
+                try:
+                    connection.request(
+                        request.get_method(), request.selector, request.data, headers
+                    )
+                except OSError as e:
+                    raise URLError(e)
+                response = connection.getresponse()
+            except (HTTPException, OSError):
+                connection.close()
+                if reused:
+                    # The server dropped an idle keep-alive connection, retry
+                    # once on a freshly opened connection
+                    continue
+                raise
+            return _PooledResponse(self, key, connection, response, request.full_url)
+
+    def _acquire(self, key):
+        with self._lock:
+            self.requests += 1
+            idle = self._idle.get(key)
+            if idle:
+                self.connections_reused += 1
+                return idle.pop(), True
+            self.connections_opened += 1
+
+        scheme, host, port = key
+        if scheme == "https":
+            return HTTPSConnection(host, port, context=self.context), False
+        return HTTPConnection(host, port), False
+
+    def _release(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(connection)
+                return
+        connection.close()
+
+
+connection_pool = ConnectionPool(context=https_ctx)
+
+
+class _CachedResponse(object):
+    """A page replayed from the HTTP cache in place of a 304 response."""
+
+    reason = "Not Modified"
+
+    def __init__(self, body, headers):
+        self._body = body
+        self.headers = headers
+
+    def getcode(self):
+        return 200
+
+    def read(self, amt=None):
+        body, self._body = self._body, b""
+        return body
+
+
+class HTTPCache(object):
+    """
+    On-disk cache of API responses and their ETag / Last-Modified validators.
+
+    Entries are keyed by the full request URL, including the cursor URLs
+    taken from Link headers. Cached pages are revalidated with If-None-Match /
+    If-Modified-Since; GitHub answers those with a 304 that doesn't count
+    against the rate limit, and the page is then replayed from disk.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self.conditional_requests = 0
+        self.not_modified = 0
+
+    def _entry_path(self, url):
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + ".json")
+
+    def get(self, url):
+        try:
+            with codecs.open(self._entry_path(url), "r", encoding="utf-8") as f:
+                entry = json_loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if entry.get("url") != url:
+            return None
+        return entry
+
+    def add_conditional_headers(self, request):
+        """Make request conditional on its cache entry, which is returned."""
+        entry = self.get(request.get_full_url())
+        if not entry:
+            return None
+        if entry.get("etag"):
+            request.add_header("If-None-Match", entry["etag"])
+        if entry.get("last_modified"):
+            request.add_header("If-Modified-Since", entry["last_modified"])
+        with self._lock:
+            self.conditional_requests += 1
+        return entry
+
+    def replay(self, response, entry):
+        """The page of the cache entry a 304 response was answered for."""
+        logger.debug("Not modified, using cached response")
+        with self._lock:
+            self.not_modified += 1
+
+        # Keep the fresh headers, the ETag only covers the body of the page,
+        # so pages added after it are only known from the fresh Link header
+        headers = HTTPMessage()
+        for name, value in response.headers.items():
+            headers[name] = value
+        if "Link" not in headers and entry.get("link"):
+            headers["Link"] = entry["link"]
+        return _CachedResponse(entry["body"].encode("utf-8"), headers)
+
+    def store(self, request, response, body):
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+
+        url = request.get_full_url()
+        entry = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "link": response.headers.get("Link"),
+            "body": body,
+        }
+        entry_path = self._entry_path(url)
+        mkdir_p(os.path.dirname(entry_path))
+        fd, temp_file = tempfile.mkstemp(
+            dir=os.path.dirname(entry_path), suffix=".temp"
+        )
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(temp_file, entry_path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "conditional_requests": self.conditional_requests,
+                "not_modified": self.not_modified,
+            }
+
+
+http_cache = None
+
+
+class RateLimitGovernor(object):
+    """
+    Paces requests against GitHub's rate limits, shared by all threads.
+
+    The x-ratelimit-* headers of every response are tracked per credential and
+    resource (core, search, graphql, ...). Once fewer than throttle_limit
+    requests remain, requests are spaced out so the remaining budget lasts
+    until the window resets; when it is exhausted, requests wait for the reset.
+    Secondary rate limits (403/429 with Retry-After) block further requests
+    with that credential for the requested time. Only requests to api_host
+    count, downloads from github.com or S3 don't.
+    """
+
+    def __init__(
+        self, throttle_limit=0, throttle_pause=30.0, api_host="api.github.com"
+    ):
+        self.throttle_limit = throttle_limit
+        self.throttle_pause = throttle_pause
+        self.api_host = api_host
+        self._lock = threading.Lock()
+        self._limits = {}
+        self._next_slot = {}
+        self._blocked_until = {}
+        self.waited = 0.0
+
+    @staticmethod
+    def fingerprint(authorization):
+        if authorization is None:
+            return None
+        if isinstance(authorization, str):
+            authorization = authorization.encode("utf-8")
+        return hashlib.sha256(authorization).hexdigest()[:12]
+
+    @classmethod
+    def credential(cls, request):
+        return cls.fingerprint(request.get_header("Authorization"))
+
+    @staticmethod
+    def resource(url):
+        path = urlparse(url).path
+        if path.endswith("/graphql"):
+            return "graphql"
+        if "/search/code" in path:
+            return "code_search"
+        if "/search/" in path:
+            return "search"
+        return "core"
+
+    def is_api(self, url):
+        """Whether url is one of the API, as opposed to a download."""
+        parsed = urlparse(url)
+        host, _, path = self.api_host.partition("/")
+        # GitHub Enterprise serves GraphQL from /api/graphql, next to /api/v3
+        return parsed.netloc == host and parsed.path.startswith(
+            "/api/" if path else "/"
+        )
+
+    def wait(self, request):
+        if not self.is_api(request.get_full_url()):
+            return
+        key = (self.credential(request), self.resource(request.get_full_url()))
+        with self._lock:
+            now = time.time()
+            start = max(now, self._blocked_until.get(key[0], 0))
+            state = self._limits.get(key)
+            if state is not None:
+                reset = state["reset"]
+                if state["remaining"] <= 0 and reset and reset > now:
+                    # Budget used up, nothing will succeed before the reset
+                    start = max(start, reset + 1)
+                elif self.throttle_limit and state["remaining"] <= self.throttle_limit:
+                    if reset:
+                        interval = max(0.0, reset - now) / max(state["remaining"], 1)
+                    else:
+                        interval = self.throttle_pause
+                    start = max(start, self._next_slot.get(key, 0))
+                    self._next_slot[key] = start + interval
+                # Count the request against the budget until the headers of
+                # a response tell the real numbers
+                state["remaining"] -= 1
+            delay = start - now
+            if delay > 0:
+                self.waited += delay
+
+        if delay > 0:
+            if delay >= 10:
+                logger.info(
+                    "Waiting {0:.0f} seconds for the {1} rate limit".format(
+                        delay, key[1]
+                    )
+                )
+            time.sleep(delay)
+
+    def budget(self, credential, resource):
+        """Requests left for a credential, infinite while nothing is known yet."""
+        with self._lock:
+            if self._blocked_until.get(credential, 0) > time.time():
+                return -1
+            state = self._limits.get((credential, resource))
+            if state is None or (state["reset"] and state["reset"] <= time.time()):
+                return float("inf")
+            return state["remaining"]
+
+    def update(self, request, headers):
+        remaining = headers.get("x-ratelimit-remaining")
+        if remaining is None:
+            return
+
+        resource = headers.get("x-ratelimit-resource") or self.resource(
+            request.get_full_url()
+        )
+        key = (self.credential(request), resource)
+        state = {
+            "limit": int(headers.get("x-ratelimit-limit") or 0),
+            "remaining": int(remaining),
+            "reset": int(headers.get("x-ratelimit-reset") or 0),
+            "used": int(headers.get("x-ratelimit-used") or 0),
+        }
+        with self._lock:
+            previous = self._limits.get(key)
+            if (
+                previous is not None
+                and previous["reset"] == state["reset"]
+                and state["used"] < previous["used"]
+            ):
+                # A response of a concurrent request arriving out of order,
+                # the numbers of the later one are more accurate
+                return
+            # The server's numbers replace the local estimate, which also
+            # counted requests that didn't count, like 304 responses
+            self._limits[key] = state
+
+    def should_retry(self, request, exc):
+        """Decide whether a failed request hit a rate limit and is worth retrying."""
+        if exc.code not in (403, 429):
+            return False
+
+        headers = exc.headers
+        credential = self.credential(request)
+        now = time.time()
+
+        retry_after = headers.get("Retry-After")
+        remaining = headers.get("x-ratelimit-remaining")
+        if retry_after:
+            try:
+                delay = max(1, int(retry_after))
+            except ValueError:
+                delay = 60
+            logger.warning(
+                "Secondary rate limit hit; waiting {0} seconds".format(delay)
+            )
+        elif remaining is not None and int(remaining) < 1:
+            # The X-RateLimit-Reset header includes a
+            # timestamp telling us when the limit will reset
+            # so we can calculate how long to wait rather
+            # than inefficiently polling:
+            reset = int(headers.get("x-ratelimit-reset") or 0) or now
+            # We'll never sleep for less than 10 seconds:
+            delay = max(10, reset - now)
+            logger.warning(
+                "Exceeded rate limit of {0} requests; waiting {1:.0f} seconds to reset".format(
+                    headers.get("x-ratelimit-limit"), delay
+                )
+            )
+            if credential is None:
+                logger.info("Hint: Authenticate to raise your GitHub rate limit")
+        elif exc.code == 429:
+            # Secondary rate limit without instructions, back off for a minute
+            delay = 60
+            logger.warning(
+                "Secondary rate limit hit; waiting {0} seconds".format(delay)
+            )
+        else:
+            return False
+
+        with self._lock:
+            self._blocked_until[credential] = max(
+                self._blocked_until.get(credential, 0), now + delay
+            )
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "waited": self.waited,
+                "limits": {key: dict(state) for key, state in self._limits.items()},
+            }
+
+
+rate_limit_governor = RateLimitGovernor()
+
+
+class ServerClock(object):
+    """
+    The time on GitHub's servers, from the Date header of the responses.
+
+    Incremental watermarks are compared with the timestamps GitHub sets on
+    issues and comments, so they are taken from its clock instead of the
+    local one, which can be off by more than a run takes.
+    """
+
+    def __init__(self):
+        self.offset = None
+
+    def update(self, headers):
+        date = headers.get("Date") if headers is not None else None
+        if not date:
+            return
+        try:
+            server_time = email.utils.parsedate_to_datetime(date).timestamp()
+        except (TypeError, ValueError):
+            return
+        self.offset = server_time - time.time()
+
+    def timestamp(self, overlap=0):
+        """The server time overlap seconds ago, formatted like updated_at."""
+        now = time.time() + (self.offset or 0) - overlap
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now))
+
+
+server_clock = ServerClock()
+
+
+class TokenPool(object):
+    """
+    Spreads API requests over several tokens to multiply the rate limit.
+
+    Requests for a repository are sent with the token that has the most
+    budget left for their rate limit resource, according to the
+    RateLimitGovernor. A token that gets a 401 is not used again. A token
+    that gets a 403 or 404 for a repository it never had access to is not
+    used for that repository again; one that did have access is only kept
+    off that endpoint (e.g. hooks without admin rights). Either way the
+    request is retried with the next token, and once every token was denied
+    the error is raised after a single request. Everything else, like
+    listing repositories or the authenticated user, always uses the first
+    token so the set of backed up repositories doesn't depend on which token
+    was picked.
+    """
+
+    def __init__(self, tokens, api_host):
+        self.tokens = tokens
+        host, _, prefix = api_host.partition("/")
+        self.api_host = host.lower()
+        self.api_prefix = "/" + prefix if prefix else ""
+        self._lock = threading.Lock()
+        self._denied = {}
+        self._granted = {}
+        self._accessible = {}
+        self._invalid = set()
+        for token in self.tokens:
+            token["requests"] = 0
+            token["credential"] = RateLimitGovernor.fingerprint(token["authorization"])
+
+    def _endpoint(self, request):
+        """(repository, endpoint) of a request, e.g. ("owner/repo", "hooks")."""
+        parsed = urlparse(request.get_full_url())
+        if (parsed.netloc or "").lower() != self.api_host:
+            return None, None
+        if not parsed.path.startswith(self.api_prefix + "/repos/"):
+            return None, None
+        parts = parsed.path[len(self.api_prefix) :].split("/")
+        if len(parts) < 4:
+            return None, None
+        endpoint = parts[4] if len(parts) > 4 else ""
+        return "{0}/{1}".format(parts[2], parts[3]).lower(), endpoint
+
+    def _repository(self, request):
+        return self._endpoint(request)[0]
+
+    def _unusable(self, repository, endpoint):
+        return (
+            self._denied.get((repository, None), set())
+            | self._denied.get((repository, endpoint), set())
+            | self._invalid
+        )
+
+    def authorize(self, request, exclude=()):
+        """Put the best token on request and return its index in tokens."""
+        repository, endpoint = self._endpoint(request)
+        if repository is None:
+            return None
+
+        with self._lock:
+            unusable = self._unusable(repository, endpoint)
+            invalid = set(self._invalid)
+        candidates = [
+            index
+            for index in range(len(self.tokens))
+            if index not in exclude and index not in unusable
+        ]
+        if not candidates:
+            # Every token was denied before, let the request fail with one
+            # of them rather than with whatever the request was sent with
+            candidates = [
+                index
+                for index in range(len(self.tokens))
+                if index not in exclude and index not in invalid
+            ]
+        if not candidates:
+            return None
+
+        resource = RateLimitGovernor.resource(request.get_full_url())
+        index = max(
+            candidates,
+            key=lambda i: rate_limit_governor.budget(
+                self.tokens[i]["credential"], resource
+            ),
+        )
+        token = self.tokens[index]
+        request.add_header("Authorization", token["authorization"])
+        with self._lock:
+            token["requests"] += 1
+        return index
+
+    def deny(self, request, exc, index):
+        """Remember a token that failed; True if another one is left to try."""
+        if exc.code not in (401, 403, 404):
+            return False
+
+        repository, endpoint = self._endpoint(request)
+        with self._lock:
+            if exc.code == 401:
+                if index not in self._invalid:
+                    logger.warning(
+                        "Token {0} was rejected, not using it anymore".format(
+                            self.tokens[index]["label"]
+                        )
+                    )
+                    self._invalid.add(index)
+            elif index in self._accessible.get(repository, ()):
+                # The token can see the repository, only this endpoint is off limits
+                self._denied.setdefault((repository, endpoint), set()).add(index)
+            else:
+                self._denied.setdefault((repository, None), set()).add(index)
+            return len(self._unusable(repository, endpoint)) < len(self.tokens)
+
+    def grant(self, request, index):
+        repository = self._repository(request)
+        with self._lock:
+            self._granted.setdefault(repository, index)
+            self._accessible.setdefault(repository, set()).add(index)
+
+    def clone_auth(self, full_name):
+        """Git credentials of a token known to have access to the repository."""
+        with self._lock:
+            index = self._granted.get(full_name.lower())
+        if index is None:
+            return None
+        return self.tokens[index]["clone_auth"]
+
+    def stats(self):
+        with self._lock:
+            return [
+                {
+                    "label": token["label"],
+                    "credential": token["credential"],
+                    "requests": token["requests"],
+                    "invalid": index in self._invalid,
+                }
+                for index, token in enumerate(self.tokens)
+            ]
+
+
+token_pool = None
+
+# Number of pages retrieve_data_gen fetches at once when the Link header
+# tells how many pages there are, see --page-window
+page_window = 1
+
+
+class RunStatistics(object):
+    """Thread-safe counters reported by log_run_statistics()."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def get(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+
+run_statistics = RunStatistics()
+
+
+class RetryableError(Exception):
+    """A failed request that may succeed when it is made again."""
+
+
+class RetryPolicy(object):
+    """
+    Retries transient failures with exponential backoff and jitter.
+
+    Server errors with one of the configured statuses, dropped or timed out
+    connections and truncated responses are retried up to max_retries times
+    per call, waiting a random time between 0 and base_delay * 2 ** attempt
+    (capped at max_delay) so concurrent workers don't retry in lockstep.
+    All calls of the run share a budget of retries; once it is spent,
+    failures are raised right away instead of dragging out a backup against
+    an API that is down. Rate limits are handled by the RateLimitGovernor.
+    """
+
+    def __init__(
+        self,
+        max_retries=5,
+        budget=200,
+        statuses=(500, 502, 503, 504),
+        base_delay=1.0,
+        max_delay=60.0,
+    ):
+        self.max_retries = max_retries
+        self.budget = budget
+        self.statuses = frozenset(statuses)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._spent = 0
+
+    # Dropped, reset or refused connections (including RemoteDisconnected)
+    # and timeouts; certificate or DNS failures won't go away by retrying
+    transient_errors = (ConnectionError, TimeoutError, socket.timeout)
+
+    def retryable(self, exc):
+        if isinstance(exc, HTTPError):
+            return exc.code in self.statuses
+        if isinstance(exc, URLError):
+            return isinstance(exc.reason, self.transient_errors)
+        return isinstance(
+            exc,
+            (RetryableError, IncompleteRead, json.decoder.JSONDecodeError)
+            + self.transient_errors,
+        )
+
+    def call(self, func, description, *args):
+        """Return func(*args), retrying it while it fails with a transient error."""
+        attempt = 0
+        while True:
+            try:
+                return func(*args)
+            except Exception as exc:
+                if not self.retryable(exc) or not self._spend(attempt):
+                    if self.retryable(exc):
+                        run_statistics.increment("retries_exhausted")
+                    raise
+                delay = random.uniform(
+                    0, min(self.max_delay, self.base_delay * 2**attempt)
+                )
+                logger.warning(
+                    "{0} failed ({1}), retrying in {2:.1f} seconds".format(
+                        description, self._reason(exc), delay
+                    )
+                )
+                run_statistics.increment("retries")
+                time.sleep(delay)
+                attempt += 1
+
+    def _spend(self, attempt):
+        if attempt >= self.max_retries:
+            return False
+        with self._lock:
+            if self._spent >= self.budget:
+                if self._spent == self.budget:
+                    logger.warning(
+                        "Retry budget of {0} retries used up, not retrying failed requests anymore".format(
+                            self.budget
+                        )
+                    )
+                    self._spent += 1
+                return False
+            self._spent += 1
+        return True
+
+    @staticmethod
+    def _reason(exc):
+        if isinstance(exc, HTTPError):
+            return "HTTP {0}".format(exc.code)
+        if isinstance(exc, URLError):
+            return str(exc.reason)
+        return str(exc) or type(exc).__name__
+
+
+retry_policy = RetryPolicy()
+
+
+class RequestSlots(object):
+    """
+    Caps the requests in flight across all threads of the run.
+
+    The async engine runs requests on several thread pools at once (pages,
+    sub-resources, details and attachments, for every --workers repository),
+    so the size of each pool doesn't bound them. Every API request and
+    download takes a slot from here until its response is read instead; a
+    limit of None leaves requests unbounded.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit) if limit else None
+
+    def run(self, func, *args):
+        """Return func(*args), called while holding a slot."""
+        if self._semaphore is None:
+            return func(*args)
+        with self._semaphore:
+            return func(*args)
+
+
+request_slots = RequestSlots()
+
+
+class _DecodingResponse(object):
+    """
+    Decompresses a gzip or deflate encoded API response while it is read.
+
+    Compressed chunks are inflated as they come off the socket, so the wire
+    body is never buffered in full next to the decoded one. Responses without
+    a Content-Encoding pass through untouched. Wire and decoded byte counts are
+    added to run_statistics either way.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, response):
+        self._response = response
+        self.headers = response.headers
+        self.reason = response.reason
+
+        encoding = (response.headers.get("Content-Encoding") or "").strip().lower()
+        if encoding in ("gzip", "x-gzip"):
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        elif encoding == "deflate":
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+        else:
+            self._decompressor = None
+        self._first_chunk = True
+        self._eof = False
+
+    def getcode(self):
+        return self._response.getcode()
+
+    def close(self):
+        self._response.close()
+
+    def read(self, amt=None):
+        if amt is None and self._decompressor is None:
+            data = self._response.read()
+            self._eof = True
+            run_statistics.increment("api_wire_bytes", len(data))
+            run_statistics.increment("api_decoded_bytes", len(data))
+            return data
+
+        if amt is None:
+            chunks = []
+            while True:
+                chunk = self._read_chunk(self.chunk_size)
+                if not chunk:
+                    return b"".join(chunks)
+                chunks.append(chunk)
+
+        # A compressed chunk can inflate to nothing, keep reading until it doesn't
+        while True:
+            chunk = self._read_chunk(amt)
+            if chunk or self._eof:
+                return chunk
+
+    def _read_chunk(self, amt):
+        if self._eof:
+            return b""
+
+        data = self._response.read(amt)
+        run_statistics.increment("api_wire_bytes", len(data))
+        if self._decompressor is None:
+            if not data:
+                self._eof = True
+            run_statistics.increment("api_decoded_bytes", len(data))
+            return data
+
+        if data:
+            decoded = self._decompress(data)
+        else:
+            self._eof = True
+            decoded = self._decompressor.flush()
+        run_statistics.increment("api_decoded_bytes", len(decoded))
+        return decoded
+
+    def _decompress(self, data):
+        if not self._first_chunk:
+            return self._decompressor.decompress(data)
+
+        self._first_chunk = False
+        try:
+            return self._decompressor.decompress(data)
+        except zlib.error:
+            # Some servers send raw deflate data without the zlib header
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decompressor.decompress(data)
+
+
 def logging_subprocess(
     popenargs, stdout_log_level=logging.DEBUG, stderr_log_level=logging.ERROR, **kwargs
 ):
@@ -205,7 +1194,7 @@ def parse_args(args=None):
         "--incremental-by-files",
         action="store_true",
         dest="incremental_by_files",
-        help="incremental backup based on modification date of files",
+        help="incremental backup based on the updated_at of the stored issues and pull requests",
     )
     parser.add_argument(
         "--starred",
@@ -451,14 +1440,133 @@ def parse_args(args=None):
         dest="throttle_limit",
         type=int,
         default=0,
-        help="start throttling of GitHub API requests after this amount of API requests remain",
+        help="start spreading GitHub API requests evenly over the rest of the rate limit window after this amount of API requests remain",
     )
     parser.add_argument(
         "--throttle-pause",
         dest="throttle_pause",
         type=float,
         default=30.0,
-        help="wait this amount of seconds when API request throttling is active (default: 30.0, requires --throttle-limit to be set)",
+        help="wait this amount of seconds between API requests when throttling is active and GitHub doesn't report when the rate limit resets (default: 30.0, requires --throttle-limit to be set)",
+    )
+    parser.add_argument(
+        "--bulk-events",
+        action="store_true",
+        dest="bulk_events",
+        help="retrieve issue events with one repository-wide listing instead of a request per issue, with --incremental the listing is only read back to the last run",
+    )
+    parser.add_argument(
+        "--api",
+        dest="api",
+        choices=["rest", "graphql"],
+        default="rest",
+        help="API used to back up issues and pull requests, graphql fetches them together with their comments, events and commits in far fewer requests (default: rest)",
+    )
+    parser.add_argument(
+        "--single-pass-issues",
+        action="store_true",
+        dest="single_pass_issues",
+        help="list open and closed issues at once, most recently updated first, with --incremental the listing stops at the first issue not updated since the last run",
+    )
+    parser.add_argument(
+        "--bulk-comments",
+        action="store_true",
+        dest="bulk_comments",
+        help="retrieve issue and pull request comments with repository-wide listings instead of requests per issue and pull request, with --incremental only comments changed since the last run are retrieved and merged into the stored files",
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        default=1,
+        help="number of repositories to back up in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--engine",
+        dest="engine",
+        choices=["sync", "async"],
+        default="sync",
+        help="request engine to use, the async engine fetches issue and pull request listings and their comments, events, commits, details and attachments concurrently (default: sync)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        dest="concurrency",
+        type=int,
+        default=8,
+        help="maximum number of API requests and downloads in flight at a time with the async engine, across all threads and --workers (default: 8)",
+    )
+    parser.add_argument(
+        "--http-cache",
+        action="store_true",
+        dest="http_cache",
+        help="cache API responses in OUTPUT_DIRECTORY/.http_cache and revalidate them with conditional requests, unchanged pages don't count against the rate limit",
+    )
+    parser.add_argument(
+        "--max-retries",
+        dest="max_retries",
+        type=int,
+        default=5,
+        help="number of times a request failing with a server error, timeout or dropped connection is retried, with exponential backoff (default: 5)",
+    )
+    parser.add_argument(
+        "--retry-budget",
+        dest="retry_budget",
+        type=int,
+        default=200,
+        help="total number of retries for the whole run, after which failing requests are not retried anymore (default: 200)",
+    )
+    parser.add_argument(
+        "--retry-statuses",
+        dest="retry_statuses",
+        default="500,502,503,504",
+        help="comma separated HTTP statuses to retry (default: 500,502,503,504)",
+    )
+    parser.add_argument(
+        "--page-window",
+        dest="page_window",
+        type=int,
+        default=1,
+        help="number of pages of a listing to fetch at once when GitHub reports the number of pages, 1 fetches them one after another (default: 1)",
+    )
+    parser.add_argument(
+        "--token-pool",
+        action="append",
+        dest="token_pool",
+        metavar="TOKEN",
+        help="additional classic or fine-grained token to spread API requests over, can be given multiple times, a file:// URI is read with one token per line",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        dest="resume",
+        help="keep a journal of the run in OUTPUT_DIRECTORY/journal.jsonl and continue the interrupted run it records, if any, skipping the repositories and resources it completed",
+    )
+    parser.add_argument(
+        "--storage",
+        dest="storage",
+        choices=["files", "sqlite"],
+        default="files",
+        help="store issues, pull requests, milestones, releases, labels and hooks as JSON files or in one SQLite database per repository (default: files)",
+    )
+    parser.add_argument(
+        "--compress",
+        dest="compress",
+        choices=["none", "gz", "xz"],
+        default="none",
+        help="compress the JSON files of issues, pull requests, milestones, releases, labels, hooks and the account with gzip or xz (default: none)",
+    )
+    parser.add_argument(
+        "--durability",
+        dest="durability",
+        choices=["none", "batch", "strict"],
+        default="none",
+        help="when written files are fsynced: never, in batches at the end of each repository, or each file as it is written (default: none)",
+    )
+    parser.add_argument(
+        "--export-json",
+        action="store_true",
+        dest="export_json",
+        help="write the JSON files of the SQLite databases in OUTPUT_DIRECTORY and exit",
     )
     parser.add_argument(
         "--exclude", dest="exclude", help="names of repositories to exclude", nargs="*"
@@ -466,10 +1574,81 @@ def parse_args(args=None):
     return parser.parse_args(args)
 
 
-def get_auth(args, encode=True, for_git_cli=False):
-    auth = None
+def configure_http(args, output_directory):
+    global http_cache, page_window, request_slots, token_pool
 
-    if args.osx_keychain_item_name:
+    rate_limit_governor.throttle_limit = args.throttle_limit
+    rate_limit_governor.throttle_pause = args.throttle_pause
+    rate_limit_governor.api_host = get_github_api_host(args)
+    page_window = max(1, args.page_window)
+    if args.engine == "async":
+        request_slots = RequestSlots(max(1, args.concurrency))
+    retry_policy.max_retries = args.max_retries
+    retry_policy.budget = args.retry_budget
+    retry_policy.statuses = frozenset(
+        int(status) for status in args.retry_statuses.split(",") if status.strip()
+    )
+
+    if args.http_cache:
+        http_cache = HTTPCache(os.path.join(output_directory, ".http_cache"))
+
+    if args.token_pool:
+        tokens = get_pool_tokens(args)
+        token_pool = TokenPool(tokens, get_github_api_host(args))
+        logger.info("Spreading API requests over {0} tokens".format(len(tokens)))
+
+
+def get_pool_tokens(args):
+    tokens = []
+    auth = get_auth(args, encode=not args.as_app)
+    if auth is not None:
+        tokens.append(
+            {
+                "authorization": _authorization_header(
+                    auth, args.as_app, args.token_fine is not None
+                ),
+                "clone_auth": get_clone_auth(args),
+            }
+        )
+
+    values = []
+    for value in args.token_pool:
+        if value.startswith(FILE_URI_PREFIX):
+            values.extend(read_file_lines(value))
+        else:
+            values.append(value.strip())
+
+    for value in values:
+        if value.startswith("github_pat_"):
+            tokens.append(
+                {
+                    "authorization": _authorization_header(value, fine=True),
+                    "clone_auth": "oauth2:" + value,
+                }
+            )
+        else:
+            auth = value + ":" + "x-oauth-basic"
+            tokens.append(
+                {
+                    "authorization": _authorization_header(
+                        base64.b64encode(auth.encode("ascii"))
+                    ),
+                    "clone_auth": auth,
+                }
+            )
+
+    unique = []
+    for token in tokens:
+        if token["authorization"] not in [t["authorization"] for t in unique]:
+            token["label"] = "#{0}".format(len(unique) + 1)
+            unique.append(token)
+    return unique
+
+
+def get_auth(args, encode=True, for_git_cli=False):
+    auth = None
+
+    if args.osx_keychain_item_name:
         if not args.osx_keychain_item_account:
             raise Exception(
                 "You must specify both name and account fields for osx keychain password items"
@@ -539,192 +1718,2039 @@ def get_auth(args, encode=True, for_git_cli=False):
     if not encode or args.token_fine is not None:
         return auth
 
-    return base64.b64encode(auth.encode("ascii"))
+    return base64.b64encode(auth.encode("ascii"))
+
+
+def get_github_api_host(args):
+    if args.github_host:
+        host = args.github_host + "/api/v3"
+    else:
+        host = "api.github.com"
+
+    return host
+
+
+def get_github_host(args):
+    if args.github_host:
+        host = args.github_host
+    else:
+        host = "github.com"
+
+    return host
+
+
+def read_file_contents(file_uri):
+    return open(file_uri[len(FILE_URI_PREFIX) :], "rt").readline().strip()
+
+
+def read_file_lines(file_uri):
+    with open(file_uri[len(FILE_URI_PREFIX) :], "rt") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def get_github_repo_url(args, repository):
+    if repository.get("is_gist"):
+        if args.prefer_ssh:
+            # The git_pull_url value is always https for gists, so we need to transform it to ssh form
+            repo_url = re.sub(
+                r"^https?:\/\/(.+)\/(.+)\.git$",
+                r"git@\1:\2.git",
+                repository["git_pull_url"],
+            )
+            repo_url = re.sub(
+                r"^git@gist\.", "git@", repo_url
+            )  # strip gist subdomain for better hostkey compatibility
+        else:
+            repo_url = repository["git_pull_url"]
+        return repo_url
+
+    if args.prefer_ssh:
+        return repository["ssh_url"]
+
+    auth = get_clone_auth(args)
+    if token_pool is not None:
+        auth = get_pool_clone_auth(args, repository) or auth
+    if auth:
+        repo_url = "https://{0}@{1}/{2}/{3}.git".format(
+            auth,
+            get_github_host(args),
+            repository["owner"]["login"],
+            repository["name"],
+        )
+    else:
+        repo_url = repository["clone_url"]
+
+    return repo_url
+
+
+def fetch_repository_of(args, repository, name, local_dir, wiki=False, **kwargs):
+    """
+    fetch_repository for repository, or its wiki. The clone URL is only
+    resolved here, as with a token pool that can take an API request.
+    """
+    remote_url = get_github_repo_url(args, repository)
+    if wiki:
+        remote_url = remote_url.replace(".git", ".wiki.git")
+    fetch_repository(name, remote_url, local_dir, **kwargs)
+
+
+def get_clone_auth(args):
+    auth = get_auth(args, encode=False, for_git_cli=True)
+    if auth and args.token_fine is not None:
+        return "oauth2:" + auth
+    return auth
+
+
+def get_pool_clone_auth(args, repository):
+    auth = token_pool.clone_auth(repository["full_name"])
+    if auth is None and repository.get("private"):
+        # no API request for this repository went through yet, ask for it
+        # so the pool finds out which token can see it
+        template = "https://{0}/repos/{1}".format(
+            get_github_api_host(args), repository["full_name"]
+        )
+        try:
+            retrieve_data(args, template, single_request=True)
+        except Exception:
+            return None
+        auth = token_pool.clone_auth(repository["full_name"])
+    return auth
+
+
+def retrieve_data_gen(args, template, query_args=None, single_request=False):
+    auth = get_auth(args, encode=not args.as_app)
+    query_args = get_query_args(query_args)
+    per_page = 100
+    next_url = None
+
+    while True:
+        if single_request:
+            request_per_page = None
+        else:
+            request_per_page = per_page
+
+        r, response = _fetch_page(
+            args, next_url or template, request_per_page, query_args, auth
+        )
+
+        if type(response) is list:
+            for resp in response:
+                yield resp
+            links = _parse_link_header(r.headers.get("Link", ""))
+            next_url = links.get("next")
+            if not next_url:
+                break
+            page_urls = _numbered_page_urls(next_url, links.get("last"))
+            if page_urls and page_window > 1:
+                yield from _fetch_pages(
+                    args, page_urls, request_per_page, query_args, auth
+                )
+                break
+        elif type(response) is dict and single_request:
+            yield response
+
+        if single_request:
+            break
+
+
+def _parse_link_header(link_header):
+    # <https://api.github.com/...?per_page=100&after=cursor>; rel="next", ...
+    links = {}
+    for link in link_header.split(","):
+        match = re.search(r'<([^>]*)>\s*;\s*rel="([^"]*)"', link)
+        if match:
+            links[match.group(2)] = match.group(1)
+    return links
+
+
+def _numbered_page_urls(next_url, last_url):
+    """
+    URLs of every page from next_url to last_url, or None if the endpoint
+    doesn't paginate by page number.
+
+    Cursor based endpoints (after=/before=) can only be walked one page at a
+    time, each page links to the next cursor.
+    """
+    if not last_url:
+        return None
+
+    next_parsed = urlparse(next_url)
+    next_query = parse_qsl(next_parsed.query, keep_blank_values=True)
+    last_query = dict(parse_qsl(urlparse(last_url).query, keep_blank_values=True))
+    next_keys = dict(next_query)
+    if "after" in next_keys or "before" in next_keys:
+        return None
+    try:
+        first_page = int(next_keys["page"])
+        last_page = int(last_query["page"])
+    except (KeyError, ValueError):
+        return None
+
+    urls = []
+    for page in range(first_page, last_page + 1):
+        query = [(k, str(page) if k == "page" else v) for k, v in next_query]
+        urls.append(next_parsed._replace(query=urlencode(query)).geturl())
+    return urls
+
+
+def _fetch_pages(args, page_urls, request_per_page, query_args, auth):
+    """
+    Fetch page_urls with up to page_window requests in flight, yielding the
+    items of each page in page order. The window starts at one page and
+    doubles with every page read, so a caller that stops after a page or
+    two, e.g. at updated_since, doesn't have a full window fetched for it.
+    """
+    repository = getattr(_log_context, "repository", None)
+    executor = ThreadPoolExecutor(max_workers=page_window)
+
+    def submit(url):
+        return executor.submit(
+            _run_with_log_context,
+            repository,
+            _fetch_page,
+            args,
+            url,
+            request_per_page,
+            query_args,
+            auth,
+        )
+
+    try:
+        urls = iter(page_urls)
+        window = 1
+        pending = [submit(next(urls))]
+        while pending:
+            yield from pending.pop(0).result()[1]
+            # Only schedule more pages once the caller read this one
+            window = min(page_window, window * 2)
+            for _, url in zip(range(window - len(pending)), urls):
+                pending.append(submit(url))
+    finally:
+        # also reached when the caller stops iterating early
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _fetch_page(args, url, request_per_page, query_args, auth):
+    return retry_policy.call(
+        request_slots.run,
+        url,
+        _fetch_page_once,
+        args,
+        url,
+        request_per_page,
+        query_args,
+        auth,
+    )
+
+
+def _fetch_page_once(args, url, request_per_page, query_args, auth):
+    request = _construct_request(
+        request_per_page,
+        query_args,
+        url,
+        auth,
+        as_app=args.as_app,
+        fine=True if args.token_fine is not None else False,
+    )  # noqa
+    request.add_header("Accept-Encoding", "gzip, deflate")
+    cache_entry = None
+    if http_cache is not None:
+        cache_entry = http_cache.add_conditional_headers(request)
+    r, errors = _get_response(request, auth, url)
+
+    status_code = int(r.getcode())
+
+    # Unchanged since the last run, replay the page from the HTTP cache
+    replayed = status_code == 304 and cache_entry is not None
+    if replayed:
+        r.close()
+        r = http_cache.replay(r, cache_entry)
+        status_code = int(r.getcode())
+
+    # Handle DMCA takedown (HTTP 451) - raise exception to skip entire repository
+    if status_code == 451:
+        dmca_url = None
+        try:
+            response_data = json.loads(r.read().decode("utf-8"))
+            dmca_url = response_data.get("block", {}).get("html_url")
+        except Exception:
+            pass
+        raise RepositoryUnavailableError(
+            "Repository unavailable due to legal reasons (HTTP 451)",
+            dmca_url=dmca_url
+        )
+
+    if status_code != 200:
+        template = "API request returned HTTP {0}: {1}"
+        errors.append(template.format(status_code, r.reason))
+        if status_code in retry_policy.statuses:
+            raise RetryableError(", ".join(errors))
+        raise Exception(", ".join(errors))
+
+    # Check if we got correct data
+    try:
+        body = r.read().decode("utf-8")
+        response = json_loads(body)
+    except (IncompleteRead, json.decoder.JSONDecodeError, TimeoutError) as exc:
+        template = "API request problem reading response for {0}: {1}"
+        errors.append(template.format(url, type(exc).__name__))
+        raise RetryableError(", ".join(errors))
+
+    if len(errors) > 0:
+        raise Exception(", ".join(errors))
+
+    if http_cache is not None and not replayed:
+        http_cache.store(request, r, body)
+
+    return r, response
+
+
+def retrieve_data(args, template, query_args=None, single_request=False):
+    return list(retrieve_data_gen(args, template, query_args, single_request))
+
+
+def retrieve_data_concurrently(args, calls):
+    """
+    Run retrieve_data for each (template, query_args) pair in calls.
+
+    The sync engine makes the calls one after another, the async engine runs
+    them concurrently. Results are returned in the order of calls either way.
+    """
+    if args.engine != "async":
+        return [
+            retrieve_data(args, template, query_args=query_args)
+            for template, query_args in calls
+        ]
+    return asyncio.run(_retrieve_data_async(args, calls))
+
+
+async def _retrieve_data_async(args, calls):
+    # urllib and the connection pool are blocking, so the requests run on a
+    # bounded thread pool and share retrieve_data_gen's pagination, HTTP 451
+    # and rate limit handling with the sync engine
+    loop = asyncio.get_running_loop()
+    repository = getattr(_log_context, "repository", None)
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        return await asyncio.gather(
+            *[
+                loop.run_in_executor(
+                    executor,
+                    _run_with_log_context,
+                    repository,
+                    retrieve_data,
+                    args,
+                    template,
+                    query_args,
+                )
+                for template, query_args in calls
+            ]
+        )
+
+
+def enrich_items(args, items, subresource_templates):
+    """
+    Attach sub-resources to each (number, item) pair of items and yield it.
+
+    subresource_templates(number) returns {key: template} for the
+    sub-resources of one item, e.g. {"comment_data": ".../issues/1/comments"}.
+    The sync engine fetches them item by item; the async engine fetches the
+    sub-resources of a window of items concurrently. Items are yielded in
+    their original order so the output is the same for both engines.
+    """
+    if args.engine != "async":
+        for number, item in items:
+            for key, template in subresource_templates(number).items():
+                item[key] = retrieve_data(args, template)
+            yield number, item
+        return
+
+    window = []
+    for number, item in items:
+        window.append((number, item))
+        if len(window) >= args.concurrency * 4:
+            yield from _enrich_window(args, window, subresource_templates)
+            window = []
+    yield from _enrich_window(args, window, subresource_templates)
+
+
+def _enrich_window(args, window, subresource_templates):
+    keys = []
+    calls = []
+    for number, item in window:
+        for key, template in subresource_templates(number).items():
+            keys.append((item, key))
+            calls.append((template, None))
+
+    if calls:
+        for (item, key), data in zip(keys, retrieve_data_concurrently(args, calls)):
+            item[key] = data
+    return window
+
+
+def process_items(args, items, func):
+    """
+    Call func(number, item) for each (number, item) pair of items and yield it.
+
+    func changes the item in place, e.g. replaces it with its details or
+    downloads its attachments. The sync engine calls it item by item; the
+    async engine runs it for up to args.concurrency * 4 items at a time on a
+    bounded thread pool while the listing is still being read. Items are
+    yielded in their original order either way.
+    """
+    if args.engine != "async":
+        for number, item in items:
+            func(number, item)
+            yield number, item
+        return
+
+    repository = getattr(_log_context, "repository", None)
+    pending = []
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        try:
+            for number, item in items:
+                future = executor.submit(
+                    _run_with_log_context, repository, func, number, item
+                )
+                pending.append((number, item, future))
+                if len(pending) >= args.concurrency * 4:
+                    number, item, future = pending.pop(0)
+                    future.result()
+                    yield number, item
+            for number, item, future in pending:
+                future.result()
+                yield number, item
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+
+
+def interleave_listings(args, listings):
+    """
+    Yield (index, item) for the items of each listing, index being the
+    position of the listing in listings.
+
+    The sync engine reads the listings one after another. The async engine
+    reads them concurrently, on a thread each, and yields the items in the
+    order they arrive; at most args.concurrency * 4 of them are buffered.
+    """
+    if args.engine != "async" or len(listings) < 2:
+        for index, listing in enumerate(listings):
+            for item in listing:
+                yield index, item
+        return
+
+    done = object()
+    buffered = queue.Queue(maxsize=args.concurrency * 4)
+    stopped = threading.Event()
+    repository = getattr(_log_context, "repository", None)
+
+    def put(entry):
+        # Give up once the consumer went away instead of blocking forever
+        while not stopped.is_set():
+            try:
+                buffered.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(index, listing):
+        try:
+            for item in listing:
+                if not put((index, item, None)):
+                    return
+        except Exception as exc:
+            put((index, done, exc))
+            return
+        put((index, done, None))
+
+    with ThreadPoolExecutor(max_workers=len(listings)) as executor:
+        try:
+            for index, listing in enumerate(listings):
+                executor.submit(_run_with_log_context, repository, read, index, listing)
+            remaining = len(listings)
+            while remaining:
+                index, item, exc = buffered.get()
+                if exc is not None:
+                    raise exc
+                if item is done:
+                    remaining -= 1
+                    continue
+                yield index, item
+        finally:
+            stopped.set()
+
+
+def newest_copies(items, seen):
+    """
+    Yield the (index, item) pairs of items, from interleave_listings, that
+    are newer than the copy of the same number yielded before.
+
+    An issue or pull request that changes state while it is listed shows up
+    in both the open and the closed listing. The copy updated last wins, or
+    the one of the later listing if they were updated at the same time, as
+    if the listings were read one after another. A copy that wins over one
+    yielded before is yielded again, so it is the one written last. seen
+    maps the numbers yielded to (updated_at, index).
+    """
+    for index, item in items:
+        key = (item["updated_at"], index)
+        number = item["number"]
+        if number in seen and seen[number] >= key:
+            continue
+        seen[number] = key
+        yield index, item
+
+
+def updated_since(args, items):
+    """Yield items of a listing sorted by updated_at, newest first, until args.since."""
+    for item in items:
+        if args.since and item["updated_at"] < args.since:
+            break
+        yield item
+
+
+def pull_shas(pull):
+    """The head and base commit of a pull request, None for either if unknown."""
+    return tuple((pull.get(ref) or {}).get("sha") for ref in ("head", "base"))
+
+
+def retrieve_comments_by_number(args, template, url_key):
+    """
+    Retrieve the repository-wide comment listing at template and group the
+    comments by the issue or pull request number found at their url_key.
+
+    One paginated stream replaces a request per issue or pull request. On
+    incremental runs only comments created or edited since the last run are
+    retrieved, see merge_by_id. Each group is sorted by id, the order
+    of the per-item listings.
+    """
+    query_args = {"sort": "updated", "direction": "asc"}
+    if args.since:
+        query_args["since"] = args.since
+
+    comments = {}
+    for comment in retrieve_data_gen(args, template, query_args=query_args):
+        number = int(comment[url_key].rstrip("/").rsplit("/", 1)[1])
+        comments.setdefault(number, []).append(comment)
+    for group in comments.values():
+        group.sort(key=lambda comment: comment["id"])
+    return comments
+
+
+def retrieve_events_by_number(args, template):
+    """
+    Retrieve the repository-wide issue event listing at template and group
+    the events by issue number.
+
+    The listing is newest first, so on incremental runs it is only read up
+    to the first event from before the last run. The "issue" each event
+    carries is dropped, events are stored like the per-issue listing
+    returns them, sorted by id.
+    """
+    events = {}
+    for event in retrieve_data_gen(args, template):
+        if args.since and event["created_at"] < args.since:
+            break
+        issue = event.pop("issue", None)
+        if issue is None:
+            continue
+        events.setdefault(issue["number"], []).append(event)
+    for group in events.values():
+        group.sort(key=lambda event: event["id"])
+    return events
+
+
+class ListingCache(object):
+    """
+    Repository-wide listings retrieved for one resource and needed again by
+    another, like the issue comments that backup_issues groups by number,
+    which hold the regular comments of pull requests as well. A listing is
+    kept for its repository until it's taken or the repository is done.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listings = {}
+
+    def put(self, repository, name, since, groups):
+        """Keep groups, the listing name retrieved from since on."""
+        with self._lock:
+            self._listings[(repository, name)] = (since, groups)
+
+    def take(self, repository, name, since):
+        """The groups kept as name if they cover everything since since."""
+        with self._lock:
+            kept = self._listings.pop((repository, name), None)
+        if kept is None:
+            return None
+        kept_since, groups = kept
+        if kept_since is not None and (since is None or since < kept_since):
+            return None
+        return groups
+
+    def discard(self, repository):
+        with self._lock:
+            for key in list(self._listings):
+                if key[0] == repository:
+                    del self._listings[key]
+
+
+listing_cache = ListingCache()
+
+
+def merge_by_id(stored, changed):
+    """
+    Items of stored replaced or extended by those in changed, by id. Items
+    without an id, like events written with --api graphql by earlier
+    versions, can't be matched and are kept ahead of the others.
+    """
+    items = {}
+    without_id = []
+    for item in list(stored or []) + list(changed):
+        if item.get("id") is None:
+            without_id.append(item)
+        else:
+            items[item["id"]] = item
+    return without_id + sorted(items.values(), key=lambda item: item["id"])
+
+
+def attach_bulk_subresources(args, store, number, item, bulk):
+    """
+    Attach the sub-resources of an issue or pull request retrieved with
+    repository-wide listings, bulk maps keys like "comment_data" to the
+    groups by number. On incremental runs the listings only hold what changed
+    since the last run, so those are merged into the item stored in store.
+    """
+    stored = {}
+    if bulk and args.since:
+        stored = store.get("{0}.json".format(number)) or {}
+    for key, groups in bulk.items():
+        item[key] = groups.get(number, [])
+        if args.since:
+            item[key] = merge_by_id(stored.get(key), item[key])
+
+
+def merge_bulk_subresources(store, bulk, attached):
+    """
+    Merge the groups of bulk into the issues or pull requests of store
+    that they weren't attached to by attach_bulk_subresources, because
+    they weren't updated themselves or were skipped. Numbers that weren't
+    stored before are ignored.
+    """
+    numbers = set()
+    for groups in bulk.values():
+        numbers.update(groups)
+    for number in sorted(numbers - attached):
+        name = "{0}.json".format(number)
+        stored = store.get(name)
+        if stored is None:
+            continue
+        for key, groups in bulk.items():
+            if number in groups:
+                stored[key] = merge_by_id(stored.get(key), groups[number])
+        store.put(name, stored)
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_directory(path):
+    # Directories can only be opened and synced on POSIX systems
+    if hasattr(os, "O_DIRECTORY"):
+        _fsync(path)
+
+
+class DurabilityPolicy(object):
+    """
+    When the files written by a backup are fsynced, set by --durability.
+
+    "none" leaves flushing them to the operating system, so a power loss
+    can leave files renamed into place but still empty. "strict" syncs
+    every file before it is renamed into place and its directory after.
+    "batch" only remembers the files written and syncs them, then their
+    directories, in one go by flush(), which runs at the end of every
+    repository. Progress that must not be recorded before the files it
+    covers are synced is deferred to the next flush() by once_synced().
+    """
+
+    # NORMAL can't corrupt a database in WAL mode, commits become durable
+    # at the checkpoint when the archive is closed after each resource
+    SQLITE_SYNCHRONOUS = {"none": "NORMAL", "batch": "NORMAL", "strict": "FULL"}
+
+    def __init__(self, mode="none"):
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._pending = []
+        # Deferred callbacks must wait for a concurrent flush too
+        self._flushing = threading.Lock()
+
+    def replace(self, temp_path, path):
+        """Rename the completely written temp_path to path."""
+        if self.mode == "strict":
+            _fsync(temp_path)
+        os.rename(temp_path, path)  # Atomic on POSIX systems
+        self.written(path, synced=True)
+
+    def written(self, path, synced=False):
+        """Note that path was written (or removed) in place."""
+        if self.mode == "strict":
+            if not synced and os.path.exists(path):
+                _fsync(path)
+            _fsync_directory(os.path.dirname(path))
+            run_statistics.increment("files_synced")
+        elif self.mode == "batch":
+            with self._lock:
+                self._dirty.add(path)
+
+    def once_synced(self, callback, *args):
+        """
+        Call callback(*args) once the files written so far are synced, at
+        the next flush() in batch mode and right away otherwise.
+        """
+        if self.mode != "batch":
+            return callback(*args)
+        with self._lock:
+            self._pending.append((callback, args))
+
+    def flush(self):
+        """Sync the files written since the last flush in batch mode."""
+        with self._flushing:
+            with self._lock:
+                paths, self._dirty = self._dirty, set()
+                pending, self._pending = self._pending, []
+            if paths:
+                self._sync(paths)
+            for callback, args in pending:
+                callback(*args)
+
+    def _sync(self, paths):
+        directories = set()
+        for path in sorted(paths):
+            try:
+                _fsync(path)
+            except FileNotFoundError:
+                pass  # removed since, syncing its directory persists that
+            directories.add(os.path.dirname(path))
+        for directory in sorted(directories):
+            _fsync_directory(directory)
+        run_statistics.increment("files_synced", len(paths))
+        run_statistics.increment("sync_batches")
+        logger.debug(
+            "Synced {0} files in {1} directories".format(len(paths), len(directories))
+        )
+
+    @property
+    def sqlite_synchronous(self):
+        return self.SQLITE_SYNCHRONOUS.get(self.mode, "NORMAL")
+
+
+durability = DurabilityPolicy()
+
+
+def write_item_file(item_file, item):
+    with codecs.open(item_file + ".temp", "w", encoding="utf-8") as f:
+        json_dump(item, f)
+    durability.replace(item_file + ".temp", item_file)
+
+
+class FileIndex(object):
+    """
+    The updated_at, sha256 and size of the JSON files in a directory, by
+    file name, kept in a .github-backup-index file next to them, named so
+    it doesn't match *.json. For .json.gz and .json.xz files these are of
+    the uncompressed content. Pull requests stored with their commits also
+    have their head and base sha as shas.
+
+    Lets --incremental-by-files decide whether an issue or pull request
+    changed without reading or stat-ing its file, json_dump_if_changed
+    whether a file changed and backup_pulls whether the stored commits of a
+    pull request can be kept without reading it. A missing or unreadable
+    index is rebuilt from the files in the directory, entries of files that
+    were removed are dropped when it's loaded.
+    """
+
+    name = ".github-backup-index"
+    # Written by earlier versions, picked up by globs for *.json
+    legacy_name = ".index.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, self.name)
+        try:
+            self._entries = read_json_file(self.path)
+        except ValueError:
+            self._entries = None
+        self._changed = False
+        if self._entries is None:
+            self.rebuild()
+        else:
+            self._drop_missing()
+
+    def _drop_missing(self):
+        # One listing of the directory instead of a stat per file
+        present = set(os.listdir(self.directory))
+        for name in [name for name in self._entries if name not in present]:
+            logger.debug("{0} was removed, dropping it from the index".format(name))
+            del self._entries[name]
+            self._changed = True
+
+    @staticmethod
+    def entry(content, updated_at=None, shas=None):
+        entry = {
+            "updated_at": updated_at,
+            "sha256": hashlib.sha256(content).hexdigest(),
+            "size": len(content),
+        }
+        if shas is not None:
+            entry["shas"] = shas
+        return entry
+
+    def rebuild(self):
+        self._entries = {}
+        for name in sorted(os.listdir(self.directory)):
+            if name == self.legacy_name or not any(
+                name.endswith(variant) for variant in json_file_variants(".json")
+            ):
+                continue
+            with open(os.path.join(self.directory, name), "rb") as f:
+                content = f.read()
+            try:
+                content = _decompress(content, name)
+            except (OSError, EOFError, lzma.LZMAError):
+                continue
+            try:
+                data = json_loads(content)
+            except ValueError:
+                continue
+            self._entries[name] = self.entry(
+                content, _updated_at(data), _commit_shas(data)
+            )
+        self._changed = True
+        if self._entries:
+            logger.info(
+                "Indexed {0} files in {1}".format(len(self._entries), self.directory)
+            )
+
+    def get(self, name):
+        return self._entries.get(name)
+
+    def holds(self, name, content):
+        """Whether the file name was written with content, going by its hash."""
+        entry = self._entries.get(name)
+        return bool(
+            entry
+            and entry["size"] == len(content)
+            and entry["sha256"] == hashlib.sha256(content).hexdigest()
+        )
+
+    def unchanged(self, name, updated_at):
+        """Whether the file name holds the item at updated_at or a later one."""
+        entry = self._entries.get(name)
+        return bool(entry and entry["updated_at"] and entry["updated_at"] >= updated_at)
+
+    def record(self, name, content, updated_at=None, shas=None):
+        self._entries[name] = self.entry(content, updated_at, shas)
+        self._changed = True
+
+    def discard(self, name):
+        if self._entries.pop(name, None) is not None:
+            self._changed = True
+
+    def save(self):
+        if self._changed:
+            write_item_file(self.path, self._entries)
+            self._changed = False
+            legacy_path = os.path.join(self.directory, self.legacy_name)
+            if os.path.exists(legacy_path):
+                os.remove(legacy_path)
+                durability.written(legacy_path)
+
+
+def _updated_at(data):
+    return data.get("updated_at") if isinstance(data, dict) else None
+
+
+def _commit_shas(data):
+    """The head and base sha of a pull request stored with its commits."""
+    if isinstance(data, dict) and "commit_data" in data and pull_shas(data)[0]:
+        return list(pull_shas(data))
+    return None
+
+
+class FileCollection(object):
+    """
+    The JSON files of one resource of a repository, e.g. its issues, stored
+    as name (like "1.json") in directory, compressed with compression ("gz"
+    or "xz") if given. See SQLiteCollection for the --storage sqlite
+    counterpart.
+    """
+
+    def __init__(self, directory, compression=None):
+        self.directory = directory
+        self.suffix = JSON_COMPRESSIONS.get(compression, "")
+        mkdir_p(directory)
+        self.index = FileIndex(directory)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + self.suffix)
+
+    def contains(self, name):
+        return any(
+            os.path.exists(variant)
+            for variant in json_file_variants(os.path.join(self.directory, name))
+        )
+
+    def get(self, name):
+        return read_json_file(os.path.join(self.directory, name))
+
+    def put(self, name, data):
+        """Store data as name, returns False if it was stored unchanged before."""
+        path = self._path(name)
+        written = json_dump_if_changed(data, path, self.index)
+        if written:
+            # Written with another compression before
+            for variant in json_file_variants(os.path.join(self.directory, name)):
+                if variant != path and os.path.exists(variant):
+                    os.remove(variant)
+                    durability.written(variant)
+                    self.index.discard(os.path.basename(variant))
+        return written
+
+    def unchanged(self, name, updated_at):
+        return self.index.unchanged(name + self.suffix, updated_at)
+
+    def commit_shas(self, name):
+        """The head and base sha of the pull request name stored with commits."""
+        entry = self.index.get(name + self.suffix) or {}
+        return tuple(entry["shas"]) if entry.get("shas") else None
+
+    def close(self):
+        self.index.save()
+
+
+SQLITE_ARCHIVE = "archive.sqlite3"
+
+
+class SQLiteCollection(object):
+    """
+    One resource of a repository stored in the repository's SQLite archive,
+    with --storage sqlite.
+
+    Every document is a row of the documents table holding the content of
+    the JSON file it replaces, so export_sqlite_archive() can write the
+    same files. Rows are only updated if their content changed, and are
+    committed every batch_size changes and on close().
+    """
+
+    batch_size = 500
+
+    def __init__(self, path, collection):
+        self.path = path
+        self.collection = collection
+        self._lock = threading.Lock()
+        self._updated_at = None
+        self._pending = 0
+        self.connection = open_sqlite_archive(path)
+
+    def contains(self, name):
+        return self._content(name) is not None
+
+    def _content(self, name):
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT content FROM documents WHERE collection = ? AND name = ?",
+                (self.collection, name),
+            ).fetchone()
+        return row[0] if row else None
+
+    def get(self, name):
+        content = self._content(name)
+        return json_loads(content) if content is not None else None
+
+    def put(self, name, data):
+        """Store data as name, returns False if it was stored unchanged before."""
+        content = json_dumps(data)
+        sha256 = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        with self._lock:
+            cursor = self.connection.execute(
+                "INSERT INTO documents (collection, name, updated_at, sha256, content)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (collection, name) DO UPDATE SET"
+                " updated_at = excluded.updated_at, sha256 = excluded.sha256,"
+                " content = excluded.content"
+                " WHERE documents.sha256 != excluded.sha256",
+                (self.collection, name, _updated_at(data), sha256, content),
+            )
+            written = cursor.rowcount > 0
+            if written:
+                if self._updated_at is not None:
+                    self._updated_at[name] = _updated_at(data)
+                self._pending += 1
+                if self._pending >= self.batch_size:
+                    self.connection.commit()
+                    self._pending = 0
+        return written
+
+    def unchanged(self, name, updated_at):
+        with self._lock:
+            if self._updated_at is None:
+                self._updated_at = dict(
+                    self.connection.execute(
+                        "SELECT name, updated_at FROM documents WHERE collection = ?",
+                        (self.collection,),
+                    )
+                )
+        stored = self._updated_at.get(name)
+        return bool(stored and stored >= updated_at)
+
+    def commit_shas(self, name):
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT json_extract(content, '$.head.sha'),"
+                " json_extract(content, '$.base.sha') FROM documents"
+                " WHERE collection = ? AND name = ?"
+                " AND json_type(content, '$.commit_data') IS NOT NULL",
+                (self.collection, name),
+            ).fetchone()
+        return tuple(row) if row and row[0] else None
+
+    def close(self):
+        with self._lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+def open_sqlite_archive(path):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = " + durability.sqlite_synchronous)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS documents ("
+        " collection TEXT NOT NULL,"
+        " name TEXT NOT NULL,"
+        " updated_at TEXT,"
+        " sha256 TEXT NOT NULL,"
+        " content TEXT NOT NULL,"
+        " PRIMARY KEY (collection, name)"
+        ") WITHOUT ROWID"
+    )
+    return connection
+
+
+def open_collection(args, repo_cwd, name):
+    """The store of the resource name of the repository backed up to repo_cwd."""
+    if args.storage == "sqlite":
+        mkdir_p(repo_cwd)
+        return SQLiteCollection(os.path.join(repo_cwd, SQLITE_ARCHIVE), name)
+    return FileCollection(os.path.join(repo_cwd, name), args.compress)
+
+
+def export_sqlite_archive(path, compression=None):
+    """
+    Write the documents of the SQLite archive at path as the JSON files
+    they replace, next to it, compressed with compression if given.
+    Returns the number of files written.
+    """
+    repo_cwd = os.path.dirname(path)
+    connection = open_sqlite_archive(path)
+    indexes = {}
+    written = 0
+    try:
+        rows = connection.execute(
+            "SELECT collection, name, updated_at, content FROM documents"
+            " ORDER BY collection, name"
+        )
+        for collection, name, updated_at, content in rows:
+            if collection not in indexes:
+                mkdir_p(os.path.join(repo_cwd, collection))
+                indexes[collection] = FileIndex(os.path.join(repo_cwd, collection))
+            output_file = os.path.join(repo_cwd, collection, name)
+            output_file += JSON_COMPRESSIONS.get(compression, "")
+            if write_if_changed(content, output_file, indexes[collection], updated_at):
+                written += 1
+    finally:
+        connection.close()
+    for index in indexes.values():
+        index.save()
+    return written
+
+
+def export_sqlite_archives(output_directory, compression=None):
+    """Export every SQLite archive below output_directory to JSON files."""
+    for directory, _, files in os.walk(output_directory):
+        if SQLITE_ARCHIVE in files:
+            path = os.path.join(directory, SQLITE_ARCHIVE)
+            written = export_sqlite_archive(path, compression)
+            logger.info("Exported {0} files from {1}".format(written, path))
+
+
+JSON_COMPRESSIONS = {"gz": ".gz", "xz": ".xz"}
+
+
+def json_file_variants(path):
+    """The names a JSON file path is stored under, uncompressed or compressed."""
+    return [path] + [path + suffix for suffix in JSON_COMPRESSIONS.values()]
+
+
+def open_json_file(path):
+    """Open the JSON file at path for reading, decompressing .gz and .xz files."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".xz"):
+        return lzma.open(path, "rt", encoding="utf-8")
+    return codecs.open(path, "r", encoding="utf-8")
+
+
+def read_json_file(path):
+    """
+    The JSON stored at path, or None if there is no such file. A .gz or .xz
+    compressed variant of path is read as well.
+    """
+    for variant in json_file_variants(path):
+        try:
+            with open_json_file(variant) as f:
+                return json_loads(f.read())
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def _decompress(content, path):
+    if path.endswith(".gz"):
+        return gzip.decompress(content)
+    if path.endswith(".xz"):
+        return lzma.decompress(content)
+    return content
+
+
+def _compress(content, path):
+    # mtime=0 keeps gzip output the same for the same content
+    if path.endswith(".gz"):
+        return gzip.compress(content, mtime=0)
+    if path.endswith(".xz"):
+        return lzma.compress(content)
+    return content
+
+
+def get_github_graphql_url(args):
+    if args.github_host:
+        return "https://{0}/api/graphql".format(args.github_host)
+    return "https://api.github.com/graphql"
+
+
+def graphql_query(args, query, variables):
+    """
+    Run a GraphQL query and return its data.
+
+    The query goes through the same rate limit governor, connection pool and
+    retry policy as REST requests. Queries are expected to ask for the
+    rateLimit field, whose cost and remaining points are recorded so that
+    the governor paces the graphql budget by points rather than requests.
+    """
+    url = get_github_graphql_url(args)
+    return retry_policy.call(
+        request_slots.run,
+        "GraphQL query to " + url,
+        _graphql_query_once,
+        args,
+        url,
+        query,
+        variables,
+    )
+
+
+def _graphql_query_once(args, url, query, variables):
+    auth = get_auth(args, encode=not args.as_app)
+    request = Request(
+        url,
+        data=json.dumps({"query": query, "variables": variables}).encode("utf-8"),
+        method="POST",
+    )
+    if auth is not None:
+        request.add_header(
+            "Authorization",
+            _authorization_header(auth, args.as_app, args.token_fine is not None),
+        )
+    request.add_header("Content-Type", "application/json")
+    request.add_header("Accept-Encoding", "gzip, deflate")
+    logger.info("Requesting {0} ({1})".format(url, _graphql_operation(query)))
+    r, errors = _get_response(request, auth, url)
+
+    status_code = int(r.getcode())
+    if status_code != 200:
+        errors.append(
+            "GraphQL request returned HTTP {0}: {1}".format(status_code, r.reason)
+        )
+        if status_code in retry_policy.statuses:
+            raise RetryableError(", ".join(errors))
+        raise Exception(", ".join(errors))
+
+    try:
+        payload = json_loads(r.read().decode("utf-8"))
+    except (IncompleteRead, json.decoder.JSONDecodeError, TimeoutError) as exc:
+        raise RetryableError(
+            "GraphQL request problem reading response: {0}".format(type(exc).__name__)
+        )
+
+    data = payload.get("data") or {}
+    rate_limit = data.get("rateLimit")
+    if rate_limit:
+        run_statistics.increment("graphql_cost", rate_limit["cost"])
+        reset = datetime.strptime(rate_limit["resetAt"], "%Y-%m-%dT%H:%M:%SZ")
+        rate_limit_governor.update(
+            request,
+            {
+                "x-ratelimit-resource": "graphql",
+                "x-ratelimit-limit": rate_limit["limit"],
+                "x-ratelimit-remaining": rate_limit["remaining"],
+                "x-ratelimit-used": rate_limit.get("used") or 0,
+                "x-ratelimit-reset": int(
+                    (reset - datetime(1970, 1, 1)).total_seconds()
+                ),
+            },
+        )
+
+    if payload.get("errors"):
+        messages = "; ".join(error.get("message", "") for error in payload["errors"])
+        if not payload.get("data"):
+            raise Exception("GraphQL request failed: {0}".format(messages))
+        # Partial results, e.g. for a team the token can't see
+        logger.warning("GraphQL request returned errors: {0}".format(messages))
+    return data
+
+
+def _graphql_operation(query):
+    match = re.search(r"query\s+(\w+)", query)
+    return match.group(1) if match else "query"
+
+
+GRAPHQL_RATE_LIMIT = "rateLimit { cost limit remaining resetAt used }"
+
+# Selections for the Actor interface and unions of actors; spreads are used
+# for every field as unions can't select fields directly
+GRAPHQL_ACTOR = """
+    __typename
+    ... on Actor { login avatarUrl url }
+    ... on Node { id }
+    ... on User { databaseId }
+    ... on Bot { databaseId }
+    ... on Organization { databaseId }
+    ... on Mannequin { databaseId }
+"""
+
+GRAPHQL_REVIEWER = """
+    __typename
+    ... on Actor { login avatarUrl url }
+    ... on Node { id }
+    ... on User { databaseId }
+    ... on Bot { databaseId }
+    ... on Mannequin { databaseId }
+    ... on Team { name slug }
+"""
+
+GRAPHQL_USER = "__typename login avatarUrl url id databaseId"
+
+GRAPHQL_REACTIONS = "reactionGroups { content reactors { totalCount } }"
+
+GRAPHQL_COMMENT = """
+    id databaseId body createdAt updatedAt url authorAssociation
+    author { %(actor)s }
+    %(reactions)s
+""" % {
+    "actor": GRAPHQL_ACTOR,
+    "reactions": GRAPHQL_REACTIONS,
+}
+
+GRAPHQL_REVIEW_COMMENT = """
+    id databaseId body diffHunk path
+    line originalLine startLine originalStartLine
+    createdAt updatedAt url authorAssociation
+    commit { oid } originalCommit { oid }
+    replyTo { databaseId } pullRequestReview { databaseId }
+    author { %(actor)s }
+    %(reactions)s
+""" % {
+    "actor": GRAPHQL_ACTOR,
+    "reactions": GRAPHQL_REACTIONS,
+}
+
+GRAPHQL_REVIEW_THREAD = "diffSide startDiffSide subjectType"
+
+GRAPHQL_GIT_ACTOR = "name email date user { %s }" % GRAPHQL_USER
+
+GRAPHQL_COMMIT = """
+    commit {
+        id oid message url authoredDate committedDate
+        author { %(git_actor)s }
+        committer { %(git_actor)s }
+        tree { oid }
+        parents(first: 10) { nodes { oid url } }
+    }
+""" % {"git_actor": GRAPHQL_GIT_ACTOR}
+
+# GraphQL timeline item type -> (REST issue event name, extra fields)
+GRAPHQL_EVENTS = {
+    "AssignedEvent": ("assigned", "assignee { %s }" % GRAPHQL_ACTOR),
+    "ClosedEvent": ("closed", "stateReason closer { ... on Commit { oid } }"),
+    "ConnectedEvent": ("connected", ""),
+    "ConvertedToDiscussionEvent": ("converted_to_discussion", ""),
+    "DemilestonedEvent": ("demilestoned", "milestoneTitle"),
+    "DisconnectedEvent": ("disconnected", ""),
+    "HeadRefDeletedEvent": ("head_ref_deleted", ""),
+    "HeadRefForcePushedEvent": (
+        "head_ref_force_pushed",
+        "beforeCommit { oid } afterCommit { oid }",
+    ),
+    "HeadRefRestoredEvent": ("head_ref_restored", ""),
+    "LabeledEvent": ("labeled", "label { name color }"),
+    "LockedEvent": ("locked", "lockReason"),
+    "MarkedAsDuplicateEvent": ("marked_as_duplicate", ""),
+    "MergedEvent": ("merged", "commit { oid }"),
+    "MilestonedEvent": ("milestoned", "milestoneTitle"),
+    "PinnedEvent": ("pinned", ""),
+    "ReferencedEvent": ("referenced", "commit { oid }"),
+    "RenamedTitleEvent": ("renamed", "previousTitle currentTitle"),
+    "ReopenedEvent": ("reopened", "stateReason"),
+    "ReviewDismissedEvent": (
+        "review_dismissed",
+        "dismissalMessage review { databaseId state }",
+    ),
+    "ReviewRequestRemovedEvent": (
+        "review_request_removed",
+        "requestedReviewer { %s }" % GRAPHQL_REVIEWER,
+    ),
+    "ReviewRequestedEvent": (
+        "review_requested",
+        "requestedReviewer { %s }" % GRAPHQL_REVIEWER,
+    ),
+    "TransferredEvent": ("transferred", "fromRepository { nameWithOwner }"),
+    "UnassignedEvent": ("unassigned", "assignee { %s }" % GRAPHQL_ACTOR),
+    "UnlabeledEvent": ("unlabeled", "label { name color }"),
+    "UnlockedEvent": ("unlocked", ""),
+    "UnmarkedAsDuplicateEvent": ("unmarked_as_duplicate", ""),
+    "UnpinnedEvent": ("unpinned", ""),
+}
+
+GRAPHQL_ISSUE_ONLY_EVENTS = {
+    "ConvertedToDiscussionEvent",
+    "PinnedEvent",
+    "TransferredEvent",
+    "UnpinnedEvent",
+}
+
+GRAPHQL_PULL_ONLY_EVENTS = {
+    "HeadRefDeletedEvent",
+    "HeadRefForcePushedEvent",
+    "HeadRefRestoredEvent",
+    "MergedEvent",
+    "ReviewDismissedEvent",
+    "ReviewRequestRemovedEvent",
+    "ReviewRequestedEvent",
+}
+
+
+def _graphql_event_selection(typename):
+    types = [
+        name
+        for name in sorted(GRAPHQL_EVENTS)
+        if name
+        not in (
+            GRAPHQL_ISSUE_ONLY_EVENTS
+            if typename == "PullRequest"
+            else GRAPHQL_PULL_ONLY_EVENTS
+        )
+    ]
+    fragments = " ".join(
+        "... on {0} {{ id createdAt actor {{ {1} }} {2} }}".format(
+            name, GRAPHQL_ACTOR, GRAPHQL_EVENTS[name][1]
+        )
+        for name in types
+    )
+    return (
+        "itemTypes: [{0}]".format(", ".join(_graphql_enum(name) for name in types)),
+        "__typename " + fragments,
+    )
+
 
+def _graphql_enum(typename):
+    # LabeledEvent -> LABELED_EVENT
+    words = re.findall(r"[A-Z][a-z]*", typename[: -len("Event")])
+    return "_".join(word.upper() for word in words) + "_EVENT"
 
-def get_github_api_host(args):
-    if args.github_host:
-        host = args.github_host + "/api/v3"
-    else:
-        host = "api.github.com"
 
-    return host
+GRAPHQL_ISSUE = """
+    id databaseId number title body state stateReason locked activeLockReason
+    createdAt updatedAt closedAt url authorAssociation
+    author { %(actor)s }
+    assignees(first: 10) { nodes { %(user)s } }
+    labels(first: 100) { nodes { id name color description isDefault } }
+    milestone {
+        id number title description state dueOn createdAt updatedAt
+        closedAt url creator { %(actor)s }
+    }
+    commentCount: comments { totalCount }
+    %(reactions)s
+""" % {
+    "actor": GRAPHQL_ACTOR,
+    "user": GRAPHQL_USER,
+    "reactions": GRAPHQL_REACTIONS,
+}
+
+GRAPHQL_PULL = """
+    id databaseId number title body state locked activeLockReason
+    createdAt updatedAt closedAt mergedAt url authorAssociation isDraft
+    author { %(actor)s }
+    assignees(first: 10) { nodes { %(user)s } }
+    labels(first: 100) { nodes { id name color description isDefault } }
+    milestone {
+        id number title description state dueOn createdAt updatedAt
+        closedAt url creator { %(actor)s }
+    }
+    reviewRequests(first: 20) {
+        nodes { requestedReviewer { %(reviewer)s } }
+    }
+    headRefName headRefOid baseRefName baseRefOid
+    headRepository { nameWithOwner } headRepositoryOwner { login }
+    mergeCommit { oid }
+    commentCount: comments { totalCount }
+    %(reactions)s
+""" % {
+    "actor": GRAPHQL_ACTOR,
+    "user": GRAPHQL_USER,
+    "reviewer": GRAPHQL_REVIEWER,
+    "reactions": GRAPHQL_REACTIONS,
+}
+
+GRAPHQL_PULL_DETAILS = """
+    merged mergeable maintainerCanModify additions deletions changedFiles
+    mergedBy { %(actor)s }
+    commitCount: commits { totalCount }
+""" % {"actor": GRAPHQL_ACTOR}
+
+GRAPHQL_PAGE = "pageInfo { hasNextPage endCursor } nodes { %s }"
+
+# Nested connections are fetched along with their issue or pull request,
+# remaining pages of the few busy ones are fetched separately
+GRAPHQL_ISSUES_PER_PAGE = 25
+GRAPHQL_NESTED_PER_PAGE = 50
+
+
+def _graphql_connections(typename, comments, events, review_comments, commits):
+    """Selections of the nested connections of an issue or pull request."""
+    selections = {}
+    if comments:
+        selections["comments"] = ("", GRAPHQL_COMMENT)
+    if events:
+        selections["timelineItems"] = _graphql_event_selection(typename)
+    if review_comments:
+        selections["reviewThreads"] = (
+            "",
+            "id %s comments(first: %d) { %s }"
+            % (
+                GRAPHQL_REVIEW_THREAD,
+                GRAPHQL_NESTED_PER_PAGE,
+                GRAPHQL_PAGE % GRAPHQL_REVIEW_COMMENT,
+            ),
+        )
+    if commits:
+        selections["commits"] = ("", GRAPHQL_COMMIT)
+    return selections
 
 
-def get_github_host(args):
-    if args.github_host:
-        host = args.github_host
-    else:
-        host = "github.com"
+def _graphql_connection_query(field, arguments, selection, per_page, after=None):
+    arguments = ["first: {0}".format(per_page)] + ([arguments] if arguments else [])
+    if after:
+        arguments.append("after: $cursor")
+    return "{0}({1}) {{ {2} }}".format(
+        field, ", ".join(arguments), GRAPHQL_PAGE % selection
+    )
 
-    return host
 
+def retrieve_graphql_items(args, repository, typename, connections, details=False):
+    """
+    Yield every issue or pull request of repository with the nodes of its
+    nested connections, most recently updated first.
 
-def read_file_contents(file_uri):
-    return open(file_uri[len(FILE_URI_PREFIX) :], "rt").readline().strip()
+    typename is "Issue" or "PullRequest", connections maps nested connection
+    fields to their (arguments, selection) as built by _graphql_connections.
+    Nested connections with more pages than fit in the listing query are
+    completed with additional queries before the item is yielded.
+    """
+    owner, name = repository["full_name"].split("/", 1)
+    listing = "issues" if typename == "Issue" else "pullRequests"
+    fields = GRAPHQL_ISSUE if typename == "Issue" else GRAPHQL_PULL
+    if details:
+        fields += GRAPHQL_PULL_DETAILS
+    nested = " ".join(
+        _graphql_connection_query(field, arguments, selection, GRAPHQL_NESTED_PER_PAGE)
+        for field, (arguments, selection) in sorted(connections.items())
+    )
 
+    filter_by = ""
+    variables = {"owner": owner, "name": name, "cursor": None}
+    if typename == "Issue" and args.since:
+        filter_by = ", filterBy: {since: $since}"
+        variables["since"] = args.since
+
+    query = """
+        query BackupItems($owner: String!, $name: String!, $cursor: String%(since_var)s) {
+            %(rate_limit)s
+            repository(owner: $owner, name: $name) {
+                %(listing)s(first: %(per_page)d, after: $cursor,
+                        orderBy: {field: UPDATED_AT, direction: DESC}%(filter_by)s) {
+                    pageInfo { hasNextPage endCursor }
+                    nodes { %(fields)s %(nested)s }
+                }
+            }
+        }
+    """ % {
+        "since_var": ", $since: DateTime" if filter_by else "",
+        "rate_limit": GRAPHQL_RATE_LIMIT,
+        "listing": listing,
+        "per_page": GRAPHQL_ISSUES_PER_PAGE,
+        "filter_by": filter_by,
+        "fields": fields,
+        "nested": nested,
+    }
 
-def get_github_repo_url(args, repository):
-    if repository.get("is_gist"):
-        if args.prefer_ssh:
-            # The git_pull_url value is always https for gists, so we need to transform it to ssh form
-            repo_url = re.sub(
-                r"^https?:\/\/(.+)\/(.+)\.git$",
-                r"git@\1:\2.git",
-                repository["git_pull_url"],
+    while True:
+        data = graphql_query(args, query, variables)
+        if not data.get("repository"):
+            raise Exception(
+                "GraphQL request failed: repository {0} not found".format(
+                    repository["full_name"]
+                )
             )
-            repo_url = re.sub(
-                r"^git@gist\.", "git@", repo_url
-            )  # strip gist subdomain for better hostkey compatibility
+        page = data["repository"][listing]
+        for node in page["nodes"]:
+            if args.since and node["updatedAt"] < args.since:
+                return
+            for field, (arguments, selection) in connections.items():
+                node[field] = _graphql_complete_connection(
+                    args,
+                    typename,
+                    node["id"],
+                    field,
+                    arguments,
+                    selection,
+                    node[field],
+                )
+            if "reviewThreads" in node:
+                for thread in node["reviewThreads"]:
+                    thread["comments"] = _graphql_complete_connection(
+                        args,
+                        "PullRequestReviewThread",
+                        thread["id"],
+                        "comments",
+                        "",
+                        GRAPHQL_REVIEW_COMMENT,
+                        thread["comments"],
+                    )
+            yield node
+        if not page["pageInfo"]["hasNextPage"]:
+            return
+        variables["cursor"] = page["pageInfo"]["endCursor"]
+
+
+def _graphql_complete_connection(
+    args, typename, node_id, field, arguments, selection, connection
+):
+    """Return all nodes of connection, fetching the pages after the first one."""
+    nodes = list(connection["nodes"])
+    page_info = connection["pageInfo"]
+    if not page_info["hasNextPage"]:
+        return nodes
+
+    query = """
+        query BackupConnection($id: ID!, $cursor: String) {
+            %(rate_limit)s
+            node(id: $id) { ... on %(typename)s { %(connection)s } }
+        }
+    """ % {
+        "rate_limit": GRAPHQL_RATE_LIMIT,
+        "typename": typename,
+        "connection": _graphql_connection_query(
+            field, arguments, selection, 100, after=True
+        ),
+    }
+    variables = {"id": node_id, "cursor": page_info["endCursor"]}
+    while page_info["hasNextPage"]:
+        data = graphql_query(args, query, variables)
+        page = data["node"][field]
+        nodes.extend(page["nodes"])
+        page_info = page["pageInfo"]
+        variables["cursor"] = page_info["endCursor"]
+    return nodes
+
+
+# Conversion of GraphQL nodes to the REST API's JSON, so that backups made
+# with --api graphql have the same layout as those made with the REST API.
+# Fields GraphQL doesn't expose (mostly derived URLs) are omitted, ids of
+# types without databaseId are decoded from their node ID.
+
+REACTION_CONTENT = {
+    "THUMBS_UP": "+1",
+    "THUMBS_DOWN": "-1",
+    "LAUGH": "laugh",
+    "HOORAY": "hooray",
+    "CONFUSED": "confused",
+    "HEART": "heart",
+    "ROCKET": "rocket",
+    "EYES": "eyes",
+}
+
+LOCK_REASONS = {
+    "OFF_TOPIC": "off-topic",
+    "TOO_HEATED": "too heated",
+    "RESOLVED": "resolved",
+    "SPAM": "spam",
+}
+
+
+def _lower(value):
+    return value.lower() if value else value
+
+
+def _database_id(node_id):
+    """
+    The REST id a GraphQL node ID encodes, or None. Legacy IDs are base64
+    of "012:LabeledEvent1234", current ones a type prefix and base64 of a
+    MessagePack array of integers ending with it, like "LE_lADO...".
+    """
+    if not node_id:
+        return None
+    prefix, _, encoded = node_id.partition("_")
+    try:
+        if not encoded:
+            legacy = base64.b64decode(node_id, validate=True).decode("ascii")
+            match = re.match(r"\d+:[A-Za-z]+(\d+)$", legacy)
+            return int(match.group(1)) if match else None
+        data = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not data or data[0] & 0xF0 != 0x90:
+        return None
+    value = None
+    position = 1
+    for _ in range(data[0] & 0x0F):
+        if position >= len(data):
+            return None
+        marker = data[position]
+        if marker < 0x80:
+            value, position = marker, position + 1
+        elif 0xCC <= marker <= 0xCF:
+            # unsigned integers of 1, 2, 4 and 8 bytes
+            size = 1 << (marker - 0xCC)
+            value = int.from_bytes(data[position + 1 : position + 1 + size], "big")
+            position += 1 + size
         else:
-            repo_url = repository["git_pull_url"]
-        return repo_url
+            return None
+    return value
 
-    if args.prefer_ssh:
-        return repository["ssh_url"]
 
-    auth = get_auth(args, encode=False, for_git_cli=True)
-    if auth:
-        repo_url = "https://{0}@{1}/{2}/{3}.git".format(
-            auth if args.token_fine is None else "oauth2:" + auth,
-            get_github_host(args),
-            repository["owner"]["login"],
-            repository["name"],
+def _rest_user(actor, api_base):
+    if not actor:
+        return None
+    user = {
+        "login": actor["login"],
+        "id": actor.get("databaseId"),
+        "node_id": actor.get("id"),
+        "avatar_url": actor.get("avatarUrl"),
+        "url": "{0}/users/{1}".format(api_base, actor["login"]),
+        "html_url": actor.get("url"),
+        "type": actor.get("__typename"),
+    }
+    return user
+
+
+def _rest_reactions(node, url):
+    reactions = {"url": url + "/reactions", "total_count": 0}
+    for content in REACTION_CONTENT.values():
+        reactions[content] = 0
+    for group in node.get("reactionGroups") or []:
+        content = REACTION_CONTENT.get(group["content"])
+        if content:
+            count = group["reactors"]["totalCount"]
+            reactions[content] = count
+            reactions["total_count"] += count
+    return reactions
+
+
+def _rest_labels(node, repo_url):
+    return [
+        {
+            "id": _database_id(label["id"]),
+            "node_id": label["id"],
+            "url": "{0}/labels/{1}".format(repo_url, urlquote(label["name"])),
+            "name": label["name"],
+            "color": label["color"],
+            "default": label.get("isDefault", False),
+            "description": label.get("description"),
+        }
+        for label in node["labels"]["nodes"]
+    ]
+
+
+def _rest_milestone(milestone, repo_url, api_base):
+    if not milestone:
+        return None
+    return {
+        "url": "{0}/milestones/{1}".format(repo_url, milestone["number"]),
+        "html_url": milestone["url"],
+        "node_id": milestone["id"],
+        "number": milestone["number"],
+        "title": milestone["title"],
+        "description": milestone["description"],
+        "creator": _rest_user(milestone.get("creator"), api_base),
+        "state": _lower(milestone["state"]),
+        "created_at": milestone["createdAt"],
+        "updated_at": milestone["updatedAt"],
+        "due_on": milestone["dueOn"],
+        "closed_at": milestone["closedAt"],
+    }
+
+
+def _rest_issue_fields(node, repo_url, api_base, kind):
+    url = "{0}/{1}/{2}".format(repo_url, kind, node["number"])
+    issue_url = "{0}/issues/{1}".format(repo_url, node["number"])
+    assignees = [_rest_user(a, api_base) for a in node["assignees"]["nodes"]]
+    return {
+        "url": url,
+        "html_url": node["url"],
+        "comments_url": issue_url + "/comments",
+        "id": node["databaseId"],
+        "node_id": node["id"],
+        "number": node["number"],
+        "title": node["title"],
+        "user": _rest_user(node["author"], api_base),
+        "labels": _rest_labels(node, repo_url),
+        "state": "closed" if node["state"] != "OPEN" else "open",
+        "locked": node["locked"],
+        "assignee": assignees[0] if assignees else None,
+        "assignees": assignees,
+        "milestone": _rest_milestone(node["milestone"], repo_url, api_base),
+        "created_at": node["createdAt"],
+        "updated_at": node["updatedAt"],
+        "closed_at": node["closedAt"],
+        "author_association": node["authorAssociation"],
+        "active_lock_reason": LOCK_REASONS.get(node["activeLockReason"]),
+        "body": node["body"],
+        "reactions": _rest_reactions(node, issue_url),
+    }
+
+
+def graphql_issue_to_rest(node, repo_url, api_base):
+    """Convert an Issue or PullRequest node to an item of the REST issues list."""
+    issue = _rest_issue_fields(node, repo_url, api_base, "issues")
+    issue["repository_url"] = repo_url
+    issue["labels_url"] = issue["url"] + "/labels{/name}"
+    issue["events_url"] = issue["url"] + "/events"
+    issue["comments"] = node["commentCount"]["totalCount"]
+    issue["state_reason"] = _lower(node.get("stateReason"))
+    if "mergedAt" in node:
+        pull_url = "{0}/pulls/{1}".format(repo_url, node["number"])
+        issue["pull_request"] = {
+            "url": pull_url,
+            "html_url": node["url"],
+            "diff_url": node["url"] + ".diff",
+            "patch_url": node["url"] + ".patch",
+            "merged_at": node["mergedAt"],
+        }
+        issue["draft"] = node["isDraft"]
+    return issue
+
+
+def graphql_pull_to_rest(node, repo_url, api_base, details=False):
+    """Convert a PullRequest node to an item of the REST pulls list."""
+    pull = _rest_issue_fields(node, repo_url, api_base, "pulls")
+    pull.update(
+        {
+            "diff_url": node["url"] + ".diff",
+            "patch_url": node["url"] + ".patch",
+            "issue_url": "{0}/issues/{1}".format(repo_url, node["number"]),
+            "commits_url": pull["url"] + "/commits",
+            "review_comments_url": pull["url"] + "/comments",
+            "statuses_url": "{0}/statuses/{1}".format(repo_url, node["headRefOid"]),
+            "merged_at": node["mergedAt"],
+            "merge_commit_sha": (node.get("mergeCommit") or {}).get("oid"),
+            "draft": node["isDraft"],
+            "head": _rest_ref(
+                node["headRefName"],
+                node["headRefOid"],
+                node.get("headRepositoryOwner"),
+                node.get("headRepository"),
+            ),
+            "base": _rest_ref(
+                node["baseRefName"],
+                node["baseRefOid"],
+                {"login": repo_url.split("/")[-2]},
+                {"nameWithOwner": "/".join(repo_url.split("/")[-2:])},
+            ),
+        }
+    )
+    reviewers = [
+        request["requestedReviewer"]
+        for request in node["reviewRequests"]["nodes"]
+        if request.get("requestedReviewer")
+    ]
+    pull["requested_reviewers"] = [
+        _rest_user(r, api_base) for r in reviewers if "login" in r
+    ]
+    pull["requested_teams"] = [
+        {"name": r["name"], "slug": r["slug"]} for r in reviewers if "slug" in r
+    ]
+    if details:
+        pull.update(
+            {
+                "merged": node["merged"],
+                "mergeable": {"MERGEABLE": True, "CONFLICTING": False}.get(
+                    node["mergeable"]
+                ),
+                "merged_by": _rest_user(node.get("mergedBy"), api_base),
+                "maintainer_can_modify": node["maintainerCanModify"],
+                "comments": node["commentCount"]["totalCount"],
+                "commits": node["commitCount"]["totalCount"],
+                "additions": node["additions"],
+                "deletions": node["deletions"],
+                "changed_files": node["changedFiles"],
+            }
         )
-    else:
-        repo_url = repository["clone_url"]
+    return pull
 
-    return repo_url
 
+def _rest_ref(ref, sha, owner, repository):
+    login = owner["login"] if owner else None
+    return {
+        "label": "{0}:{1}".format(login, ref) if login else ref,
+        "ref": ref,
+        "sha": sha,
+        "user": {"login": login} if login else None,
+        "repo": {"full_name": repository["nameWithOwner"]} if repository else None,
+    }
 
-def retrieve_data_gen(args, template, query_args=None, single_request=False):
-    auth = get_auth(args, encode=not args.as_app)
-    query_args = get_query_args(query_args)
-    per_page = 100
-    next_url = None
 
-    while True:
-        if single_request:
-            request_per_page = None
-        else:
-            request_per_page = per_page
+def graphql_comment_to_rest(node, repo_url, api_base, number):
+    url = "{0}/issues/comments/{1}".format(repo_url, node["databaseId"])
+    return {
+        "url": url,
+        "html_url": node["url"],
+        "issue_url": "{0}/issues/{1}".format(repo_url, number),
+        "id": node["databaseId"],
+        "node_id": node["id"],
+        "user": _rest_user(node["author"], api_base),
+        "created_at": node["createdAt"],
+        "updated_at": node["updatedAt"],
+        "author_association": node["authorAssociation"],
+        "body": node["body"],
+        "reactions": _rest_reactions(node, url),
+    }
 
-        request = _construct_request(
-            request_per_page,
-            query_args,
-            next_url or template,
-            auth,
-            as_app=args.as_app,
-            fine=True if args.token_fine is not None else False,
-        )  # noqa
-        r, errors = _get_response(request, auth, next_url or template)
 
-        status_code = int(r.getcode())
+def graphql_review_comment_to_rest(node, thread, repo_url, api_base, number):
+    url = "{0}/pulls/comments/{1}".format(repo_url, node["databaseId"])
+    comment = {
+        "url": url,
+        "pull_request_review_id": (node.get("pullRequestReview") or {}).get(
+            "databaseId"
+        ),
+        "id": node["databaseId"],
+        "node_id": node["id"],
+        "diff_hunk": node["diffHunk"],
+        "path": node["path"],
+        "position": None,
+        "original_position": None,
+        "commit_id": (node.get("commit") or {}).get("oid"),
+        "original_commit_id": (node.get("originalCommit") or {}).get("oid"),
+        "user": _rest_user(node["author"], api_base),
+        "body": node["body"],
+        "created_at": node["createdAt"],
+        "updated_at": node["updatedAt"],
+        "html_url": node["url"],
+        "pull_request_url": "{0}/pulls/{1}".format(repo_url, number),
+        "author_association": node["authorAssociation"],
+        "reactions": _rest_reactions(node, url),
+        "start_line": node["startLine"],
+        "original_start_line": node["originalStartLine"],
+        "start_side": thread.get("startDiffSide"),
+        "line": node["line"],
+        "original_line": node["originalLine"],
+        "side": thread.get("diffSide"),
+        "subject_type": _lower(thread.get("subjectType")),
+    }
+    if node.get("replyTo"):
+        comment["in_reply_to_id"] = node["replyTo"]["databaseId"]
+    return comment
 
-        # Handle DMCA takedown (HTTP 451) - raise exception to skip entire repository
-        if status_code == 451:
-            dmca_url = None
-            try:
-                response_data = json.loads(r.read().decode("utf-8"))
-                dmca_url = response_data.get("block", {}).get("html_url")
-            except Exception:
-                pass
-            raise RepositoryUnavailableError(
-                "Repository unavailable due to legal reasons (HTTP 451)",
-                dmca_url=dmca_url
-            )
 
-        # Check if we got correct data
-        try:
-            response = json.loads(r.read().decode("utf-8"))
-        except IncompleteRead:
-            logger.warning("Incomplete read error detected")
-            read_error = True
-        except json.decoder.JSONDecodeError:
-            logger.warning("JSON decode error detected")
-            read_error = True
-        except TimeoutError:
-            logger.warning("Tiemout error detected")
-            read_error = True
+def graphql_event_to_rest(node, repo_url, api_base, number):
+    typename = node.get("__typename")
+    if typename not in GRAPHQL_EVENTS:
+        return None
+    event_id = _database_id(node["id"])
+    event = {
+        "id": event_id,
+        "node_id": node["id"],
+        "url": "{0}/issues/events/{1}".format(repo_url, event_id) if event_id else None,
+        "actor": _rest_user(node.get("actor"), api_base),
+        "event": GRAPHQL_EVENTS[typename][0],
+        "commit_id": None,
+        "commit_url": None,
+        "created_at": node["createdAt"],
+        "performed_via_github_app": None,
+    }
+    commit = node.get("commit") or node.get("closer") or {}
+    if commit.get("oid"):
+        event["commit_id"] = commit["oid"]
+        event["commit_url"] = "{0}/commits/{1}".format(repo_url, commit["oid"])
+    if "label" in node:
+        event["label"] = node["label"]
+    if "assignee" in node:
+        event["assignee"] = _rest_user(node["assignee"], api_base)
+    if "milestoneTitle" in node:
+        event["milestone"] = {"title": node["milestoneTitle"]}
+    if "currentTitle" in node:
+        event["rename"] = {"from": node["previousTitle"], "to": node["currentTitle"]}
+    if "lockReason" in node:
+        event["lock_reason"] = LOCK_REASONS.get(node["lockReason"])
+    if "stateReason" in node:
+        event["state_reason"] = _lower(node["stateReason"])
+    if "requestedReviewer" in node:
+        reviewer = node["requestedReviewer"] or {}
+        if "slug" in reviewer:
+            event["requested_team"] = {
+                "name": reviewer["name"],
+                "slug": reviewer["slug"],
+            }
         else:
-            read_error = False
+            event["requested_reviewer"] = _rest_user(reviewer, api_base)
+    if "review" in node:
+        event["dismissed_review"] = {
+            "state": _lower((node["review"] or {}).get("state")),
+            "review_id": (node["review"] or {}).get("databaseId"),
+            "dismissal_message": node["dismissalMessage"],
+        }
+    return event
+
+
+def graphql_commit_to_rest(node, repo_url, api_base):
+    commit = node["commit"]
+    git_actor = {}
+    for role in ("author", "committer"):
+        actor = commit.get(role) or {}
+        git_actor[role] = {
+            "name": actor.get("name"),
+            "email": actor.get("email"),
+            "date": actor.get("date"),
+        }
+    return {
+        "sha": commit["oid"],
+        "node_id": commit["id"],
+        "commit": {
+            "author": git_actor["author"],
+            "committer": git_actor["committer"],
+            "message": commit["message"],
+            "tree": {
+                "sha": commit["tree"]["oid"],
+                "url": "{0}/git/trees/{1}".format(repo_url, commit["tree"]["oid"]),
+            },
+            "url": "{0}/git/commits/{1}".format(repo_url, commit["oid"]),
+        },
+        "url": "{0}/commits/{1}".format(repo_url, commit["oid"]),
+        "html_url": commit["url"],
+        "comments_url": "{0}/commits/{1}/comments".format(repo_url, commit["oid"]),
+        "author": _rest_user((commit.get("author") or {}).get("user"), api_base),
+        "committer": _rest_user((commit.get("committer") or {}).get("user"), api_base),
+        "parents": [
+            {
+                "sha": parent["oid"],
+                "url": "{0}/commits/{1}".format(repo_url, parent["oid"]),
+                "html_url": parent["url"],
+            }
+            for parent in commit["parents"]["nodes"]
+        ],
+    }
 
-        # be gentle with API request limit and throttle requests if remaining requests getting low
-        limit_remaining = int(r.headers.get("x-ratelimit-remaining", 0))
-        if args.throttle_limit and limit_remaining <= args.throttle_limit:
-            logger.info(
-                "API request limit hit: {} requests left, pausing further requests for {}s".format(
-                    limit_remaining, args.throttle_pause
-                )
-            )
-            time.sleep(args.throttle_pause)
-
-        retries = 0
-        while retries < 3 and (status_code == 502 or read_error):
-            logger.warning("API request failed. Retrying in 5 seconds")
-            retries += 1
-            time.sleep(5)
-            request = _construct_request(
-                request_per_page,
-                query_args,
-                next_url or template,
-                auth,
-                as_app=args.as_app,
-                fine=True if args.token_fine is not None else False,
-            )  # noqa
-            r, errors = _get_response(request, auth, next_url or template)
-
-            status_code = int(r.getcode())
-            try:
-                response = json.loads(r.read().decode("utf-8"))
-                read_error = False
-            except IncompleteRead:
-                logger.warning("Incomplete read error detected")
-                read_error = True
-            except json.decoder.JSONDecodeError:
-                logger.warning("JSON decode error detected")
-                read_error = True
-            except TimeoutError:
-                logger.warning("Tiemout error detected")
-                read_error = True
-
-        if status_code != 200:
-            template = "API request returned HTTP {0}: {1}"
-            errors.append(template.format(status_code, r.reason))
-            raise Exception(", ".join(errors))
-
-        if read_error:
-            template = "API request problem reading response for {0}"
-            errors.append(template.format(request))
-            raise Exception(", ".join(errors))
-
-        if len(errors) == 0:
-            if type(response) is list:
-                for resp in response:
-                    yield resp
-                # Parse Link header for next page URL (cursor-based pagination)
-                link_header = r.headers.get("Link", "")
-                next_url = None
-                if link_header:
-                    # Parse Link header: <https://api.github.com/...?per_page=100&after=cursor>; rel="next"
-                    for link in link_header.split(","):
-                        if 'rel="next"' in link:
-                            next_url = link[link.find("<") + 1:link.find(">")]
-                            break
-                if not next_url:
-                    break
-            elif type(response) is dict and single_request:
-                yield response
 
-        if len(errors) > 0:
-            raise Exception(", ".join(errors))
+def _graphql_events(node, repo_url, api_base):
+    events = [
+        graphql_event_to_rest(item, repo_url, api_base, node["number"])
+        for item in node["timelineItems"]
+    ]
+    return [event for event in events if event is not None]
 
-        if single_request:
-            break
 
+def retrieve_issues_graphql(args, repository, repos_template, include_pulls):
+    """
+    The issues of repository as written by backup_issues, from GraphQL.
 
-def retrieve_data(args, template, query_args=None, single_request=False):
-    return list(retrieve_data_gen(args, template, query_args, single_request))
+    Yields issues with comment_data and event_data attached as
+    requested. Unless include_pulls is set, pull requests are included too
+    as the REST issues list does.
+    """
+    repo_url = "{0}/{1}".format(repos_template, repository["full_name"])
+    api_base = repos_template[: -len("/repos")]
+    comments = args.include_issue_comments or args.include_everything
+    events = args.include_issue_events or args.include_everything
+
+    typenames = ["Issue"] if include_pulls else ["Issue", "PullRequest"]
+    for typename in typenames:
+        connections = _graphql_connections(typename, comments, events, False, False)
+        for node in retrieve_graphql_items(args, repository, typename, connections):
+            issue = graphql_issue_to_rest(node, repo_url, api_base)
+            if comments:
+                issue["comment_data"] = [
+                    graphql_comment_to_rest(c, repo_url, api_base, node["number"])
+                    for c in node["comments"]
+                ]
+            if events:
+                issue["event_data"] = _graphql_events(node, repo_url, api_base)
+            yield issue
+
+
+def retrieve_pulls_graphql(args, repository, repos_template):
+    """
+    The pull requests of repository as written by backup_pulls, from GraphQL.
+
+    Yields pull requests with comment_regular_data, comment_data and
+    commit_data attached as requested.
+    """
+    repo_url = "{0}/{1}".format(repos_template, repository["full_name"])
+    api_base = repos_template[: -len("/repos")]
+    comments = args.include_pull_comments or args.include_everything
+    commits = args.include_pull_commits or args.include_everything
+    details = bool(args.include_pull_details)
+
+    connections = _graphql_connections(
+        "PullRequest", comments, False, comments, commits
+    )
+    for node in retrieve_graphql_items(
+        args, repository, "PullRequest", connections, details=details
+    ):
+        number = node["number"]
+        pull = graphql_pull_to_rest(node, repo_url, api_base, details=details)
+        if comments:
+            pull["comment_regular_data"] = [
+                graphql_comment_to_rest(c, repo_url, api_base, number)
+                for c in node["comments"]
+            ]
+            review_comments = [
+                graphql_review_comment_to_rest(c, thread, repo_url, api_base, number)
+                for thread in node["reviewThreads"]
+                for c in thread["comments"]
+            ]
+            pull["comment_data"] = sorted(review_comments, key=lambda c: c["id"])
+        if commits:
+            pull["commit_data"] = [
+                graphql_commit_to_rest(c, repo_url, api_base) for c in node["commits"]
+            ]
+        yield pull
 
 
 def get_query_args(query_args=None):
@@ -734,33 +3760,29 @@ def get_query_args(query_args=None):
 
 
 def _get_response(request, auth, template):
-    retry_timeout = 3
     errors = []
-    # We'll make requests in a loop so we can
-    # delay and retry in the case of rate-limiting
-    while True:
-        should_continue = False
-        try:
-            r = urlopen(request, context=https_ctx)
-        except HTTPError as exc:
-            errors, should_continue = _request_http_error(exc, auth, errors)  # noqa
-            r = exc
-        except URLError as e:
-            logger.warning(e.reason)
-            should_continue, retry_timeout = _request_url_error(template, retry_timeout)
-            if not should_continue:
-                raise
-        except socket.error as e:
-            logger.warning(e.strerror)
-            should_continue, retry_timeout = _request_url_error(template, retry_timeout)
-            if not should_continue:
-                raise
+    try:
+        r = http_open(request)
+    except HTTPError as exc:
+        # HTTPError behaves like a Response so we can
+        # check the status code and headers to see exactly
+        # what failed.
+        r = _buffered_error(exc)
+    return _DecodingResponse(r), errors
 
-        if should_continue:
-            continue
 
-        break
-    return r, errors
+def _buffered_error(exc):
+    """
+    exc with its body read and closed, so the connection behind it is
+    released now instead of whenever the error is garbage collected.
+    """
+    try:
+        body = exc.read()
+    except (HTTPException, OSError):
+        body = b""
+    finally:
+        exc.close()
+    return HTTPError(exc.url, exc.code, exc.reason, exc.headers, BytesIO(body))
 
 
 def _construct_request(
@@ -788,14 +3810,8 @@ def _construct_request(
 
     request = Request(request_url)
     if auth is not None:
-        if not as_app:
-            if fine:
-                request.add_header("Authorization", "token " + auth)
-            else:
-                request.add_header("Authorization", "Basic ".encode("ascii") + auth)
-        else:
-            auth = auth.encode("ascii")
-            request.add_header("Authorization", "token ".encode("ascii") + auth)
+        request.add_header("Authorization", _authorization_header(auth, as_app, fine))
+        if as_app:
             request.add_header(
                 "Accept", "application/vnd.github.machine-man-preview+json"
             )
@@ -807,50 +3823,48 @@ def _construct_request(
     return request
 
 
-def _request_http_error(exc, auth, errors):
-    # HTTPError behaves like a Response so we can
-    # check the status code and headers to see exactly
-    # what failed.
+def _authorization_header(auth, as_app=False, fine=False):
+    if not as_app:
+        if fine:
+            return "token " + auth
+        return "Basic ".encode("ascii") + auth
+    return "token ".encode("ascii") + auth.encode("ascii")
 
-    should_continue = False
-    headers = exc.headers
-    limit_remaining = int(headers.get("x-ratelimit-remaining", 0))
 
-    if exc.code == 403 and limit_remaining < 1:
-        # The X-RateLimit-Reset header includes a
-        # timestamp telling us when the limit will reset
-        # so we can calculate how long to wait rather
-        # than inefficiently polling:
-        gm_now = calendar.timegm(time.gmtime())
-        reset = int(headers.get("x-ratelimit-reset", 0)) or gm_now
-        # We'll never sleep for less than 10 seconds:
-        delta = max(10, reset - gm_now)
+def http_open(request, redirect_handler=None):
+    """
+    Open request through the rate limit governor and the connection pool.
 
-        limit = headers.get("x-ratelimit-limit")
-        logger.warning(
-            "Exceeded rate limit of {} requests; waiting {} seconds to reset".format(
-                limit, delta
+    Every API request and download goes through here, so waits for primary
+    and secondary rate limits are shared by all threads of the run.
+    """
+    denied = set()
+    while True:
+        token = None
+        if token_pool is not None:
+            token = token_pool.authorize(request, exclude=denied)
+        rate_limit_governor.wait(request)
+        try:
+            response = connection_pool.urlopen(
+                request, redirect_handler=redirect_handler
             )
-        )  # noqa
-
-        if auth is None:
-            logger.info("Hint: Authenticate to raise your GitHub rate limit")
-
-        time.sleep(delta)
-        should_continue = True
-    return errors, should_continue
-
-
-def _request_url_error(template, retry_timeout):
-    # In case of a connection timing out, we can retry a few time
-    # But we won't crash and not back-up the rest now
-    logger.info("'{}' timed out".format(template))
-    retry_timeout -= 1
-
-    if retry_timeout >= 0:
-        return True, retry_timeout
-
-    raise Exception("'{}' timed out to much, skipping!".format(template))
+        except HTTPError as exc:
+            rate_limit_governor.update(request, exc.headers)
+            server_clock.update(exc.headers)
+            if rate_limit_governor.should_retry(request, exc):
+                run_statistics.increment("rate_limit_retries")
+                exc.close()
+                continue
+            if token is not None and token_pool.deny(request, exc, token):
+                denied.add(token)
+                exc.close()
+                continue
+            raise
+        rate_limit_governor.update(request, response.headers)
+        server_clock.update(response.headers)
+        if token is not None:
+            token_pool.grant(request, token)
+        return response
 
 
 class S3HTTPRedirectHandler(HTTPRedirectHandler):
@@ -885,18 +3899,28 @@ def download_file(url, path, auth, as_app=False, fine=False):
         fine=fine,
     )
     request.add_header("Accept", "application/octet-stream")
-    opener = build_opener(S3HTTPRedirectHandler)
+    # Only complete downloads are renamed to path, which is skipped next time
+    temp_path = path + ".temp"
 
-    try:
-        response = opener.open(request)
+    def download():
+        response = http_open(request, redirect_handler=S3HTTPRedirectHandler())
 
         chunk_size = 16 * 1024
-        with open(path, "wb") as f:
+        size = 0
+        with open(temp_path, "wb") as f:
             while True:
                 chunk = response.read(chunk_size)
                 if not chunk:
                     break
                 f.write(chunk)
+                size += len(chunk)
+        _check_length(response, size)
+        durability.replace(temp_path, path)
+
+    try:
+        retry_policy.call(
+            request_slots.run, "Download of asset {0}".format(url), download
+        )
     except HTTPError as exc:
         # Gracefully handle 404 responses (and others) when downloading from S3
         logger.warning(
@@ -911,12 +3935,26 @@ def download_file(url, path, auth, as_app=False, fine=False):
         )
     except socket.error as e:
         # Gracefully handle socket errors
-        # TODO: Implement retry logic
         logger.warning(
             "Skipping download of asset {0} due to socker error: {1}".format(
                 url, e.strerror
             )
         )
+    except IncompleteRead as e:
+        logger.warning(
+            "Skipping download of asset {0}, {1} bytes missing".format(url, e.expected)
+        )
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _check_length(response, size):
+    """Raise IncompleteRead if fewer than the Content-Length bytes were read."""
+    # http.client ends a body cut off by a dropped connection silently
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit() and size < int(length):
+        raise IncompleteRead(b"", int(length) - size)
 
 
 def download_attachment_file(url, path, auth, as_app=False, fine=False):
@@ -983,13 +4021,11 @@ def download_attachment_file(url, path, auth, as_app=False, fine=False):
             auth = auth.encode("ascii")
             request.add_header("Authorization", "token ".encode("ascii") + auth)
 
-    # Reuse S3HTTPRedirectHandler from download_file()
-    opener = build_opener(S3HTTPRedirectHandler)
-
     temp_path = path + ".temp"
 
-    try:
-        response = opener.open(request)
+    def download():
+        # Reuse S3HTTPRedirectHandler from download_file()
+        response = http_open(request, redirect_handler=S3HTTPRedirectHandler())
         metadata["http_status"] = response.getcode()
 
         # Extract Content-Type
@@ -1036,11 +4072,17 @@ def download_attachment_file(url, path, auth, as_app=False, fine=False):
                     break
                 f.write(chunk)
                 bytes_downloaded += len(chunk)
+        _check_length(response, bytes_downloaded)
 
         # Atomic rename to final location
-        os.rename(temp_path, path)
+        durability.replace(temp_path, path)
 
         metadata["size_bytes"] = bytes_downloaded
+
+    try:
+        retry_policy.call(
+            request_slots.run, "Download of attachment {0}".format(url), download
+        )
         metadata["success"] = True
 
     except HTTPError as exc:
@@ -1070,6 +4112,7 @@ def download_attachment_file(url, path, auth, as_app=False, fine=False):
         logger.warning(
             "Skipping download of attachment {0} due to error: {1}".format(url, str(e))
         )
+    finally:
         # Clean up temp file if it was partially created
         if os.path.exists(temp_path):
             try:
@@ -1460,6 +4503,8 @@ def download_attachments(
                 # Rename to add extension (already atomic from download)
                 try:
                     os.rename(filepath, final_filepath)
+                    durability.written(filepath)
+                    durability.written(final_filepath, synced=True)
                     metadata["saved_as"] = os.path.basename(final_filepath)
                 except Exception as e:
                     logger.warning(
@@ -1490,7 +4535,7 @@ def download_attachments(
         manifest_path = os.path.join(attachments_dir, "manifest.json")
         with open(manifest_path + ".temp", "w") as f:
             json.dump(manifest, f, indent=2)
-            os.rename(manifest_path + ".temp", manifest_path)  # Atomic write
+        durability.replace(manifest_path + ".temp", manifest_path)
         logger.debug(
             "Wrote manifest for {0} #{1}: {2} attachments".format(
                 item_type_display, number, len(attachment_metadata_list)
@@ -1602,48 +4647,211 @@ def filter_repositories(args, unfiltered_repositories):
     if args.name_regex:
         name_regex = re.compile(args.name_regex)
 
-    languages = None
-    if args.languages:
-        languages = [x.lower() for x in args.languages]
+    languages = None
+    if args.languages:
+        languages = [x.lower() for x in args.languages]
+
+    if not args.fork:
+        repositories = [r for r in repositories if not r.get("fork")]
+    if not args.private:
+        repositories = [
+            r for r in repositories if not r.get("private") or r.get("public")
+        ]
+    if languages:
+        repositories = [
+            r
+            for r in repositories
+            if r.get("language") and r.get("language").lower() in languages
+        ]  # noqa
+    if name_regex:
+        repositories = [
+            r for r in repositories if "name" not in r or name_regex.match(r["name"])
+        ]
+    if args.skip_archived:
+        repositories = [r for r in repositories if not r.get("archived")]
+    if args.exclude:
+        repositories = [
+            r for r in repositories if "name" not in r or r["name"] not in args.exclude
+        ]
+
+    return repositories
+
+
+class Journal(object):
+    """
+    Append-only record of a run in journal.jsonl in the output directory.
+
+    The first line holds the repositories the run backs up, followed by a
+    line for every (repository, resource) it completed and a last line once
+    the run finished. An interrupted run can be resumed from it without
+    listing the repositories again or repeating what was completed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.repositories = None
+        self.done = set()
+        self._load()
+
+    def _load(self):
+        try:
+            f = codecs.open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # cut off by the interruption
+                if "repositories" in record:
+                    self.repositories = record["repositories"]
+                    self.done = set()
+                elif "finished" in record:
+                    self.repositories = None
+                else:
+                    self.done.add((record["repository"], record["resource"]))
+
+    def _append(self, record, mode="a"):
+        with self._lock:
+            with codecs.open(self.path, mode, encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            durability.written(self.path, synced=False)
+
+    def start(self, repositories):
+        self.repositories = repositories
+        self.done = set()
+        now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        self._append({"started": now, "repositories": repositories}, mode="w")
+
+    def completed(self, repository, resource):
+        return (repository, resource) in self.done
+
+    def complete(self, repository, resource):
+        self.done.add((repository, resource))
+        self._append({"repository": repository, "resource": resource})
+
+    def finish(self):
+        now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        self._append({"finished": now})
+
+
+journal = None
+
+
+def open_journal(args, output_directory):
+    """
+    Set up the journal of this run, only kept with --resume. Its
+    repositories are those of the interrupted run to continue, if any.
+    """
+    global journal
+    if not args.resume:
+        journal = None
+        return journal
+    durability.mode = args.durability
+    journal = Journal(os.path.join(output_directory, "journal.jsonl"))
+    if journal.repositories is None:
+        logger.info("No interrupted run to resume, starting a new one")
+    else:
+        logger.info(
+            "Resuming the interrupted run of {0} repositories ({1} resources completed)".format(
+                len(journal.repositories), len(journal.done)
+            )
+        )
+    return journal
+
+
+def backup_unit(repository, resource, backup, *backup_args, **backup_kwargs):
+    """
+    Run backup(*backup_args, **backup_kwargs) unless the journal has
+    resource of repository as completed, and record it once it is.
+    """
+    label = _repository_label(repository)
+    if journal is not None and journal.completed(label, resource):
+        logger.info("Skipping {0} of {1}, completed before".format(resource, label))
+        return
+    backup(*backup_args, **backup_kwargs)
+    if journal is not None:
+        durability.once_synced(journal.complete, label, resource)
+
+
+class WatermarkStore(object):
+    """
+    High-water marks of incremental backups, per repository and resource.
+
+    Stored as {full_name: {resource: timestamp}} in a JSON file of the output
+    directory. A mark is the time the resource's last successful backup
+    started on GitHub's clock, less OVERLAP seconds for changes that were
+    still being written then, so the next run only requests what changed
+    since then.
+    """
+
+    OVERLAP = 60
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._marks = read_json_file(path) or {}
+
+    def get(self, repository, resource, default=None):
+        return self._marks.get(repository, {}).get(resource, default)
+
+    def advance(self, repository, resource, mark):
+        """Record mark for resource once its data is written, and save the store."""
+        with self._lock:
+            marks = self._marks.setdefault(repository, {})
+            if mark > marks.get(resource, ""):
+                marks[resource] = mark
+                write_item_file(self.path, self._marks)
+
+
+watermark_store = None
 
-    if not args.fork:
-        repositories = [r for r in repositories if not r.get("fork")]
-    if not args.private:
-        repositories = [
-            r for r in repositories if not r.get("private") or r.get("public")
-        ]
-    if languages:
-        repositories = [
-            r
-            for r in repositories
-            if r.get("language") and r.get("language").lower() in languages
-        ]  # noqa
-    if name_regex:
-        repositories = [
-            r for r in repositories if "name" not in r or name_regex.match(r["name"])
-        ]
-    if args.skip_archived:
-        repositories = [r for r in repositories if not r.get("archived")]
-    if args.exclude:
-        repositories = [
-            r for r in repositories if "name" not in r or r["name"] not in args.exclude
-        ]
 
-    return repositories
+def backup_incrementally(args, resource, repo_cwd, repository, backup, *backup_args):
+    """
+    Run backup(args, *backup_args) with args.since set to the watermark of
+    resource for repository, and advance the watermark once it completed
+    and its files are synced.
+
+    A resource without a watermark is backed up completely, unless its
+    directory was written by a version that kept one last_update for all
+    repositories; that one is used then.
+    """
+    if not args.incremental or watermark_store is None:
+        return backup(args, *backup_args)
+
+    started = server_clock.timestamp(overlap=WatermarkStore.OVERLAP)
+    since = None
+    if os.path.isdir(os.path.join(repo_cwd, resource)):
+        since = args.since
+    resource_args = copy.copy(args)
+    resource_args.since = watermark_store.get(repository["full_name"], resource, since)
+    backup(resource_args, *backup_args)
+    durability.once_synced(
+        watermark_store.advance, repository["full_name"], resource, started
+    )
 
 
 def backup_repositories(args, output_directory, repositories):
     logger.info("Backing up repositories")
     repos_template = "https://{0}/repos".format(get_github_api_host(args))
 
+    global watermark_store
+    durability.mode = args.durability
     if args.incremental:
         last_update_path = os.path.join(output_directory, "last_update")
         if os.path.exists(last_update_path):
             args.since = open(last_update_path).read().strip()
         else:
             args.since = None
+        watermark_store = WatermarkStore(
+            os.path.join(output_directory, "watermarks.json")
+        )
     else:
         args.since = None
+        watermark_store = None
 
     last_update = "0000-00-00T00:00:00Z"
     for repository in repositories:
@@ -1652,99 +4860,248 @@ def backup_repositories(args, output_directory, repositories):
         elif "pushed_at" in repository and repository["pushed_at"] > last_update:
             last_update = repository["pushed_at"]
 
-        if repository.get("is_gist"):
-            repo_cwd = os.path.join(output_directory, "gists", repository["id"])
-        elif repository.get("is_starred"):
-            # put starred repos in -o/starred/${owner}/${repo} to prevent collision of
-            # any repositories with the same name
-            repo_cwd = os.path.join(
-                output_directory,
-                "starred",
-                repository["owner"]["login"],
-                repository["name"],
-            )
-        else:
-            repo_cwd = os.path.join(
-                output_directory, "repositories", repository["name"]
+    succeeded = []
+    unavailable = []
+    failed = []
+    if args.workers > 1:
+        logger.info(
+            "Backing up {0} repositories with {1} workers".format(
+                len(repositories), args.workers
             )
+        )
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = {
+                executor.submit(
+                    _backup_repository_in_worker,
+                    args,
+                    output_directory,
+                    repository,
+                    repos_template,
+                ): repository
+                for repository in repositories
+            }
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                repository = futures[future]
+                try:
+                    backed_up = future.result()
+                except Exception as e:
+                    failed.append((repository, e))
+                    # Same as a sequential run: stop at the first error, but
+                    # let the repositories already in progress finish
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    continue
+                (succeeded if backed_up else unavailable).append(repository)
+    else:
+        for repository in repositories:
+            try:
+                backed_up = backup_repository(
+                    args, output_directory, repository, repos_template
+                )
+            except Exception as e:
+                failed.append((repository, e))
+                break
+            finally:
+                _finish_repository(repository)
+            (succeeded if backed_up else unavailable).append(repository)
+
+    logger.info(
+        "Backed up {0} of {1} repositories ({2} unavailable, {3} failed)".format(
+            len(succeeded), len(repositories), len(unavailable), len(failed)
+        )
+    )
+    for repository, e in failed:
+        logger.error(
+            "Backing up {0} failed: {1}".format(_repository_label(repository), e)
+        )
+    if failed:
+        raise failed[0][1]
 
-        repo_dir = os.path.join(repo_cwd, "repository")
-        repo_url = get_github_repo_url(args, repository)
+    if args.incremental:
+        if last_update == "0000-00-00T00:00:00Z":
+            last_update = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.localtime())
 
-        include_gists = args.include_gists or args.include_starred_gists
-        if (args.include_repository or args.include_everything) or (
-            include_gists and repository.get("is_gist")
-        ):
-            repo_name = (
-                repository.get("name")
-                if not repository.get("is_gist")
-                else repository.get("id")
-            )
-            fetch_repository(
-                repo_name,
-                repo_url,
-                repo_dir,
+        open(last_update_path, "w").write(last_update)
+
+
+def _repository_label(repository):
+    return repository.get("full_name") or repository.get("id")
+
+
+def _backup_repository_in_worker(args, output_directory, repository, repos_template):
+    try:
+        return _run_with_log_context(
+            _repository_label(repository),
+            backup_repository,
+            args,
+            output_directory,
+            repository,
+            repos_template,
+        )
+    finally:
+        _finish_repository(repository)
+
+
+def _finish_repository(repository):
+    durability.flush()
+    listing_cache.discard(repository.get("full_name"))
+
+
+def backup_repository(args, output_directory, repository, repos_template):
+    """
+    Back up a single repository or gist.
+
+    Returns True once everything requested was backed up and False if the
+    repository is unavailable for legal reasons (HTTP 451).
+    """
+    if repository.get("is_gist"):
+        repo_cwd = os.path.join(output_directory, "gists", repository["id"])
+    elif repository.get("is_starred"):
+        # put starred repos in -o/starred/${owner}/${repo} to prevent collision of
+        # any repositories with the same name
+        repo_cwd = os.path.join(
+            output_directory,
+            "starred",
+            repository["owner"]["login"],
+            repository["name"],
+        )
+    else:
+        repo_cwd = os.path.join(output_directory, "repositories", repository["name"])
+
+    repo_dir = os.path.join(repo_cwd, "repository")
+
+    include_gists = args.include_gists or args.include_starred_gists
+    if (args.include_repository or args.include_everything) or (
+        include_gists and repository.get("is_gist")
+    ):
+        repo_name = (
+            repository.get("name")
+            if not repository.get("is_gist")
+            else repository.get("id")
+        )
+        backup_unit(
+            repository,
+            "repository",
+            fetch_repository_of,
+            args,
+            repository,
+            repo_name,
+            repo_dir,
+            skip_existing=args.skip_existing,
+            bare_clone=args.bare_clone,
+            lfs_clone=args.lfs_clone,
+            no_prune=args.no_prune,
+        )
+
+        if repository.get("is_gist"):
+            # dump gist information to a file as well
+            output_file = "{0}/gist.json".format(repo_cwd)
+            with codecs.open(output_file, "w", encoding="utf-8") as f:
+                json_dump(repository, f)
+            durability.written(output_file)
+
+            return True  # don't try to back anything else for a gist; it doesn't exist
+
+    try:
+        download_wiki = args.include_wiki or args.include_everything
+        if repository["has_wiki"] and download_wiki:
+            backup_unit(
+                repository,
+                "wiki",
+                fetch_repository_of,
+                args,
+                repository,
+                repository["name"],
+                os.path.join(repo_cwd, "wiki"),
+                wiki=True,
                 skip_existing=args.skip_existing,
                 bare_clone=args.bare_clone,
                 lfs_clone=args.lfs_clone,
                 no_prune=args.no_prune,
             )
+        if args.include_issues or args.include_everything:
+            backup_unit(
+                repository,
+                "issues",
+                backup_incrementally,
+                args,
+                "issues",
+                repo_cwd,
+                repository,
+                backup_issues,
+                repo_cwd,
+                repository,
+                repos_template,
+            )
 
-            if repository.get("is_gist"):
-                # dump gist information to a file as well
-                output_file = "{0}/gist.json".format(repo_cwd)
-                with codecs.open(output_file, "w", encoding="utf-8") as f:
-                    json_dump(repository, f)
-
-                continue  # don't try to back anything else for a gist; it doesn't exist
-
-        try:
-            download_wiki = args.include_wiki or args.include_everything
-            if repository["has_wiki"] and download_wiki:
-                fetch_repository(
-                    repository["name"],
-                    repo_url.replace(".git", ".wiki.git"),
-                    os.path.join(repo_cwd, "wiki"),
-                    skip_existing=args.skip_existing,
-                    bare_clone=args.bare_clone,
-                    lfs_clone=args.lfs_clone,
-                    no_prune=args.no_prune,
-                )
-            if args.include_issues or args.include_everything:
-                backup_issues(args, repo_cwd, repository, repos_template)
-
-            if args.include_pulls or args.include_everything:
-                backup_pulls(args, repo_cwd, repository, repos_template)
-
-            if args.include_milestones or args.include_everything:
-                backup_milestones(args, repo_cwd, repository, repos_template)
+        if args.include_pulls or args.include_everything:
+            backup_unit(
+                repository,
+                "pulls",
+                backup_incrementally,
+                args,
+                "pulls",
+                repo_cwd,
+                repository,
+                backup_pulls,
+                repo_cwd,
+                repository,
+                repos_template,
+            )
 
-            if args.include_labels or args.include_everything:
-                backup_labels(args, repo_cwd, repository, repos_template)
+        if args.include_milestones or args.include_everything:
+            backup_unit(
+                repository,
+                "milestones",
+                backup_milestones,
+                args,
+                repo_cwd,
+                repository,
+                repos_template,
+            )
 
-            if args.include_hooks or args.include_everything:
-                backup_hooks(args, repo_cwd, repository, repos_template)
+        if args.include_labels or args.include_everything:
+            backup_unit(
+                repository,
+                "labels",
+                backup_labels,
+                args,
+                repo_cwd,
+                repository,
+                repos_template,
+            )
 
-            if args.include_releases or args.include_everything:
-                backup_releases(
-                    args,
-                    repo_cwd,
-                    repository,
-                    repos_template,
-                    include_assets=args.include_assets or args.include_everything,
-                )
-        except RepositoryUnavailableError as e:
-            logger.warning(f"Repository {repository['full_name']} is unavailable (HTTP 451)")
-            if e.dmca_url:
-                logger.warning(f"DMCA notice: {e.dmca_url}")
-            logger.info(f"Skipping remaining resources for {repository['full_name']}")
-            continue
+        if args.include_hooks or args.include_everything:
+            backup_unit(
+                repository,
+                "hooks",
+                backup_hooks,
+                args,
+                repo_cwd,
+                repository,
+                repos_template,
+            )
 
-    if args.incremental:
-        if last_update == "0000-00-00T00:00:00Z":
-            last_update = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.localtime())
+        if args.include_releases or args.include_everything:
+            backup_unit(
+                repository,
+                "releases",
+                backup_releases,
+                args,
+                repo_cwd,
+                repository,
+                repos_template,
+                include_assets=args.include_assets or args.include_everything,
+            )
+    except RepositoryUnavailableError as e:
+        logger.warning(f"Repository {repository['full_name']} is unavailable (HTTP 451)")
+        if e.dmca_url:
+            logger.warning(f"DMCA notice: {e.dmca_url}")
+        logger.info(f"Skipping remaining resources for {repository['full_name']}")
+        return False
 
-        open(last_update_path, "w").write(last_update)
+    return True
 
 
 def backup_issues(args, repo_cwd, repository, repos_template):
@@ -1754,63 +5111,142 @@ def backup_issues(args, repo_cwd, repository, repos_template):
 
     logger.info("Retrieving {0} issues".format(repository["full_name"]))
     issue_cwd = os.path.join(repo_cwd, "issues")
-    mkdir_p(repo_cwd, issue_cwd)
 
-    issues = {}
+    # Whether an issue was written, by number; one listed twice counts once
+    issues_written = {}
     issues_skipped = 0
     issues_skipped_message = ""
     _issue_template = "{0}/{1}/issues".format(repos_template, repository["full_name"])
 
     should_include_pulls = args.include_pulls or args.include_everything
     issue_states = ["open", "closed"]
-    for issue_state in issue_states:
-        query_args = {"filter": "all", "state": issue_state}
-        if args.since:
-            query_args["since"] = args.since
+    listings = []
+    if args.api == "graphql":
+        # comments and events come along with the issues
+        listings.append(
+            retrieve_issues_graphql(
+                args, repository, repos_template, should_include_pulls
+            )
+        )
+    elif args.single_pass_issues:
+        # Most recently updated first, so the listing can stop at the first
+        # issue that didn't change since the last run
+        query_args = {
+            "filter": "all",
+            "state": "all",
+            "sort": "updated",
+            "direction": "desc",
+        }
+        listings.append(
+            updated_since(
+                args, retrieve_data_gen(args, _issue_template, query_args=query_args)
+            )
+        )
+    else:
+        for issue_state in issue_states:
+            query_args = {"filter": "all", "state": issue_state}
+            if args.since:
+                query_args["since"] = args.since
+            listings.append(
+                retrieve_data_gen(args, _issue_template, query_args=query_args)
+            )
+
+    comments_template = _issue_template + "/{0}/comments"
+    events_template = _issue_template + "/{0}/events"
+
+    # Sub-resources retrieved with one repository-wide listing, by number
+    bulk = {}
+    if args.api != "graphql":
+        if args.bulk_comments and (
+            args.include_issue_comments or args.include_everything
+        ):
+            bulk["comment_data"] = retrieve_comments_by_number(
+                args, _issue_template + "/comments", "issue_url"
+            )
+            if should_include_pulls and (
+                args.include_pull_comments or args.include_everything
+            ):
+                # Pull requests are issues, backup_pulls needs the same listing
+                listing_cache.put(
+                    repository["full_name"],
+                    "issue_comments",
+                    args.since,
+                    bulk["comment_data"],
+                )
+        if args.bulk_events and (args.include_issue_events or args.include_everything):
+            bulk["event_data"] = retrieve_events_by_number(
+                args, _issue_template + "/events"
+            )
 
-        _issues = retrieve_data(args, _issue_template, query_args=query_args)
-        for issue in _issues:
-            # skip pull requests which are also returned as issues
-            # if retrieving pull requests is requested as well
+    def issue_subresources(number):
+        templates = {}
+        if args.api == "graphql":
+            return templates
+        if args.include_issue_comments or args.include_everything:
+            templates["comment_data"] = comments_template.format(number)
+        if args.include_issue_events or args.include_everything:
+            templates["event_data"] = events_template.format(number)
+        for key in bulk:
+            del templates[key]
+        return templates
+
+    store = open_collection(args, repo_cwd, "issues")
+
+    def listed_issues():
+        # skip pull requests which are also returned as issues
+        # if retrieving pull requests is requested as well
+        nonlocal issues_skipped
+        for index, issue in interleave_listings(args, listings):
             if "pull_request" in issue and should_include_pulls:
                 issues_skipped += 1
                 continue
-
-            issues[issue["number"]] = issue
-
-    if issues_skipped:
-        issues_skipped_message = " (skipped {0} pull requests)".format(issues_skipped)
-
-    logger.info(
-        "Saving {0} issues to disk{1}".format(
-            len(list(issues.keys())), issues_skipped_message
-        )
-    )
-    comments_template = _issue_template + "/{0}/comments"
-    events_template = _issue_template + "/{0}/events"
-    for number, issue in list(issues.items()):
-        issue_file = "{0}/{1}.json".format(issue_cwd, number)
-        if args.incremental_by_files and os.path.isfile(issue_file):
-            modified = os.path.getmtime(issue_file)
-            modified = datetime.fromtimestamp(modified).strftime("%Y-%m-%dT%H:%M:%SZ")
-            if modified > issue["updated_at"]:
+            yield index, issue
+
+    def modified_issues():
+        # Issues are written as they are listed, only their numbers are kept
+        # to pick the newest of one showing up in both the open and closed
+        # listing
+        for _, issue in newest_copies(listed_issues(), {}):
+            number = issue["number"]
+            if args.incremental_by_files and store.unchanged(
+                "{0}.json".format(number), issue["updated_at"]
+            ):
                 logger.info("Skipping issue {0} because it wasn't modified since last backup".format(number))
                 continue
+            yield number, issue
 
-        if args.include_issue_comments or args.include_everything:
-            template = comments_template.format(number)
-            issues[number]["comment_data"] = retrieve_data(args, template)
-        if args.include_issue_events or args.include_everything:
-            template = events_template.format(number)
-            issues[number]["event_data"] = retrieve_data(args, template)
+    attached = set()
+
+    def complete(number, issue):
+        attach_bulk_subresources(args, store, number, issue, bulk)
+        attached.add(number)
         if args.include_attachments:
             download_attachments(
-                args, issue_cwd, issues[number], number, repository, item_type="issue"
+                args, issue_cwd, issue, number, repository, item_type="issue"
             )
 
-        with codecs.open(issue_file + ".temp", "w", encoding="utf-8") as f:
-            json_dump(issue, f)
-            os.rename(issue_file + ".temp", issue_file)  # Unlike json_dump, this is atomic
+    try:
+        issues = enrich_items(args, modified_issues(), issue_subresources)
+        for number, issue in process_items(args, issues, complete):
+            written = store.put("{0}.json".format(number), issue)
+            issues_written[number] = written or issues_written.get(number, False)
+
+        merge_bulk_subresources(store, bulk, attached)
+    finally:
+        store.close()
+
+    issues_saved = sum(issues_written.values())
+    issues_unchanged = len(issues_written) - issues_saved
+    # Only the REST listing returns pull requests along with issues, with
+    # --api graphql they aren't listed in the first place
+    if issues_skipped:
+        issues_skipped_message = " (skipped {0} pull requests)".format(issues_skipped)
+
+    logger.info(
+        "Saved {0} issues to disk{1}".format(issues_saved, issues_skipped_message)
+    )
+    if issues_unchanged:
+        logger.info("{0} issues unchanged, skipped write".format(issues_unchanged))
 
 
 def backup_pulls(args, repo_cwd, repository, repos_template):
@@ -1820,9 +5256,9 @@ def backup_pulls(args, repo_cwd, repository, repos_template):
 
     logger.info("Retrieving {0} pull requests".format(repository["full_name"]))  # noqa
     pulls_cwd = os.path.join(repo_cwd, "pulls")
-    mkdir_p(repo_cwd, pulls_cwd)
 
-    pulls = {}
+    # Whether a pull request was written, by number
+    pulls_written = {}
     _pulls_template = "{0}/{1}/pulls".format(repos_template, repository["full_name"])
     _issue_template = "{0}/{1}/issues".format(repos_template, repository["full_name"])
     query_args = {
@@ -1832,29 +5268,21 @@ def backup_pulls(args, repo_cwd, repository, repos_template):
         "direction": "desc",
     }
 
-    if not args.include_pull_details:
+    listings = []
+    if args.api == "graphql":
+        # comments and commits come along with the pull requests
+        listings.append(retrieve_pulls_graphql(args, repository, repos_template))
+    elif not args.include_pull_details:
         pull_states = ["open", "closed"]
         for pull_state in pull_states:
-            query_args["state"] = pull_state
-            _pulls = retrieve_data_gen(args, _pulls_template, query_args=query_args)
-            for pull in _pulls:
-                if args.since and pull["updated_at"] < args.since:
-                    break
-                if not args.since or pull["updated_at"] >= args.since:
-                    pulls[pull["number"]] = pull
+            _pulls = retrieve_data_gen(
+                args, _pulls_template, query_args=dict(query_args, state=pull_state)
+            )
+            listings.append(updated_since(args, _pulls))
     else:
         _pulls = retrieve_data_gen(args, _pulls_template, query_args=query_args)
-        for pull in _pulls:
-            if args.since and pull["updated_at"] < args.since:
-                break
-            if not args.since or pull["updated_at"] >= args.since:
-                pulls[pull["number"]] = retrieve_data(
-                    args,
-                    _pulls_template + "/{}".format(pull["number"]),
-                    single_request=True,
-                )[0]
+        listings.append(updated_since(args, _pulls))
 
-    logger.info("Saving {0} pull requests to disk".format(len(list(pulls.keys()))))
     # Comments from pulls API are only _review_ comments
     # regular comments need to be fetched via issue API.
     # For backwards compatibility with versions <= 0.41.0
@@ -1862,30 +5290,110 @@ def backup_pulls(args, repo_cwd, repository, repos_template):
     comments_regular_template = _issue_template + "/{0}/comments"
     comments_template = _pulls_template + "/{0}/comments"
     commits_template = _pulls_template + "/{0}/commits"
-    for number, pull in list(pulls.items()):
-        pull_file = "{0}/{1}.json".format(pulls_cwd, number)
-        if args.incremental_by_files and os.path.isfile(pull_file):
-            modified = os.path.getmtime(pull_file)
-            modified = datetime.fromtimestamp(modified).strftime("%Y-%m-%dT%H:%M:%SZ")
-            if modified > pull["updated_at"]:
+
+    # Sub-resources retrieved with one repository-wide listing, by number
+    bulk = {}
+    if (
+        args.api != "graphql"
+        and args.bulk_comments
+        and (args.include_pull_comments or args.include_everything)
+    ):
+        bulk["comment_regular_data"] = listing_cache.take(
+            repository["full_name"], "issue_comments", args.since
+        )
+        if bulk["comment_regular_data"] is None:
+            bulk["comment_regular_data"] = retrieve_comments_by_number(
+                args, _issue_template + "/comments", "issue_url"
+            )
+        bulk["comment_data"] = retrieve_comments_by_number(
+            args, _pulls_template + "/comments", "pull_request_url"
+        )
+
+    include_commits = args.include_pull_commits or args.include_everything
+    reused_commits = set()
+
+    def stored_commits(pulls):
+        # The commits of a pull request only change with its head or base,
+        # so those of the stored pull request are kept while they are the
+        # same. The stored ones are only read if the index says so.
+        for number, pull in pulls:
+            name = "{0}.json".format(number)
+            shas = pull_shas(pull)
+            if shas[0] and store.commit_shas(name) == shas:
+                stored = store.get(name) or {}
+                if "commit_data" in stored:
+                    pull["commit_data"] = stored["commit_data"]
+                    reused_commits.add(number)
+                    run_statistics.increment("pull_commits_reused")
+            yield number, pull
+
+    def pull_subresources(number):
+        templates = {}
+        if args.api == "graphql":
+            return templates
+        if args.include_pull_comments or args.include_everything:
+            templates["comment_regular_data"] = comments_regular_template.format(number)
+            templates["comment_data"] = comments_template.format(number)
+        if include_commits and number not in reused_commits:
+            templates["commit_data"] = commits_template.format(number)
+        for key in bulk:
+            del templates[key]
+        return templates
+
+    store = open_collection(args, repo_cwd, "pulls")
+
+    def modified_pulls():
+        # Pull requests are written as they are listed, only their numbers
+        # are kept to pick the newest of one showing up in both the open and
+        # closed listing
+        for _, pull in newest_copies(interleave_listings(args, listings), {}):
+            number = pull["number"]
+            if args.incremental_by_files and store.unchanged(
+                "{0}.json".format(number), pull["updated_at"]
+            ):
                 logger.info("Skipping pull request {0} because it wasn't modified since last backup".format(number))
                 continue
-        if args.include_pull_comments or args.include_everything:
-            template = comments_regular_template.format(number)
-            pulls[number]["comment_regular_data"] = retrieve_data(args, template)
-            template = comments_template.format(number)
-            pulls[number]["comment_data"] = retrieve_data(args, template)
-        if args.include_pull_commits or args.include_everything:
-            template = commits_template.format(number)
-            pulls[number]["commit_data"] = retrieve_data(args, template)
+            yield number, pull
+
+    def details(number, pull):
+        detail = retrieve_data(
+            args, _pulls_template + "/{}".format(number), single_request=True
+        )[0]
+        pull.clear()
+        pull.update(detail)
+
+    attached = set()
+
+    def complete(number, pull):
+        attach_bulk_subresources(args, store, number, pull, bulk)
+        attached.add(number)
         if args.include_attachments:
             download_attachments(
-                args, pulls_cwd, pulls[number], number, repository, item_type="pull"
+                args, pulls_cwd, pull, number, repository, item_type="pull"
             )
 
-        with codecs.open(pull_file + ".temp", "w", encoding="utf-8") as f:
-            json_dump(pull, f)
-            os.rename(pull_file + ".temp", pull_file)  # Unlike json_dump, this is atomic
+    try:
+        pulls = modified_pulls()
+        if args.api != "graphql" and args.include_pull_details:
+            pulls = process_items(args, pulls, details)
+        if args.api != "graphql" and include_commits:
+            pulls = stored_commits(pulls)
+        pulls = enrich_items(args, pulls, pull_subresources)
+        for number, pull in process_items(args, pulls, complete):
+            written = store.put("{0}.json".format(number), pull)
+            pulls_written[number] = written or pulls_written.get(number, False)
+
+        merge_bulk_subresources(store, bulk, attached)
+    finally:
+        store.close()
+
+    pulls_saved = sum(pulls_written.values())
+    pulls_unchanged = len(pulls_written) - pulls_saved
+    logger.info("Saved {0} pull requests to disk".format(pulls_saved))
+    if pulls_unchanged:
+        logger.info(
+            "{0} pull requests unchanged, skipped write".format(pulls_unchanged)
+        )
 
 
 def backup_milestones(args, repo_cwd, repository, repos_template):
@@ -1894,7 +5402,6 @@ def backup_milestones(args, repo_cwd, repository, repos_template):
         return
 
     logger.info("Retrieving {0} milestones".format(repository["full_name"]))
-    mkdir_p(repo_cwd, milestone_cwd)
 
     template = "{0}/{1}/milestones".format(repos_template, repository["full_name"])
 
@@ -1906,11 +5413,14 @@ def backup_milestones(args, repo_cwd, repository, repos_template):
     for milestone in _milestones:
         milestones[milestone["number"]] = milestone
 
+    store = open_collection(args, repo_cwd, "milestones")
     written_count = 0
-    for number, milestone in list(milestones.items()):
-        milestone_file = "{0}/{1}.json".format(milestone_cwd, number)
-        if json_dump_if_changed(milestone, milestone_file):
-            written_count += 1
+    try:
+        for number, milestone in list(milestones.items()):
+            if store.put("{0}.json".format(number), milestone):
+                written_count += 1
+    finally:
+        store.close()
 
     total = len(milestones)
     if written_count == total:
@@ -1927,7 +5437,7 @@ def backup_labels(args, repo_cwd, repository, repos_template):
     label_cwd = os.path.join(repo_cwd, "labels")
     output_file = "{0}/labels.json".format(label_cwd)
     template = "{0}/{1}/labels".format(repos_template, repository["full_name"])
-    _backup_data(args, "labels", template, output_file, label_cwd)
+    _backup_data(args, "labels", template, output_file, label_cwd, repo_cwd)
 
 
 def backup_hooks(args, repo_cwd, repository, repos_template):
@@ -1939,7 +5449,7 @@ def backup_hooks(args, repo_cwd, repository, repos_template):
     output_file = "{0}/hooks.json".format(hook_cwd)
     template = "{0}/{1}/hooks".format(repos_template, repository["full_name"])
     try:
-        _backup_data(args, "hooks", template, output_file, hook_cwd)
+        _backup_data(args, "hooks", template, output_file, hook_cwd, repo_cwd)
     except Exception as e:
         if "404" in str(e):
             logger.info("Unable to read hooks, skipping")
@@ -1953,7 +5463,6 @@ def backup_releases(args, repo_cwd, repository, repos_template, include_assets=F
     # give release files somewhere to live & log intent
     release_cwd = os.path.join(repo_cwd, "releases")
     logger.info("Retrieving {0} releases".format(repository_fullname))
-    mkdir_p(repo_cwd, release_cwd)
 
     query_args = {}
 
@@ -1975,30 +5484,31 @@ def backup_releases(args, repo_cwd, repository, repos_template, include_assets=F
         releases = releases[: args.number_of_latest_releases]
 
     # for each release, store it
+    store = open_collection(args, repo_cwd, "releases")
     written_count = 0
-    for release in releases:
-        release_name = release["tag_name"]
-        release_name_safe = release_name.replace("/", "__")
-        output_filepath = os.path.join(
-            release_cwd, "{0}.json".format(release_name_safe)
-        )
-        if json_dump_if_changed(release, output_filepath):
-            written_count += 1
-
-        if include_assets:
-            assets = retrieve_data(args, release["assets_url"])
-            if len(assets) > 0:
-                # give release asset files somewhere to live & download them (not including source archives)
-                release_assets_cwd = os.path.join(release_cwd, release_name_safe)
-                mkdir_p(release_assets_cwd)
-                for asset in assets:
-                    download_file(
-                        asset["url"],
-                        os.path.join(release_assets_cwd, asset["name"]),
-                        get_auth(args, encode=not args.as_app),
-                        as_app=args.as_app,
-                        fine=True if args.token_fine is not None else False,
-                    )
+    try:
+        for release in releases:
+            release_name = release["tag_name"]
+            release_name_safe = release_name.replace("/", "__")
+            if store.put("{0}.json".format(release_name_safe), release):
+                written_count += 1
+
+            if include_assets:
+                assets = retrieve_data(args, release["assets_url"])
+                if len(assets) > 0:
+                    # give release asset files somewhere to live & download them (not including source archives)
+                    release_assets_cwd = os.path.join(release_cwd, release_name_safe)
+                    mkdir_p(release_assets_cwd)
+                    for asset in assets:
+                        download_file(
+                            asset["url"],
+                            os.path.join(release_assets_cwd, asset["name"]),
+                            get_auth(args, encode=not args.as_app),
+                            as_app=args.as_app,
+                            fine=True if args.token_fine is not None else False,
+                        )
+    finally:
+        store.close()
 
     # Log the results
     total = len(releases)
@@ -2128,23 +5638,62 @@ def backup_account(args, output_directory):
         _backup_data(args, "following", template, output_file, account_cwd)
 
 
-def _backup_data(args, name, template, output_file, output_directory):
-    skip_existing = args.skip_existing
-    if not skip_existing or not os.path.exists(output_file):
-        logger.info("Retrieving {0} {1}".format(args.user, name))
-        mkdir_p(output_directory)
-        data = retrieve_data(args, template)
+def _backup_data(args, name, template, output_file, output_directory, repo_cwd=None):
+    """
+    Back up the listing at template to output_file. Resources of the
+    repository backed up to repo_cwd go to its store, see open_collection.
+    """
+    if repo_cwd is not None:
+        store = open_collection(args, repo_cwd, os.path.basename(output_directory))
+    else:
+        store = FileCollection(output_directory, args.compress)
+    file_name = os.path.basename(output_file)
+    try:
+        skip_existing = args.skip_existing
+        if not skip_existing or not store.contains(file_name):
+            logger.info("Retrieving {0} {1}".format(args.user, name))
+            data = retrieve_data(args, template)
 
-        if json_dump_if_changed(data, output_file):
-            logger.info("Saved {0} {1} to disk".format(len(data), name))
-        else:
-            logger.info("{0} {1} unchanged, skipped write".format(len(data), name))
+            if store.put(file_name, data):
+                logger.info("Saved {0} {1} to disk".format(len(data), name))
+            else:
+                logger.info("{0} {1} unchanged, skipped write".format(len(data), name))
+    finally:
+        store.close()
 
 
 def json_dump(data, output_file):
-    json.dump(
+    output_file.write(json_dumps(data))
+
+
+def json_dumps(data):
+    """
+    data serialized like json_dump does.
+
+    Uses orjson when it is installed and its output is the same as the one
+    of the json module for data, which is checked by _orjson_compatible.
+    """
+    if orjson is not None and _orjson_compatible(data):
+        try:
+            return _json_dumps_orjson(data)
+        except orjson.JSONEncodeError:
+            pass  # e.g. strings with lone surrogates
+    return _json_dumps_stdlib(data)
+
+
+def json_loads(data):
+    """Parse the JSON str or bytes data, with orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # e.g. integers beyond 64 bits, leave it to the json module
+    return json.loads(data)
+
+
+def _json_dumps_stdlib(data):
+    return json.dumps(
         data,
-        output_file,
         ensure_ascii=False,
         sort_keys=True,
         indent=4,
@@ -2152,7 +5701,48 @@ def json_dump(data, output_file):
     )
 
 
-def json_dump_if_changed(data, output_file_path):
+def _json_dumps_orjson(data):
+    # orjson only indents by two spaces. Strings can't contain a raw line
+    # break or NUL, so each two spaces at the start of a line become a NUL
+    # and each NUL four spaces, to get json's indentation
+    content = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+    content = content.replace(b"\n  ", b"\n\0")
+    while b"\0  " in content:
+        content = content.replace(b"\0  ", b"\0\0")
+    return content.replace(b"\0", b"    ").decode("utf-8")
+
+
+_ORJSON_SCALARS = (str, bool, type(None))
+
+
+def _orjson_compatible(data):
+    """
+    Whether orjson serializes data like the json module: it formats floats
+    differently, and doesn't take keys other than strings or integers
+    beyond 64 bits. Subclasses of the JSON types are left to json as well.
+    """
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        kind = type(value)
+        if kind in _ORJSON_SCALARS:
+            continue
+        if kind is dict:
+            for key in value:
+                if type(key) is not str:
+                    return False
+            stack.extend(value.values())
+        elif kind is list or kind is tuple:
+            stack.extend(value)
+        elif kind is int:
+            if not -(2**63) <= value < 2**64:
+                return False
+        else:
+            return False
+    return True
+
+
+def json_dump_if_changed(data, output_file_path, index=None):
     """
     Write JSON data to file only if content has changed.
 
@@ -2160,37 +5750,71 @@ def json_dump_if_changed(data, output_file_path):
     and only writes if different. This prevents unnecessary file
     modification timestamp updates and disk writes.
 
+    With the FileIndex of the file's directory, only the hash of the
+    serialized data is compared with the one of the index, and the index
+    is updated. Files missing from the index are compared in full.
+
     Uses atomic writes (temp file + rename) to prevent corruption
     if the process is interrupted during the write.
 
     Args:
         data: The data to serialize as JSON
         output_file_path: The path to the output file
+        index: Optional FileIndex of the output file's directory
 
     Returns:
         True if file was written (content changed or new file)
         False if write was skipped (content unchanged)
     """
     # Serialize new data with consistent formatting matching json_dump()
-    new_content = json.dumps(
-        data,
-        ensure_ascii=False,
-        sort_keys=True,
-        indent=4,
-        separators=(",", ": "),
+    return write_if_changed(
+        json_dumps(data),
+        output_file_path,
+        index,
+        _updated_at(data),
+        _commit_shas(data),
     )
 
-    # Check if file exists and compare content
-    if os.path.exists(output_file_path):
+
+def write_if_changed(
+    new_content, output_file_path, index=None, updated_at=None, shas=None
+):
+    """
+    Write the serialized JSON new_content like json_dump_if_changed, with
+    updated_at and shas for the index. A path ending in .gz or .xz is
+    written compressed, and compared on its uncompressed content.
+    """
+    name = os.path.basename(output_file_path)
+    encoded = new_content.encode("utf-8")
+    compressed = output_file_path.endswith(tuple(JSON_COMPRESSIONS.values()))
+
+    if index is not None and index.get(name) is not None:
+        # The size check catches files deleted or truncated behind the
+        # index, compressed files can only be checked for existence
+        size = _file_size(output_file_path)
+        if index.holds(name, encoded) and (
+            size == len(encoded) or (compressed and bool(size))
+        ):
+            logger.debug(
+                "Content unchanged, skipping write: {0}".format(output_file_path)
+            )
+            if index.get(name).get("shas") != shas:
+                # Indexed before shas were
+                index.record(name, encoded, updated_at, shas)
+            return False
+    elif os.path.exists(output_file_path):
+        # Check if file exists and compare content
         try:
-            with codecs.open(output_file_path, "r", encoding="utf-8") as f:
+            with open_json_file(output_file_path) as f:
                 existing_content = f.read()
             if existing_content == new_content:
                 logger.debug(
                     "Content unchanged, skipping write: {0}".format(output_file_path)
                 )
+                if index is not None:
+                    index.record(name, encoded, updated_at, shas)
                 return False
-        except (OSError, UnicodeDecodeError) as e:
+        except (OSError, EOFError, lzma.LZMAError, UnicodeDecodeError) as e:
             # If we can't read the existing file, write the new one
             logger.debug(
                 "Error reading existing file {0}, will overwrite: {1}".format(
@@ -2200,7 +5824,110 @@ def json_dump_if_changed(data, output_file_path):
 
     # Write the file atomically using temp file + rename
     temp_file = output_file_path + ".temp"
-    with codecs.open(temp_file, "w", encoding="utf-8") as f:
-        f.write(new_content)
-    os.rename(temp_file, output_file_path)  # Atomic on POSIX systems
+    with open(temp_file, "wb") as f:
+        f.write(_compress(encoded, output_file_path))
+    durability.replace(temp_file, output_file_path)
+    if index is not None:
+        index.record(name, encoded, updated_at, shas)
     return True
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def log_run_statistics():
+    stats = connection_pool.stats()
+    logger.info(
+        "HTTP connections: {0} requests over {1} connections ({2} reused)".format(
+            stats["requests"],
+            stats["connections_opened"],
+            stats["connections_reused"],
+        )
+    )
+
+    wire_bytes = run_statistics.get("api_wire_bytes")
+    decoded_bytes = run_statistics.get("api_decoded_bytes")
+    if decoded_bytes:
+        logger.info(
+            "API transfer: {0} bytes received, {1} bytes decoded ({2:.0%} saved by compression)".format(
+                wire_bytes, decoded_bytes, 1 - float(wire_bytes) / decoded_bytes
+            )
+        )
+
+    retries = run_statistics.get("retries")
+    if retries or run_statistics.get("rate_limit_retries"):
+        logger.info(
+            "Retries: {0} after transient errors ({1} given up), {2} after rate limits".format(
+                retries,
+                run_statistics.get("retries_exhausted"),
+                run_statistics.get("rate_limit_retries"),
+            )
+        )
+
+    stats = rate_limit_governor.stats()
+    if stats["waited"]:
+        logger.info(
+            "Rate limit: waited {0:.0f} seconds in total".format(stats["waited"])
+        )
+    for (credential, resource), state in sorted(
+        stats["limits"].items(), key=lambda item: (str(item[0][0]), item[0][1])
+    ):
+        logger.info(
+            "Rate limit {0}: {1} used, {2} of {3} remaining".format(
+                resource, state["used"], state["remaining"], state["limit"]
+            )
+        )
+
+    if token_pool is not None:
+        limits = rate_limit_governor.stats()["limits"]
+        for token in token_pool.stats():
+            remaining = [
+                "{0} {1}".format(resource, state["remaining"])
+                for (credential, resource), state in sorted(
+                    limits.items(), key=lambda item: item[0][1]
+                )
+                if credential == token["credential"]
+            ]
+            logger.info(
+                "Token {0}: {1} repository requests{2}{3}".format(
+                    token["label"],
+                    token["requests"],
+                    ", remaining " + ", ".join(remaining) if remaining else "",
+                    " (rejected)" if token["invalid"] else "",
+                )
+            )
+
+    if run_statistics.get("pull_commits_reused"):
+        logger.info(
+            "Pull request commits: reused for {0} pull requests with unchanged head and base".format(
+                run_statistics.get("pull_commits_reused")
+            )
+        )
+
+    if run_statistics.get("files_synced"):
+        batches = run_statistics.get("sync_batches")
+        logger.info(
+            "Durability: {0} files synced{1}".format(
+                run_statistics.get("files_synced"),
+                " in {0} batches".format(batches) if batches else "",
+            )
+        )
+
+    if run_statistics.get("graphql_cost"):
+        logger.info(
+            "GraphQL: {0} rate limit points used".format(
+                run_statistics.get("graphql_cost")
+            )
+        )
+
+    if http_cache is not None:
+        stats = http_cache.stats()
+        logger.info(
+            "HTTP cache: {0} of {1} conditional requests not modified".format(
+                stats["not_modified"], stats["conditional_requests"]
+            )
+        )
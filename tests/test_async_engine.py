@@ -0,0 +1,218 @@
+"""Tests for the async request engine."""
+
+import os
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from github_backup import github_backup
+
+REPOS_TEMPLATE = "https://api.github.com/repos"
+REPOSITORY = {"full_name": "owner/repo", "name": "repo"}
+
+
+def fake_retrieve_data(args, template, query_args=None, single_request=False):
+    """Serve a small repository with three issues and one pull request."""
+    path = template[len(REPOS_TEMPLATE + "/owner/repo/") :]
+    if path == "issues":
+        if query_args["state"] == "open":
+            return [
+                {"number": 1, "updated_at": "2024-01-01T00:00:00Z"},
+                {"number": 4, "updated_at": "2024-01-01T00:00:00Z", "pull_request": {}},
+            ]
+        return [
+            {"number": 2, "updated_at": "2024-01-02T00:00:00Z"},
+            {"number": 3, "updated_at": "2024-01-03T00:00:00Z"},
+        ]
+    resource, number, subresource = path.split("/")
+    return [{"id": int(number) * 10, "kind": subresource}]
+
+
+def backup_issues(tmp_path, engine):
+    args = github_backup.parse_args(
+        [
+            "owner",
+            "--issues",
+            "--issue-comments",
+            "--issue-events",
+            "--pulls",
+            "--engine",
+            engine,
+        ]
+    )
+    args.since = None
+    repo_cwd = str(tmp_path / engine)
+    with patch.object(github_backup, "retrieve_data", side_effect=fake_retrieve_data):
+        with patch.object(
+            github_backup, "retrieve_data_gen", side_effect=fake_retrieve_data
+        ):
+            github_backup.backup_issues(args, repo_cwd, REPOSITORY, REPOS_TEMPLATE)
+
+    issue_cwd = os.path.join(repo_cwd, "issues")
+    contents = {}
+    for name in sorted(os.listdir(issue_cwd)):
+        with open(os.path.join(issue_cwd, name), "rb") as f:
+            contents[name] = f.read()
+    return contents
+
+
+def test_async_engine_output_matches_sync_engine(tmp_path):
+    sync_output = backup_issues(tmp_path, "sync")
+    async_output = backup_issues(tmp_path, "async")
+
+    assert sorted(sync_output) == [".github-backup-index", "1.json", "2.json", "3.json"]
+    assert async_output == sync_output
+
+
+def test_enrich_items_fetches_concurrently_and_keeps_order():
+    args = github_backup.parse_args(
+        ["owner", "--engine", "async", "--concurrency", "4"]
+    )
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    def slow_retrieve_data(args, template, query_args=None, single_request=False):
+        with lock:
+            active.append(template)
+            peak.append(len(active))
+        time.sleep(0.02)
+        with lock:
+            active.remove(template)
+        return [template]
+
+    items = [(number, {"number": number}) for number in range(10)]
+
+    def subresources(number):
+        return {"comment_data": "comments/{0}".format(number)}
+
+    with patch.object(github_backup, "retrieve_data", side_effect=slow_retrieve_data):
+        enriched = list(github_backup.enrich_items(args, items, subresources))
+
+    assert [number for number, _ in enriched] == list(range(10))
+    assert enriched[3][1]["comment_data"] == ["comments/3"]
+    assert 1 < max(peak) <= 4
+
+
+def test_process_items_runs_concurrently_and_keeps_order():
+    args = github_backup.parse_args(
+        ["owner", "--engine", "async", "--concurrency", "2"]
+    )
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    def download(number, item):
+        with lock:
+            active.append(number)
+            peak.append(len(active))
+        time.sleep(0.02)
+        with lock:
+            active.remove(number)
+        item["downloaded"] = True
+
+    items = [(number, {"number": number}) for number in range(6)]
+
+    processed = list(github_backup.process_items(args, iter(items), download))
+
+    assert [number for number, _ in processed] == list(range(6))
+    assert all(item["downloaded"] for _, item in processed)
+    assert 1 < max(peak) <= 2
+
+
+def test_pull_details_are_fetched_per_pull(tmp_path):
+    args = github_backup.parse_args(
+        ["owner", "--pulls", "--pull-details", "--engine", "async"]
+    )
+    args.since = None
+    pulls = REPOS_TEMPLATE + "/owner/repo/pulls"
+
+    def listing(args, template, query_args=None, single_request=False):
+        return iter([{"number": 2, "updated_at": "2024-01-02T00:00:00Z"}])
+
+    def details(args, template, query_args=None, single_request=False):
+        assert template == pulls + "/2" and single_request
+        return [{"number": 2, "updated_at": "2024-01-02T00:00:00Z", "merged": True}]
+
+    with patch.object(github_backup, "retrieve_data_gen", side_effect=listing):
+        with patch.object(github_backup, "retrieve_data", side_effect=details):
+            github_backup.backup_pulls(args, str(tmp_path), REPOSITORY, REPOS_TEMPLATE)
+
+    with open(str(tmp_path / "pulls" / "2.json")) as f:
+        assert '"merged": true' in f.read()
+
+
+def test_async_engine_propagates_repository_unavailable():
+    args = github_backup.parse_args(["owner", "--engine", "async"])
+
+    def unavailable(args, template, query_args=None, single_request=False):
+        raise github_backup.RepositoryUnavailableError("HTTP 451")
+
+    with patch.object(github_backup, "retrieve_data", side_effect=unavailable):
+        with pytest.raises(github_backup.RepositoryUnavailableError):
+            github_backup.retrieve_data_concurrently(args, [("issues", None)])
+
+
+def test_concurrency_limits_requests_of_nested_pools():
+    args = github_backup.parse_args(
+        ["owner", "--engine", "async", "--concurrency", "2"]
+    )
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    def slow_fetch_page_once(args, url, request_per_page, query_args, auth):
+        with lock:
+            active.append(url)
+            peak.append(len(active))
+        time.sleep(0.01)
+        with lock:
+            active.remove(url)
+        return Mock(headers={}), [url]
+
+    def fetch_subresources(number, item):
+        calls = [("comments/{0}/{1}".format(number, i), None) for i in range(4)]
+        item["comment_data"] = github_backup.retrieve_data_concurrently(args, calls)
+
+    items = [(number, {"number": number}) for number in range(8)]
+
+    with patch.object(github_backup, "request_slots", github_backup.RequestSlots(2)):
+        with patch.object(
+            github_backup, "_fetch_page_once", side_effect=slow_fetch_page_once
+        ):
+            processed = list(
+                github_backup.process_items(args, iter(items), fetch_subresources)
+            )
+
+    assert len(processed) == 8
+    assert len(peak) == 32
+    assert max(peak) == 2
+
+
+def test_open_and_closed_listings_are_read_concurrently(tmp_path):
+    args = github_backup.parse_args(["owner", "--issues", "--engine", "async"])
+    args.since = None
+    closed_started = threading.Event()
+
+    def retrieve_data_gen(args, template, query_args=None, single_request=False):
+        if query_args["state"] == "closed":
+            closed_started.set()
+            yield {"number": 2, "updated_at": "2024-01-02T00:00:00Z"}
+            return
+        yield {"number": 1, "updated_at": "2024-01-01T00:00:00Z"}
+        # the second page of open issues is only requested once the closed
+        # listing is being read as well
+        assert closed_started.wait(timeout=5)
+        yield {"number": 3, "updated_at": "2024-01-03T00:00:00Z"}
+
+    with patch.object(github_backup, "retrieve_data_gen", retrieve_data_gen):
+        github_backup.backup_issues(args, str(tmp_path), REPOSITORY, REPOS_TEMPLATE)
+
+    assert sorted(os.listdir(str(tmp_path / "issues"))) == [
+        ".github-backup-index",
+        "1.json",
+        "2.json",
+        "3.json",
+    ]
@@ -0,0 +1,253 @@
+"""Tests for retrieving issue sub-resources with repository-wide listings."""
+
+import json
+import os
+from unittest.mock import patch
+
+from github_backup import github_backup
+
+REPOS_TEMPLATE = "https://api.github.com/repos"
+REPOSITORY = {"full_name": "owner/repo", "name": "repo"}
+ISSUES = REPOS_TEMPLATE + "/owner/repo/issues"
+
+
+def comment(comment_id, number, body="comment"):
+    return {
+        "id": comment_id,
+        "issue_url": "{0}/{1}".format(ISSUES, number),
+        "body": body,
+    }
+
+
+class FakeAPI:
+    def __init__(self, issues, comments):
+        self.issues = issues
+        self.comments = comments
+        self.requests = []
+
+    def retrieve_data_gen(self, args, template, query_args=None, single_request=False):
+        self.requests.append((template, query_args))
+        if template == ISSUES + "/comments":
+            return iter(self.comments)
+        if template == ISSUES:
+            if query_args["state"] == "open":
+                return iter(self.issues)
+            return iter([])
+        return iter([])
+
+    def retrieve_data(self, args, template, query_args=None, single_request=False):
+        return list(self.retrieve_data_gen(args, template, query_args, single_request))
+
+
+def backup_issues(tmp_path, api, since=None):
+    args = github_backup.parse_args(
+        ["owner", "--issues", "--issue-comments", "--bulk-comments"]
+    )
+    args.since = since
+    with patch.object(github_backup, "retrieve_data_gen", api.retrieve_data_gen):
+        with patch.object(github_backup, "retrieve_data", api.retrieve_data):
+            github_backup.backup_issues(args, str(tmp_path), REPOSITORY, REPOS_TEMPLATE)
+
+
+def read_issue(tmp_path, number):
+    with open(os.path.join(str(tmp_path), "issues", "{0}.json".format(number))) as f:
+        return json.load(f)
+
+
+def test_comments_are_grouped_by_issue(tmp_path):
+    api = FakeAPI(
+        issues=[
+            {"number": 1, "updated_at": "2024-01-01T00:00:00Z"},
+            {"number": 2, "updated_at": "2024-01-01T00:00:00Z"},
+        ],
+        comments=[comment(12, 1), comment(20, 2), comment(11, 1)],
+    )
+
+    backup_issues(tmp_path, api)
+
+    assert [c["id"] for c in read_issue(tmp_path, 1)["comment_data"]] == [11, 12]
+    assert [c["id"] for c in read_issue(tmp_path, 2)["comment_data"]] == [20]
+    templates = [template for template, _ in api.requests]
+    assert templates.count(ISSUES + "/comments") == 1
+    assert not any(t.endswith("/1/comments") for t in templates)
+
+
+def test_incremental_run_merges_changed_comments(tmp_path):
+    api = FakeAPI(
+        issues=[
+            {"number": 1, "updated_at": "2024-01-01T00:00:00Z"},
+            {"number": 5, "updated_at": "2024-01-01T00:00:00Z"},
+        ],
+        comments=[comment(1, 1), comment(2, 1), comment(50, 5)],
+    )
+    backup_issues(tmp_path, api)
+
+    since = "2024-02-01T00:00:00Z"
+    api = FakeAPI(
+        issues=[{"number": 1, "updated_at": "2024-02-02T00:00:00Z"}],
+        comments=[
+            comment(2, 1, body="edited"),
+            comment(3, 1),
+            comment(50, 5, body="edited"),
+            comment(90, 9),
+        ],
+    )
+    backup_issues(tmp_path, api, since=since)
+
+    issue = read_issue(tmp_path, 1)
+    assert issue["updated_at"] == "2024-02-02T00:00:00Z"
+    assert [(c["id"], c["body"]) for c in issue["comment_data"]] == [
+        (1, "comment"),
+        (2, "edited"),
+        (3, "comment"),
+    ]
+    # issue 5 wasn't listed but one of its comments was edited
+    assert read_issue(tmp_path, 5)["comment_data"][0]["body"] == "edited"
+    # no issue file for 9, e.g. a pull request
+    assert not os.path.exists(os.path.join(str(tmp_path), "issues", "9.json"))
+    comments_query = dict(api.requests)[ISSUES + "/comments"]
+    assert comments_query == {"sort": "updated", "direction": "asc", "since": since}
+
+
+def event(event_id, number, created_at):
+    return {
+        "id": event_id,
+        "event": "labeled",
+        "created_at": created_at,
+        "issue": {"number": number},
+    }
+
+
+def test_events_are_grouped_and_read_back_to_last_run(tmp_path):
+    args = github_backup.parse_args(
+        ["owner", "--issues", "--issue-events", "--bulk-events"]
+    )
+    args.since = "2024-02-01T00:00:00Z"
+    consumed = []
+
+    def events():
+        # newest first, like the API
+        for e in [
+            event(4, 1, "2024-02-04T00:00:00Z"),
+            event(3, 2, "2024-02-03T00:00:00Z"),
+            event(2, 1, "2024-02-02T00:00:00Z"),
+            event(1, 1, "2024-01-01T00:00:00Z"),
+            event(0, 1, "2023-12-01T00:00:00Z"),
+        ]:
+            consumed.append(e["id"])
+            yield e
+
+    def retrieve_data_gen(args, template, query_args=None, single_request=False):
+        assert template == ISSUES + "/events"
+        return events()
+
+    with patch.object(github_backup, "retrieve_data_gen", retrieve_data_gen):
+        grouped = github_backup.retrieve_events_by_number(args, ISSUES + "/events")
+
+    assert sorted(grouped) == [1, 2]
+    assert [e["id"] for e in grouped[1]] == [2, 4]
+    assert "issue" not in grouped[1][0]
+    # stopped at the first event from before the last run
+    assert consumed == [4, 3, 2, 1]
+
+
+PULLS = REPOS_TEMPLATE + "/owner/repo/pulls"
+
+
+def test_pull_review_comments_are_merged_on_incremental_runs(tmp_path):
+    listings = {
+        ISSUES + "/comments": [comment(7, 3, body="regular")],
+        PULLS
+        + "/comments": [
+            {"id": 70, "pull_request_url": PULLS + "/3", "body": "review"},
+            {"id": 80, "pull_request_url": PULLS + "/4", "body": "new review"},
+        ],
+    }
+    requests = []
+
+    def retrieve_data_gen(args, template, query_args=None, single_request=False):
+        requests.append(template)
+        if template == PULLS and query_args["state"] == "open":
+            return iter([{"number": 3, "updated_at": "2024-02-02T00:00:00Z"}])
+        return iter(listings.get(template, []))
+
+    pulls_cwd = tmp_path / "pulls"
+    pulls_cwd.mkdir()
+    (pulls_cwd / "4.json").write_text(
+        json.dumps({"number": 4, "comment_data": [{"id": 60, "body": "old"}]})
+    )
+
+    args = github_backup.parse_args(
+        ["owner", "--pulls", "--pull-comments", "--bulk-comments"]
+    )
+    args.since = "2024-02-01T00:00:00Z"
+    with patch.object(github_backup, "retrieve_data_gen", retrieve_data_gen):
+        github_backup.backup_pulls(args, str(tmp_path), REPOSITORY, REPOS_TEMPLATE)
+
+    with open(str(pulls_cwd / "3.json")) as f:
+        pull = json.load(f)
+    assert [c["body"] for c in pull["comment_regular_data"]] == ["regular"]
+    assert [c["body"] for c in pull["comment_data"]] == ["review"]
+    # pull request 4 wasn't updated but got a new review comment
+    with open(str(pulls_cwd / "4.json")) as f:
+        assert [c["id"] for c in json.load(f)["comment_data"]] == [60, 80]
+    assert not any(t.endswith("/3/comments") for t in requests)
+
+
+def test_issue_comments_are_listed_once_for_issues_and_pulls(tmp_path):
+    requests = []
+
+    def retrieve_data_gen(args, template, query_args=None, single_request=False):
+        requests.append(template)
+        if template == ISSUES + "/comments":
+            return iter([comment(1, 1), comment(3, 3, body="regular")])
+        if template in (ISSUES, PULLS) and query_args["state"] == "open":
+            return iter(
+                [
+                    {"number": 1, "updated_at": "2024-02-02T00:00:00Z"},
+                    {
+                        "number": 3,
+                        "updated_at": "2024-02-02T00:00:00Z",
+                        "pull_request": {},
+                    },
+                ]
+                if template == ISSUES
+                else [{"number": 3, "updated_at": "2024-02-02T00:00:00Z"}]
+            )
+        return iter([])
+
+    args = github_backup.parse_args(
+        [
+            "owner",
+            "--issues",
+            "--issue-comments",
+            "--pulls",
+            "--pull-comments",
+            "--bulk-comments",
+        ]
+    )
+    args.since = "2024-02-01T00:00:00Z"
+    with patch.object(
+        github_backup, "listing_cache", github_backup.ListingCache()
+    ), patch.object(github_backup, "retrieve_data_gen", retrieve_data_gen):
+        github_backup.backup_issues(args, str(tmp_path), REPOSITORY, REPOS_TEMPLATE)
+        github_backup.backup_pulls(args, str(tmp_path), REPOSITORY, REPOS_TEMPLATE)
+
+    assert requests.count(ISSUES + "/comments") == 1
+    assert [c["id"] for c in read_issue(tmp_path, 1)["comment_data"]] == [1]
+    with open(str(tmp_path / "pulls" / "3.json")) as f:
+        pull = json.load(f)
+    assert [c["body"] for c in pull["comment_regular_data"]] == ["regular"]
+
+
+def test_listing_kept_from_a_later_since_is_not_reused():
+    cache = github_backup.ListingCache()
+    cache.put("owner/repo", "issue_comments", "2024-02-01T00:00:00Z", {1: []})
+    assert cache.take("owner/repo", "issue_comments", "2024-01-01T00:00:00Z") is None
+
+    cache.put("owner/repo", "issue_comments", "2024-01-01T00:00:00Z", {1: []})
+    assert cache.take("owner/repo", "issue_comments", None) is None
+
+    cache.put("owner/repo", "issue_comments", None, {1: []})
+    assert cache.take("owner/repo", "issue_comments", "2024-02-01T00:00:00Z") == {1: []}
+    assert cache.take("owner/repo", "issue_comments", None) is None
@@ -0,0 +1,108 @@
+"""Tests for writing the JSON files compressed with --compress."""
+
+import gzip
+import lzma
+import os
+from unittest.mock import patch
+
+import pytest
+
+from github_backup import github_backup
+
+REPOS_TEMPLATE = "https://api.github.com/repos"
+REPOSITORY = {"full_name": "owner/repo", "name": "repo"}
+
+ISSUES = [
+    {"number": 1, "updated_at": "2024-01-01T00:00:00Z", "title": "Ünïcode 🚀"},
+    {"number": 2, "updated_at": "2024-01-02T00:00:00Z", "labels": []},
+]
+
+OPENERS = {"gz": gzip.open, "xz": lzma.open}
+
+
+def fake_retrieve_data(args, template, query_args=None, single_request=False):
+    return iter([dict(issue) for issue in ISSUES])
+
+
+def backup_issues(repo_cwd, *extra):
+    args = github_backup.parse_args(["owner", "--issues"] + list(extra))
+    args.since = None
+    with patch.object(github_backup, "retrieve_data_gen", fake_retrieve_data):
+        github_backup.backup_issues(args, repo_cwd, REPOSITORY, REPOS_TEMPLATE)
+
+
+def issue_files(repo_cwd):
+    return sorted(
+        name
+        for name in os.listdir(os.path.join(repo_cwd, "issues"))
+        if not name.startswith(".")
+    )
+
+
+@pytest.mark.parametrize("compression", ["gz", "xz"])
+def test_issues_are_written_compressed(tmp_path, compression):
+    repo_cwd = str(tmp_path)
+    backup_issues(repo_cwd, "--compress", compression)
+
+    suffix = "." + compression
+    assert issue_files(repo_cwd) == ["1.json" + suffix, "2.json" + suffix]
+    path = os.path.join(repo_cwd, "issues", "1.json" + suffix)
+    with OPENERS[compression](path, "rt", encoding="utf-8") as f:
+        content = f.read()
+    assert content == github_backup.json_dumps(ISSUES[0])
+    # the readers find the file under its uncompressed name
+    store = github_backup.FileCollection(os.path.join(repo_cwd, "issues"))
+    assert store.contains("1.json")
+    assert store.get("1.json") == ISSUES[0]
+
+
+def test_unchanged_compressed_files_are_not_rewritten(tmp_path):
+    repo_cwd = str(tmp_path)
+    backup_issues(repo_cwd, "--compress", "gz")
+    path = os.path.join(repo_cwd, "issues", "1.json.gz")
+    with open(path, "rb") as f:
+        first = f.read()
+    os.utime(path, (0, 0))
+
+    backup_issues(repo_cwd, "--compress", "gz")
+
+    assert os.stat(path).st_mtime == 0
+    with open(path, "rb") as f:
+        assert f.read() == first
+
+
+def test_switching_compression_replaces_files(tmp_path):
+    repo_cwd = str(tmp_path)
+    backup_issues(repo_cwd)
+    backup_issues(repo_cwd, "--compress", "xz")
+    assert issue_files(repo_cwd) == ["1.json.xz", "2.json.xz"]
+
+    backup_issues(repo_cwd)
+    assert issue_files(repo_cwd) == ["1.json", "2.json"]
+    index = github_backup.FileIndex(os.path.join(repo_cwd, "issues"))
+    assert index.get("1.json.xz") is None
+    assert index.get("1.json") is not None
+
+
+def test_index_is_rebuilt_from_compressed_files(tmp_path):
+    directory = str(tmp_path)
+    content = github_backup.json_dumps(ISSUES[0])
+    with gzip.open(os.path.join(directory, "1.json.gz"), "wt") as f:
+        f.write(content)
+
+    index = github_backup.FileIndex(directory)
+
+    assert index.holds("1.json.gz", content.encode("utf-8"))
+    assert index.get("1.json.gz")["updated_at"] == ISSUES[0]["updated_at"]
+
+
+def test_export_writes_compressed_files(tmp_path):
+    repo_cwd = str(tmp_path)
+    backup_issues(repo_cwd, "--storage", "sqlite")
+
+    github_backup.export_sqlite_archives(repo_cwd, "gz")
+
+    assert issue_files(repo_cwd) == ["1.json.gz", "2.json.gz"]
+    assert github_backup.read_json_file(os.path.join(repo_cwd, "issues", "2.json")) == (
+        ISSUES[1]
+    )
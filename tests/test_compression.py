@@ -0,0 +1,101 @@
+"""Tests for compressed API response decoding."""
+
+import gzip
+import io
+import json
+import zlib
+from unittest.mock import Mock, patch
+
+import pytest
+
+from github_backup import github_backup
+
+PAYLOAD = json.dumps([{"number": i, "body": "x" * 200} for i in range(100)]).encode(
+    "utf-8"
+)
+
+
+class MockHTTPResponse:
+    def __init__(self, body, encoding=None):
+        self._body = io.BytesIO(body)
+        self.headers = {"Content-Encoding": encoding} if encoding else {}
+        self.reason = "OK"
+
+    def getcode(self):
+        return 200
+
+    def read(self, amt=None):
+        return self._body.read(amt)
+
+
+def raw_deflate(data):
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+@pytest.fixture
+def statistics():
+    statistics = github_backup.RunStatistics()
+    with patch.object(github_backup, "run_statistics", statistics):
+        yield statistics
+
+
+class TestDecodingResponse:
+    @pytest.mark.parametrize(
+        "encoding,body",
+        [
+            ("gzip", gzip.compress(PAYLOAD)),
+            ("deflate", zlib.compress(PAYLOAD)),
+            ("deflate", raw_deflate(PAYLOAD)),
+            (None, PAYLOAD),
+        ],
+    )
+    def test_read_decodes_body(self, statistics, encoding, body):
+        response = github_backup._DecodingResponse(MockHTTPResponse(body, encoding))
+
+        assert response.read() == PAYLOAD
+        assert statistics.get("api_wire_bytes") == len(body)
+        assert statistics.get("api_decoded_bytes") == len(PAYLOAD)
+
+    def test_read_in_chunks(self, statistics):
+        body = gzip.compress(PAYLOAD)
+        response = github_backup._DecodingResponse(MockHTTPResponse(body, "gzip"))
+
+        chunks = []
+        while True:
+            chunk = response.read(128)
+            if not chunk:
+                break
+            chunks.append(chunk)
+
+        assert b"".join(chunks) == PAYLOAD
+        assert statistics.get("api_wire_bytes") == len(body)
+
+
+def test_retrieve_data_requests_and_decodes_gzip(statistics):
+    args = Mock()
+    args.as_app = False
+    args.token_fine = None
+    args.token_classic = "fake_token"
+    args.username = None
+    args.password = None
+    args.osx_keychain_item_name = None
+    args.osx_keychain_item_account = None
+    args.throttle_limit = None
+    args.throttle_pause = 0
+
+    requests_made = []
+
+    def mock_urlopen(request, *args, **kwargs):
+        requests_made.append(request)
+        return MockHTTPResponse(gzip.compress(PAYLOAD), "gzip")
+
+    with patch.object(
+        github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+    ):
+        results = github_backup.retrieve_data(
+            args, "https://api.github.com/repos/owner/repo/issues"
+        )
+
+    assert results == json.loads(PAYLOAD)
+    assert requests_made[0].get_header("Accept-encoding") == "gzip, deflate"
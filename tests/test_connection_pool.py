@@ -0,0 +1,143 @@
+"""Tests for the keep-alive connection pool."""
+
+import gc
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import Mock, patch
+from urllib.error import HTTPError
+from urllib.request import Request
+
+import pytest
+
+from github_backup import github_backup
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.seen.append((self.path, self.headers.get("Authorization")))
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/target")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.path.startswith("/cached") and self.headers.get("If-None-Match"):
+            self.send_response(304)
+            self.send_header("ETag", '"cached"')
+            self.end_headers()
+            return
+
+        status = 404 if self.path.startswith("/missing") else 200
+        body = b"[]" if self.path.startswith("/cached") else self.path.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"cached"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    httpd.seen = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def pool():
+    pool = github_backup.ConnectionPool()
+    pool._proxies = {}
+    yield pool
+    pool.close()
+
+
+def url(server, path):
+    return "http://127.0.0.1:{0}{1}".format(server.server_address[1], path)
+
+
+class TestConnectionPool:
+    def test_reuses_connection_for_sequential_requests(self, server, pool):
+        for i in range(3):
+            response = pool.urlopen(Request(url(server, "/page/{0}".format(i))))
+            assert response.read() == "/page/{0}".format(i).encode("utf-8")
+
+        stats = pool.stats()
+        assert stats["requests"] == 3
+        assert stats["connections_opened"] == 1
+        assert stats["connections_reused"] == 2
+
+    def test_unread_response_is_not_reused(self, server, pool):
+        pool.urlopen(Request(url(server, "/unread")))
+        response = pool.urlopen(Request(url(server, "/next")))
+        assert response.read() == b"/next"
+
+        assert pool.stats()["connections_opened"] == 2
+
+    def test_http_error_raised_with_readable_body(self, server, pool):
+        with pytest.raises(HTTPError) as exc_info:
+            pool.urlopen(Request(url(server, "/missing")))
+
+        assert exc_info.value.code == 404
+        assert exc_info.value.read() == b"/missing"
+
+    def test_redirect_keeps_authorization_by_default(self, server, pool):
+        request = Request(url(server, "/redirect"))
+        request.add_header("Authorization", "token secret")
+
+        response = pool.urlopen(request)
+
+        assert response.read() == b"/target"
+        assert response.geturl() == url(server, "/target")
+        assert server.seen[-1] == ("/target", "token secret")
+
+    def test_s3_redirect_handler_strips_authorization(self, server, pool):
+        request = Request(url(server, "/redirect"))
+        request.add_header("Authorization", "token secret")
+
+        response = pool.urlopen(
+            request, redirect_handler=github_backup.S3HTTPRedirectHandler()
+        )
+
+        assert response.read() == b"/target"
+        assert server.seen[-1] == ("/target", None)
+        # the redirect and its target shared one connection
+        assert pool.stats()["connections_opened"] == 1
+
+    @pytest.mark.parametrize("path", ["/cached", "/missing"])
+    def test_error_responses_release_their_connection(
+        self, server, pool, tmp_path, path
+    ):
+        args = Mock()
+        args.as_app = False
+        args.token_fine = None
+        args.token_classic = None
+        args.username = None
+        args.password = None
+        args.osx_keychain_item_name = None
+        args.osx_keychain_item_account = None
+        cache = github_backup.HTTPCache(str(tmp_path))
+
+        with patch.object(github_backup, "connection_pool", pool):
+            with patch.object(github_backup, "http_cache", cache):
+                for _ in range(5):
+                    try:
+                        github_backup.retrieve_data(args, url(server, path))
+                    except Exception:
+                        pass
+                    gc.collect()
+
+        assert pool.stats() == {
+            "requests": 5,
+            "connections_opened": 1,
+            "connections_reused": 4,
+        }
@@ -0,0 +1,158 @@
+"""Tests for the --durability policy of written files."""
+
+import os
+import sqlite3
+from unittest.mock import patch
+
+import pytest
+
+from github_backup import github_backup
+
+REPOSITORY = {"full_name": "owner/repo", "name": "repo"}
+
+
+@pytest.fixture
+def synced():
+    synced = []
+    with patch.object(github_backup, "_fsync", side_effect=synced.append):
+        yield synced
+
+
+def use(mode):
+    return patch.object(
+        github_backup, "durability", github_backup.DurabilityPolicy(mode)
+    )
+
+
+def write(directory, name, data):
+    path = os.path.join(directory, name)
+    github_backup.json_dump_if_changed(data, path)
+    return path
+
+
+def test_nothing_is_synced_by_default(tmp_path, synced):
+    assert github_backup.parse_args(["owner"]).durability == "none"
+    with use("none"):
+        write(str(tmp_path), "1.json", {"number": 1})
+        github_backup.durability.flush()
+
+    assert synced == []
+
+
+def test_strict_syncs_each_file_before_renaming_it(tmp_path, synced):
+    directory = str(tmp_path)
+    with use("strict"):
+        path = write(directory, "1.json", {"number": 1})
+
+    assert synced == [path + ".temp", directory]
+
+
+def test_batch_syncs_files_then_directories_on_flush(tmp_path, synced):
+    first = str(tmp_path / "issues")
+    second = str(tmp_path / "pulls")
+    os.mkdir(first)
+    os.mkdir(second)
+    with use("batch"):
+        paths = [
+            write(first, "1.json", {"number": 1}),
+            write(first, "2.json", {"number": 2}),
+            write(second, "1.json", {"number": 1}),
+        ]
+        # rewriting a file doesn't sync it twice
+        write(first, "1.json", {"number": 1, "title": "edited"})
+        assert synced == []
+
+        github_backup.durability.flush()
+        github_backup.durability.flush()
+
+    assert synced == sorted(paths) + [first, second]
+
+
+def test_batch_is_flushed_before_the_journal_records_progress(tmp_path, synced):
+    events = []
+    journal = github_backup.Journal(str(tmp_path / "journal.jsonl"))
+
+    def backup(directory):
+        write(directory, "1.json", {"number": 1})
+
+    with use("batch"), patch.object(github_backup, "journal", journal):
+        with patch.object(
+            journal, "complete", side_effect=lambda *a: events.append(list(synced))
+        ):
+            github_backup.backup_unit(REPOSITORY, "issues", backup, str(tmp_path))
+            assert events == [] and synced == []
+
+            github_backup.durability.flush()
+
+    assert events == [[str(tmp_path / "1.json"), str(tmp_path)]]
+
+
+@pytest.mark.parametrize("mode,syncs", [("none", 0), ("strict", 2), ("batch", 0)])
+def test_journal_records_follow_durability(tmp_path, synced, mode, syncs):
+    journal = github_backup.Journal(str(tmp_path / "journal.jsonl"))
+    with use(mode):
+        journal.complete("owner/repo", "issues")
+
+    assert len(synced) == syncs
+
+
+@pytest.mark.parametrize("mode,synchronous", [("batch", 1), ("strict", 2)])
+def test_sqlite_synchronous_follows_durability(tmp_path, mode, synchronous):
+    path = str(tmp_path / github_backup.SQLITE_ARCHIVE)
+    with use(mode):
+        connection = github_backup.open_sqlite_archive(path)
+
+    assert connection.execute("PRAGMA synchronous").fetchone() == (synchronous,)
+    connection.close()
+    assert sqlite3.connect(path).execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+@pytest.mark.parametrize("mode", ["batch", "strict"])
+def test_files_and_directories_are_synced(tmp_path, mode):
+    with use(mode):
+        path = write(str(tmp_path), "1.json", {"number": 1})
+        github_backup.durability.flush()
+
+    assert github_backup.read_json_file(path) == {"number": 1}
+
+
+def test_batch_syncs_once_per_repository(tmp_path, synced):
+    args = github_backup.parse_args(
+        ["owner", "--incremental", "--issues", "--pulls", "--durability", "batch"]
+    )
+    repositories = [
+        {
+            "full_name": "owner/repo{0}".format(i),
+            "name": "repo{0}".format(i),
+            "has_wiki": False,
+        }
+        for i in range(3)
+    ]
+    synced_before = []
+
+    def backup(resource):
+        def backup_resource(args, repo_cwd, repository, repos_template):
+            synced_before.append(len(synced))
+            directory = os.path.join(repo_cwd, resource)
+            os.makedirs(directory)
+            write(directory, "1.json", {"number": 1})
+
+        return backup_resource
+
+    with use("none"), patch.object(github_backup, "backup_issues", backup("issues")):
+        with patch.object(github_backup, "backup_pulls", backup("pulls")):
+            github_backup.backup_repositories(args, str(tmp_path), repositories)
+
+    # nothing is synced between the resources of a repository, and once at
+    # its end: its two files and their directories, from the second one on
+    # also watermarks.json advanced after the previous flush and its directory
+    assert synced_before[0::2] == synced_before[1::2]
+    per_repository = [
+        after - before
+        for before, after in zip(
+            synced_before[0::2], synced_before[2::2] + [len(synced)]
+        )
+    ]
+    assert per_repository == [4, 6, 6]
+    watermarks = github_backup.read_json_file(str(tmp_path / "watermarks.json"))
+    assert sorted(watermarks) == ["owner/repo0", "owner/repo1", "owner/repo2"]
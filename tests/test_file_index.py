@@ -0,0 +1,121 @@
+"""Tests for the file index used by --incremental-by-files."""
+
+import hashlib
+import json
+import os
+from unittest.mock import patch
+
+from github_backup import github_backup
+
+REPOS_TEMPLATE = "https://api.github.com/repos"
+REPOSITORY = {"full_name": "owner/repo", "name": "repo"}
+
+LISTING = [
+    {"number": 1, "updated_at": "2024-03-01T00:00:00Z", "title": "changed"},
+    {"number": 2, "updated_at": "2024-01-02T00:00:00Z", "title": "unchanged"},
+]
+
+
+def write_issue(issue_cwd, issue):
+    with open(os.path.join(issue_cwd, "{0}.json".format(issue["number"])), "w") as f:
+        github_backup.json_dump(issue, f)
+
+
+def backup_issues(tmp_path, *flags):
+    args = github_backup.parse_args(["owner", "--issues"] + list(flags))
+    args.since = None
+
+    def retrieve_data_gen(args, template, query_args=None, single_request=False):
+        return iter([dict(issue) for issue in LISTING])
+
+    with patch.object(github_backup, "retrieve_data_gen", retrieve_data_gen):
+        github_backup.backup_issues(args, str(tmp_path), REPOSITORY, REPOS_TEMPLATE)
+
+
+def read_index(issue_cwd):
+    with open(os.path.join(issue_cwd, ".github-backup-index")) as f:
+        return json.load(f)
+
+
+def test_index_is_rebuilt_from_existing_files(tmp_path):
+    issue_cwd = tmp_path / "issues"
+    issue_cwd.mkdir()
+    write_issue(str(issue_cwd), {"number": 1, "updated_at": "2024-01-01T00:00:00Z"})
+    write_issue(str(issue_cwd), dict(LISTING[1], title="stored"))
+
+    backup_issues(tmp_path, "--incremental-by-files")
+
+    with open(str(issue_cwd / "1.json"), "rb") as f:
+        content = f.read()
+    assert json.loads(content)["title"] == "changed"
+    with open(str(issue_cwd / "2.json")) as f:
+        assert json.load(f)["title"] == "stored"
+
+    index = read_index(str(issue_cwd))
+    assert sorted(index) == ["1.json", "2.json"]
+    assert index["1.json"] == {
+        "updated_at": "2024-03-01T00:00:00Z",
+        "sha256": hashlib.sha256(content).hexdigest(),
+        "size": len(content),
+    }
+
+
+def test_skips_are_decided_from_the_index(tmp_path):
+    issue_cwd = tmp_path / "issues"
+    issue_cwd.mkdir()
+    index = {
+        "1.json": github_backup.FileIndex.entry(b"{}", "2024-03-01T00:00:00Z"),
+    }
+    with open(str(issue_cwd / ".github-backup-index"), "w") as f:
+        json.dump(index, f)
+    (issue_cwd / "1.json").write_bytes(b"{}")
+
+    with patch.object(github_backup.os.path, "getmtime") as getmtime:
+        backup_issues(tmp_path, "--incremental-by-files")
+
+    getmtime.assert_not_called()
+    # 1.json is in the index at the listed updated_at, 2.json isn't
+    assert (issue_cwd / "1.json").read_bytes() == b"{}"
+    assert sorted(os.listdir(str(issue_cwd))) == [
+        ".github-backup-index",
+        "1.json",
+        "2.json",
+    ]
+    assert sorted(read_index(str(issue_cwd))) == ["1.json", "2.json"]
+
+
+def test_removed_files_are_backed_up_again(tmp_path):
+    backup_issues(tmp_path)
+    os.remove(str(tmp_path / "issues" / "1.json"))
+
+    backup_issues(tmp_path, "--incremental-by-files")
+
+    with open(str(tmp_path / "issues" / "1.json")) as f:
+        assert json.load(f)["title"] == "changed"
+
+
+def test_index_of_earlier_versions_is_replaced(tmp_path):
+    issue_cwd = tmp_path / "issues"
+    issue_cwd.mkdir()
+    write_issue(str(issue_cwd), LISTING[1])
+    (issue_cwd / ".index.json").write_text(json.dumps({"2.json": {}}))
+
+    backup_issues(tmp_path, "--incremental-by-files")
+
+    assert sorted(os.listdir(str(issue_cwd))) == [
+        ".github-backup-index",
+        "1.json",
+        "2.json",
+    ]
+
+
+def test_unchanged_issues_are_not_written_again(tmp_path, caplog):
+    backup_issues(tmp_path)
+    issue_file = str(tmp_path / "issues" / "1.json")
+    os.utime(issue_file, (0, 0))
+
+    with caplog.at_level("INFO", logger=github_backup.logger.name):
+        backup_issues(tmp_path)
+
+    assert os.path.getmtime(issue_file) == 0
+    assert "2 issues unchanged, skipped write" in caplog.messages
@@ -0,0 +1,442 @@
+"""Tests for backing up issues and pull requests through the GraphQL API."""
+
+import base64
+import io
+import json
+import os
+from http.client import HTTPMessage
+from unittest.mock import Mock, patch
+
+import pytest
+
+from github_backup import github_backup
+
+REPOS_TEMPLATE = "https://api.github.com/repos"
+REPOSITORY = {"full_name": "owner/repo", "name": "repo"}
+
+
+def actor(login, database_id=1):
+    return {
+        "__typename": "User",
+        "login": login,
+        "avatarUrl": "https://avatars.example/" + login,
+        "url": "https://github.com/" + login,
+        "id": "U_" + login,
+        "databaseId": database_id,
+    }
+
+
+def page(nodes, cursor=None):
+    return {
+        "pageInfo": {"hasNextPage": cursor is not None, "endCursor": cursor},
+        "nodes": nodes,
+    }
+
+
+def comment(database_id, body):
+    return {
+        "id": "IC_{0}".format(database_id),
+        "databaseId": database_id,
+        "body": body,
+        "createdAt": "2024-01-01T00:00:00Z",
+        "updatedAt": "2024-01-01T00:00:00Z",
+        "url": "https://github.com/owner/repo/issues/1#issuecomment-{0}".format(
+            database_id
+        ),
+        "authorAssociation": "MEMBER",
+        "author": actor("commenter", 2),
+        "reactionGroups": [
+            {"content": "THUMBS_UP", "reactors": {"totalCount": 2}},
+            {"content": "HEART", "reactors": {"totalCount": 1}},
+        ],
+    }
+
+
+def item(number, **extra):
+    node = {
+        "id": "I_{0}".format(number),
+        "databaseId": number * 100,
+        "number": number,
+        "title": "Item {0}".format(number),
+        "body": "body",
+        "state": "CLOSED",
+        "stateReason": "COMPLETED",
+        "locked": False,
+        "activeLockReason": None,
+        "createdAt": "2024-01-01T00:00:00Z",
+        "updatedAt": "2024-01-02T00:00:00Z",
+        "closedAt": "2024-01-02T00:00:00Z",
+        "url": "https://github.com/owner/repo/issues/{0}".format(number),
+        "authorAssociation": "OWNER",
+        "author": actor("author"),
+        "assignees": {"nodes": [actor("assignee", 3)]},
+        "labels": {
+            "nodes": [
+                {
+                    "id": "LA_1",
+                    "name": "bug",
+                    "color": "d73a4a",
+                    "description": "Something isn't working",
+                    "isDefault": True,
+                }
+            ]
+        },
+        "milestone": None,
+        "commentCount": {"totalCount": 3},
+        "reactionGroups": [],
+    }
+    node.update(extra)
+    return node
+
+
+RATE_LIMIT = {
+    "cost": 1,
+    "limit": 5000,
+    "remaining": 4999,
+    "resetAt": "2024-01-01T01:00:00Z",
+    "used": 1,
+}
+
+
+def fake_graphql(responses):
+    """Answer queries in order, recording (query, variables)."""
+    queries = []
+
+    def graphql_query(args, query, variables):
+        queries.append((query, dict(variables)))
+        return responses.pop(0)
+
+    return queries, graphql_query
+
+
+def make_args(*extra):
+    args = github_backup.parse_args(["owner", "--api", "graphql"] + list(extra))
+    args.since = None
+    return args
+
+
+def read_items(path):
+    items = {}
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".json") and not name.startswith("."):
+            with open(os.path.join(path, name)) as f:
+                items[name] = json.load(f)
+    return items
+
+
+def test_issues_with_comments_and_events_in_rest_schema(tmp_path):
+    issue = item(
+        1,
+        comments=page([comment(11, "first")], cursor="C1"),
+        timelineItems=page(
+            [
+                {
+                    "__typename": "LabeledEvent",
+                    "id": "LE_1",
+                    "createdAt": "2024-01-01T00:00:00Z",
+                    "actor": actor("author"),
+                    "label": {"name": "bug", "color": "d73a4a"},
+                },
+                {
+                    "__typename": "ClosedEvent",
+                    "id": "CE_1",
+                    "createdAt": "2024-01-02T00:00:00Z",
+                    "actor": actor("author"),
+                    "stateReason": "COMPLETED",
+                    "closer": {"oid": "abc123"},
+                },
+            ]
+        ),
+    )
+    responses = [
+        {
+            "rateLimit": RATE_LIMIT,
+            "repository": {"issues": page([issue])},
+        },
+        {
+            "rateLimit": RATE_LIMIT,
+            "node": {"comments": page([comment(12, "second")])},
+        },
+    ]
+    queries, graphql_query = fake_graphql(responses)
+    args = make_args("--issues", "--issue-comments", "--issue-events", "--pulls")
+
+    with patch.object(github_backup, "graphql_query", side_effect=graphql_query):
+        github_backup.backup_issues(args, str(tmp_path), REPOSITORY, REPOS_TEMPLATE)
+
+    # one listing query, one for the second page of comments
+    assert len(queries) == 2
+    assert "issues(first: 25" in queries[0][0]
+    assert queries[1][1] == {"id": "I_1", "cursor": "C1"}
+
+    issue = read_items(str(tmp_path / "issues"))["1.json"]
+    assert issue["id"] == 100
+    assert issue["number"] == 1
+    assert issue["state"] == "closed"
+    assert issue["state_reason"] == "completed"
+    assert issue["comments"] == 3
+    assert issue["user"]["login"] == "author"
+    assert issue["assignee"]["login"] == "assignee"
+    assert issue["labels"][0]["name"] == "bug"
+    assert issue["url"] == "https://api.github.com/repos/owner/repo/issues/1"
+    assert "pull_request" not in issue
+
+    assert [c["body"] for c in issue["comment_data"]] == ["first", "second"]
+    first_comment = issue["comment_data"][0]
+    assert first_comment["id"] == 11
+    assert first_comment["user"]["login"] == "commenter"
+    assert first_comment["reactions"]["+1"] == 2
+    assert first_comment["reactions"]["total_count"] == 3
+
+    assert [e["event"] for e in issue["event_data"]] == ["labeled", "closed"]
+    assert issue["event_data"][0]["label"] == {"name": "bug", "color": "d73a4a"}
+    assert issue["event_data"][1]["commit_id"] == "abc123"
+
+
+def test_pull_requests_are_listed_as_issues_without_pulls(tmp_path):
+    pull = item(2, mergedAt="2024-01-02T00:00:00Z", isDraft=False, state="MERGED")
+    del pull["stateReason"]
+    responses = [
+        {"rateLimit": RATE_LIMIT, "repository": {"issues": page([item(1)])}},
+        {"rateLimit": RATE_LIMIT, "repository": {"pullRequests": page([pull])}},
+    ]
+    queries, graphql_query = fake_graphql(responses)
+    args = make_args("--issues")
+
+    with patch.object(github_backup, "graphql_query", side_effect=graphql_query):
+        github_backup.backup_issues(args, str(tmp_path), REPOSITORY, REPOS_TEMPLATE)
+
+    issues = read_items(str(tmp_path / "issues"))
+    assert sorted(issues) == ["1.json", "2.json"]
+    assert issues["2.json"]["pull_request"]["merged_at"] == "2024-01-02T00:00:00Z"
+    assert issues["2.json"]["state"] == "closed"
+
+
+def test_pulls_with_review_comments_and_commits(tmp_path):
+    review_comment = dict(
+        comment(21, "review"),
+        diffHunk="@@ -1 +1 @@",
+        path="README.md",
+        line=1,
+        originalLine=1,
+        startLine=None,
+        originalStartLine=None,
+        commit={"oid": "head"},
+        originalCommit={"oid": "head"},
+        replyTo=None,
+        pullRequestReview={"databaseId": 5},
+    )
+    pull = item(
+        3,
+        mergedAt=None,
+        isDraft=True,
+        state="OPEN",
+        headRefName="feature",
+        headRefOid="head",
+        baseRefName="main",
+        baseRefOid="base",
+        headRepository={"nameWithOwner": "fork/repo"},
+        headRepositoryOwner={"login": "fork"},
+        mergeCommit=None,
+        reviewRequests={"nodes": [{"requestedReviewer": actor("reviewer", 4)}]},
+        comments=page([comment(11, "regular")]),
+        reviewThreads=page(
+            [
+                {
+                    "id": "T_1",
+                    "diffSide": "RIGHT",
+                    "startDiffSide": None,
+                    "subjectType": "LINE",
+                    "comments": page([review_comment]),
+                }
+            ]
+        ),
+        commits=page(
+            [
+                {
+                    "commit": {
+                        "id": "C_1",
+                        "oid": "head",
+                        "message": "Add feature",
+                        "url": "https://github.com/owner/repo/commit/head",
+                        "authoredDate": "2024-01-01T00:00:00Z",
+                        "committedDate": "2024-01-01T00:00:00Z",
+                        "author": {
+                            "name": "A",
+                            "email": "a@example.com",
+                            "date": "2024-01-01T00:00:00Z",
+                            "user": actor("author"),
+                        },
+                        "committer": {
+                            "name": "A",
+                            "email": "a@example.com",
+                            "date": "2024-01-01T00:00:00Z",
+                            "user": None,
+                        },
+                        "tree": {"oid": "tree"},
+                        "parents": {
+                            "nodes": [
+                                {
+                                    "oid": "base",
+                                    "url": "https://github.com/owner/repo/commit/base",
+                                }
+                            ]
+                        },
+                    }
+                }
+            ]
+        ),
+    )
+    del pull["stateReason"]
+    responses = [
+        {"rateLimit": RATE_LIMIT, "repository": {"pullRequests": page([pull])}}
+    ]
+    queries, graphql_query = fake_graphql(responses)
+    args = make_args("--pulls", "--pull-comments", "--pull-commits")
+
+    with patch.object(github_backup, "graphql_query", side_effect=graphql_query):
+        github_backup.backup_pulls(args, str(tmp_path), REPOSITORY, REPOS_TEMPLATE)
+
+    pull = read_items(str(tmp_path / "pulls"))["3.json"]
+    assert pull["state"] == "open"
+    assert pull["draft"] is True
+    assert pull["head"] == {
+        "label": "fork:feature",
+        "ref": "feature",
+        "sha": "head",
+        "user": {"login": "fork"},
+        "repo": {"full_name": "fork/repo"},
+    }
+    assert pull["base"]["sha"] == "base"
+    assert pull["requested_reviewers"][0]["login"] == "reviewer"
+    assert [c["body"] for c in pull["comment_regular_data"]] == ["regular"]
+    assert pull["comment_data"][0]["path"] == "README.md"
+    assert pull["comment_data"][0]["side"] == "RIGHT"
+    assert pull["comment_data"][0]["pull_request_review_id"] == 5
+    assert pull["commit_data"][0]["sha"] == "head"
+    assert pull["commit_data"][0]["commit"]["message"] == "Add feature"
+    assert pull["commit_data"][0]["parents"][0]["sha"] == "base"
+
+
+@pytest.fixture
+def mock_args():
+    args = Mock()
+    args.as_app = False
+    args.token_fine = None
+    args.token_classic = "fake_token"
+    args.username = None
+    args.password = None
+    args.osx_keychain_item_name = None
+    args.osx_keychain_item_account = None
+    args.github_host = None
+    return args
+
+
+def serve(payload, requests_made):
+    def mock_urlopen(request, *args, **kwargs):
+        requests_made.append(request)
+        response = Mock(headers=HTTPMessage(), reason="OK")
+        response.getcode.return_value = 200
+        response.read = io.BytesIO(json.dumps(payload).encode("utf-8")).read
+        return response
+
+    return patch.object(
+        github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+    )
+
+
+def test_graphql_query_records_rate_limit_cost(mock_args):
+    rate_limit = dict(RATE_LIMIT, cost=7, remaining=4321)
+    payload = {"data": {"rateLimit": rate_limit, "viewer": {}}}
+    requests_made = []
+
+    governor = github_backup.RateLimitGovernor()
+    statistics = github_backup.RunStatistics()
+    with patch.object(github_backup, "rate_limit_governor", governor):
+        with patch.object(github_backup, "run_statistics", statistics):
+            with serve(payload, requests_made):
+                github_backup.graphql_query(mock_args, "query { viewer { login } }", {})
+
+    assert requests_made[0].get_method() == "POST"
+    assert requests_made[0].get_full_url() == "https://api.github.com/graphql"
+    assert statistics.get("graphql_cost") == 7
+    limits = governor.stats()["limits"]
+    assert [resource for _, resource in limits] == ["graphql"]
+    assert [state["remaining"] for state in limits.values()] == [4321]
+
+
+def test_graphql_errors_without_data_are_raised(mock_args):
+    payload = {"data": None, "errors": [{"message": "Bad credentials"}]}
+
+    with serve(payload, []):
+        with pytest.raises(Exception, match="Bad credentials"):
+            github_backup.graphql_query(mock_args, "query { viewer { login } }", {})
+
+
+def msgpack_node_id(prefix, *numbers):
+    data = bytes([0x90 | len(numbers)])
+    for number in numbers:
+        data += (
+            number.to_bytes(1, "big")
+            if number < 0x80
+            else b"\xce" + number.to_bytes(4, "big")
+        )
+    return prefix + "_" + base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+@pytest.mark.parametrize(
+    "node_id,database_id",
+    [
+        (msgpack_node_id("LE", 0, 123456, 7654321), 7654321),
+        (base64.b64encode(b"012:LabeledEvent12345").decode("ascii"), 12345),
+        ("LE_1", None),
+        ("not base64!", None),
+        (None, None),
+    ],
+)
+def test_database_ids_are_decoded_from_node_ids(node_id, database_id):
+    assert github_backup._database_id(node_id) == database_id
+
+
+def test_converted_events_and_labels_have_rest_ids():
+    repo_url = REPOS_TEMPLATE + "/owner/repo"
+    event = github_backup.graphql_event_to_rest(
+        {
+            "__typename": "LabeledEvent",
+            "id": msgpack_node_id("LE", 0, 123456, 7654321),
+            "createdAt": "2024-01-01T00:00:00Z",
+            "actor": actor("author"),
+            "label": {"name": "bug", "color": "d73a4a"},
+        },
+        repo_url,
+        "https://api.github.com",
+        1,
+    )
+    labels = github_backup._rest_labels(
+        {
+            "labels": {
+                "nodes": [
+                    dict(
+                        item(1)["labels"]["nodes"][0],
+                        id=msgpack_node_id("LA", 0, 123456, 42),
+                    )
+                ]
+            }
+        },
+        repo_url,
+    )
+
+    assert event["id"] == 7654321
+    assert event["url"] == repo_url + "/issues/events/7654321"
+    assert labels[0]["id"] == 42
+
+
+def test_items_without_id_are_kept_when_merging():
+    stored = [{"id": None, "event": "labeled"}, {"id": 2, "event": "closed"}]
+    changed = [{"id": 3, "event": "reopened"}, {"id": 2, "event": "closed again"}]
+
+    assert github_backup.merge_by_id(stored, changed) == [
+        {"id": None, "event": "labeled"},
+        {"id": 2, "event": "closed again"},
+        {"id": 3, "event": "reopened"},
+    ]
@@ -0,0 +1,147 @@
+"""Tests for the ETag / Last-Modified HTTP cache."""
+
+import json
+from http.client import HTTPMessage
+from unittest.mock import Mock, patch
+from urllib.error import HTTPError
+
+import pytest
+
+from github_backup import github_backup
+
+
+def make_headers(values):
+    headers = HTTPMessage()
+    for name, value in values.items():
+        headers[name] = value
+    return headers
+
+
+class MockHTTPResponse:
+    def __init__(self, data, headers):
+        self._content = json.dumps(data).encode("utf-8")
+        self.headers = make_headers(headers)
+        self.reason = "OK"
+
+    def getcode(self):
+        return 200
+
+    def read(self):
+        content, self._content = self._content, b""
+        return content
+
+
+@pytest.fixture
+def mock_args():
+    args = Mock()
+    args.as_app = False
+    args.token_fine = None
+    args.token_classic = "fake_token"
+    args.username = None
+    args.password = None
+    args.osx_keychain_item_name = None
+    args.osx_keychain_item_account = None
+    args.throttle_limit = None
+    args.throttle_pause = 0
+    return args
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = github_backup.HTTPCache(str(tmp_path / ".http_cache"))
+    with patch.object(github_backup, "http_cache", cache):
+        yield cache
+
+
+PAGE_2 = "https://api.github.com/repos/owner/repo/labels?per_page=100&page=2"
+
+
+def first_run_response(request):
+    if request.get_full_url() == PAGE_2:
+        return MockHTTPResponse([{"label": 2}], {"ETag": '"page2"'})
+    return MockHTTPResponse(
+        [{"label": 1}],
+        {"ETag": '"page1"', "Link": '<{0}>; rel="next"'.format(PAGE_2)},
+    )
+
+
+def second_run_response(request):
+    headers = make_headers({"x-ratelimit-remaining": "4999"})
+    raise HTTPError(request.get_full_url(), 304, "Not Modified", headers, None)
+
+
+def retrieve(mock_args, side_effect):
+    requests_made = []
+
+    def mock_urlopen(request, *args, **kwargs):
+        requests_made.append(request)
+        return side_effect(request)
+
+    with patch.object(
+        github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+    ):
+        results = github_backup.retrieve_data(
+            mock_args, "https://api.github.com/repos/owner/repo/labels"
+        )
+    return results, requests_made
+
+
+class TestHTTPCache:
+    def test_not_modified_pages_are_replayed(self, mock_args, cache):
+        first, _ = retrieve(mock_args, first_run_response)
+        second, requests_made = retrieve(mock_args, second_run_response)
+
+        assert first == [{"label": 1}, {"label": 2}]
+        assert second == first
+        # the cached Link header drove pagination to the cursor URL
+        assert len(requests_made) == 2
+        assert requests_made[1].get_full_url() == PAGE_2
+        assert requests_made[0].get_header("If-none-match") == '"page1"'
+        assert requests_made[1].get_header("If-none-match") == '"page2"'
+        assert cache.stats() == {"conditional_requests": 2, "not_modified": 2}
+
+    def test_replayed_pages_are_read_once_and_not_stored_again(self, mock_args, cache):
+        retrieve(mock_args, first_run_response)
+
+        with patch.object(cache, "get", wraps=cache.get) as get:
+            with patch.object(cache, "store", wraps=cache.store) as store:
+                retrieve(mock_args, second_run_response)
+
+        assert get.call_count == 2
+        store.assert_not_called()
+
+    def test_fresh_link_header_of_not_modified_page_is_kept(self, mock_args, cache):
+        retrieve(mock_args, first_run_response)
+        page_3 = PAGE_2.replace("page=2", "page=3")
+
+        def response(request):
+            # Both cached pages are unchanged, but a third one was added
+            url = request.get_full_url()
+            if url == page_3:
+                return MockHTTPResponse([{"label": 3}], {"ETag": '"page3"'})
+            next_url = page_3 if url == PAGE_2 else PAGE_2
+            link = '<{0}>; rel="next", <{1}>; rel="last"'.format(next_url, page_3)
+            headers = make_headers({"x-ratelimit-remaining": "4999", "Link": link})
+            raise HTTPError(url, 304, "Not Modified", headers, None)
+
+        second, _ = retrieve(mock_args, response)
+
+        assert second == [{"label": 1}, {"label": 2}, {"label": 3}]
+        assert cache.stats()["not_modified"] == 2
+
+    def test_no_conditional_headers_without_cache_entry(self, mock_args, cache):
+        _, requests_made = retrieve(mock_args, first_run_response)
+
+        assert not requests_made[0].has_header("If-none-match")
+        assert cache.stats()["conditional_requests"] == 0
+
+    def test_responses_without_validators_are_not_cached(self, mock_args, cache):
+        def response(request):
+            return MockHTTPResponse([{"label": 1}], {})
+
+        retrieve(mock_args, response)
+
+        assert (
+            cache.get("https://api.github.com/repos/owner/repo/labels?per_page=100")
+            is None
+        )
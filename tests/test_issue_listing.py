@@ -0,0 +1,128 @@
+"""Tests for the single-pass issue listing."""
+
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+
+from github_backup import github_backup
+
+REPOS_TEMPLATE = "https://api.github.com/repos"
+REPOSITORY = {"full_name": "owner/repo", "name": "repo"}
+ISSUES = REPOS_TEMPLATE + "/owner/repo/issues"
+
+LISTING = [
+    {"number": 5, "updated_at": "2024-03-05T00:00:00Z", "state": "open"},
+    {"number": 4, "updated_at": "2024-03-04T00:00:00Z", "pull_request": {}},
+    {"number": 3, "updated_at": "2024-03-03T00:00:00Z", "state": "closed"},
+    {"number": 2, "updated_at": "2024-01-02T00:00:00Z", "state": "closed"},
+    {"number": 1, "updated_at": "2024-01-01T00:00:00Z", "state": "open"},
+]
+
+
+def backup_issues(tmp_path, since, *extra):
+    args = github_backup.parse_args(
+        ["owner", "--issues", "--single-pass-issues"] + list(extra)
+    )
+    args.since = since
+    requests = []
+    consumed = []
+
+    def listing():
+        for issue in LISTING:
+            consumed.append(issue["number"])
+            yield dict(issue)
+
+    def retrieve_data_gen(args, template, query_args=None, single_request=False):
+        requests.append((template, query_args))
+        return listing()
+
+    with patch.object(github_backup, "retrieve_data_gen", retrieve_data_gen):
+        github_backup.backup_issues(args, str(tmp_path), REPOSITORY, REPOS_TEMPLATE)
+
+    return requests, consumed, item_files(tmp_path)
+
+
+def item_files(tmp_path):
+    return sorted(
+        name
+        for name in os.listdir(str(tmp_path / "issues"))
+        if not name.startswith(".")
+    )
+
+
+def test_lists_all_states_once_by_update(tmp_path):
+    requests, consumed, files = backup_issues(tmp_path, None)
+
+    assert requests == [
+        (
+            ISSUES,
+            {"filter": "all", "state": "all", "sort": "updated", "direction": "desc"},
+        )
+    ]
+    assert consumed == [5, 4, 3, 2, 1]
+    assert files == ["1.json", "2.json", "3.json", "4.json", "5.json"]
+
+
+def test_stops_at_first_issue_older_than_last_run(tmp_path, caplog):
+    with caplog.at_level("INFO", logger=github_backup.logger.name):
+        requests, consumed, files = backup_issues(
+            tmp_path, "2024-02-01T00:00:00Z", "--pulls"
+        )
+
+    assert consumed == [5, 4, 3, 2]
+    # the pull request is skipped and counted like with the default listing
+    assert files == ["3.json", "5.json"]
+    assert "Saved 2 issues to disk (skipped 1 pull requests)" in caplog.messages
+
+
+def test_issues_are_written_while_listing(tmp_path):
+    args = github_backup.parse_args(["owner", "--issues", "--single-pass-issues"])
+    args.since = None
+    written = []
+
+    def retrieve_data_gen(args, template, query_args=None, single_request=False):
+        for issue in LISTING:
+            # issues listed before are on disk before the next page is read
+            written.append(item_files(tmp_path))
+            yield dict(issue)
+
+    with patch.object(github_backup, "retrieve_data_gen", retrieve_data_gen):
+        github_backup.backup_issues(args, str(tmp_path), REPOSITORY, REPOS_TEMPLATE)
+
+    assert written[:3] == [[], ["5.json"], ["4.json", "5.json"]]
+
+
+@pytest.mark.parametrize("engine", ["sync", "async"])
+@pytest.mark.parametrize(
+    "closed_at", ["2024-03-02T00:00:00Z", "2024-03-01T00:00:00Z"], ids=["newer", "tie"]
+)
+def test_issue_in_both_listings_keeps_the_closed_copy(tmp_path, engine, closed_at):
+    args = github_backup.parse_args(["owner", "--issues", "--engine", engine])
+    args.since = None
+    listings = {
+        "open": [{"number": 7, "updated_at": "2024-03-01T00:00:00Z", "state": "open"}],
+        "closed": [{"number": 7, "updated_at": closed_at, "state": "closed"}],
+    }
+
+    def retrieve_data_gen(args, template, query_args=None, single_request=False):
+        return iter([dict(issue) for issue in listings[query_args["state"]]])
+
+    with patch.object(github_backup, "retrieve_data_gen", retrieve_data_gen):
+        github_backup.backup_issues(args, str(tmp_path), REPOSITORY, REPOS_TEMPLATE)
+
+    with open(str(tmp_path / "issues" / "7.json")) as f:
+        assert json.load(f)["state"] == "closed"
+
+
+def test_stale_copy_listed_later_is_ignored(tmp_path):
+    items = [
+        (1, {"number": 7, "updated_at": "2024-03-02T00:00:00Z", "state": "closed"}),
+        (0, {"number": 7, "updated_at": "2024-03-01T00:00:00Z", "state": "open"}),
+        (0, {"number": 8, "updated_at": "2024-03-01T00:00:00Z", "state": "open"}),
+    ]
+
+    newest = list(github_backup.newest_copies(iter(items), {}))
+
+    assert [item["state"] for _, item in newest] == ["closed", "open"]
@@ -0,0 +1,91 @@
+"""Tests for the run journal and resuming interrupted runs."""
+
+from unittest.mock import patch
+
+import pytest
+
+from github_backup import github_backup
+
+REPOSITORIES = [
+    {
+        "full_name": "owner/repo{0}".format(i),
+        "name": "repo{0}".format(i),
+        "has_wiki": False,
+        "clone_url": "https://github.com/owner/repo{0}.git".format(i),
+    }
+    for i in range(2)
+]
+
+
+@pytest.fixture(autouse=True)
+def no_journal():
+    # open_journal sets up the journal and durability of the module
+    with patch.object(github_backup, "journal", None), patch.object(
+        github_backup, "durability", github_backup.DurabilityPolicy()
+    ):
+        yield
+
+
+def make_args(*extra):
+    return github_backup.parse_args(["owner", "--issues", "--pulls"] + list(extra))
+
+
+def test_interrupted_run_is_resumed(tmp_path):
+    journal = github_backup.open_journal(make_args("--resume"), str(tmp_path))
+    journal.start(REPOSITORIES)
+    journal.complete("owner/repo0", "issues")
+    # a record cut off by the interruption
+    with open(str(tmp_path / "journal.jsonl"), "a") as f:
+        f.write('{"repository": "owner/re')
+
+    journal = github_backup.open_journal(make_args("--resume"), str(tmp_path))
+
+    assert journal.repositories == REPOSITORIES
+    assert journal.completed("owner/repo0", "issues")
+    assert not journal.completed("owner/repo0", "pulls")
+
+
+def test_journal_is_only_kept_with_resume(tmp_path):
+    assert github_backup.open_journal(make_args(), str(tmp_path)) is None
+    assert github_backup.journal is None
+    assert not (tmp_path / "journal.jsonl").exists()
+
+
+def test_finished_runs_start_over(tmp_path):
+    journal = github_backup.open_journal(make_args("--resume"), str(tmp_path))
+    journal.start(REPOSITORIES)
+    journal.complete("owner/repo0", "issues")
+    journal.finish()
+    journal = github_backup.open_journal(make_args("--resume"), str(tmp_path))
+    assert journal.repositories is None
+
+
+def test_completed_resources_are_skipped(tmp_path):
+    journal = github_backup.Journal(str(tmp_path / "journal.jsonl"))
+    journal.start(REPOSITORIES)
+    journal.complete("owner/repo0", "issues")
+    args = make_args()
+    args.since = None
+    backed_up = []
+
+    def backup(resource):
+        def backup_resource(args, repo_cwd, repository, repos_template):
+            backed_up.append((repository["full_name"], resource))
+
+        return backup_resource
+
+    with patch.object(github_backup, "journal", journal):
+        with patch.object(github_backup, "backup_issues", backup("issues")):
+            with patch.object(github_backup, "backup_pulls", backup("pulls")):
+                for repository in REPOSITORIES:
+                    github_backup.backup_repository(
+                        args, str(tmp_path), repository, "https://api.github.com"
+                    )
+
+    assert backed_up == [
+        ("owner/repo0", "pulls"),
+        ("owner/repo1", "issues"),
+        ("owner/repo1", "pulls"),
+    ]
+    resumed = github_backup.Journal(str(tmp_path / "journal.jsonl"))
+    assert resumed.completed("owner/repo1", "pulls")
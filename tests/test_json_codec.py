@@ -0,0 +1,120 @@
+"""Tests for the JSON codec, which uses orjson when it is installed."""
+
+import json
+import random
+from unittest.mock import patch
+
+import pytest
+
+from github_backup import github_backup
+
+orjson = pytest.importorskip("orjson")
+
+
+def user(login):
+    return {
+        "login": login,
+        "id": 583231,
+        "node_id": "MDQ6VXNlcjU4MzIzMQ==",
+        "avatar_url": "https://avatars.githubusercontent.com/u/583231?v=4",
+        "type": "User",
+        "site_admin": False,
+    }
+
+
+ISSUE = {
+    "number": 1347,
+    "title": 'Found a bug 🐛 — «quotes» and "escapes" \\ / </script>',
+    "body": "Line one\r\nLine two\ttabbed\u0000\u001f\u007f   ﻿"
+    + "".join(chr(i) for i in range(0x20)),
+    "user": user("octocat"),
+    "labels": [
+        {"id": 208045946, "name": "bug", "color": "f29513", "default": True},
+        {"id": 208045947, "name": "日本語", "color": "a2eeef", "default": False},
+    ],
+    "assignees": [],
+    "milestone": None,
+    "pull_request": {},
+    "reactions": {"+1": 3, "-1": 0, "total_count": 3},
+    "locked": False,
+    "comments": 2**40,
+    "id": -(2**63),
+    "unicode_keys": {"é": 1, "e": 2, "Z": 3, "🚀": 4, "￿": 5, "": 6},
+    "nested": [[[]], [{}], [{"a": [{}]}]],
+}
+
+
+def corpus():
+    yield ISSUE
+    yield [ISSUE, user("other")]
+    yield {}
+    yield []
+    yield "string"
+    yield 2**64 - 1
+    yield None
+    yield True
+    rng = random.Random(1347)
+    for _ in range(200):
+        yield random_value(rng, 4)
+
+
+def random_string(rng):
+    return "".join(chr(rng.randrange(0xD7FF)) for _ in range(rng.randrange(8)))
+
+
+def random_value(rng, depth):
+    kind = rng.randrange(6 if depth else 4)
+    if kind == 0:
+        return None
+    if kind == 1:
+        return rng.random() < 0.5
+    if kind == 2:
+        return rng.randint(-(2**63), 2**64 - 1)
+    if kind == 3:
+        return random_string(rng)
+    if kind == 4:
+        return {
+            random_string(rng): random_value(rng, depth - 1)
+            for _ in range(rng.randrange(5))
+        }
+    return [random_value(rng, depth - 1) for _ in range(rng.randrange(5))]
+
+
+def test_orjson_output_is_identical():
+    for data in corpus():
+        assert github_backup._orjson_compatible(data)
+        assert github_backup._json_dumps_orjson(
+            data
+        ) == github_backup._json_dumps_stdlib(data)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"float": 1e16},
+        {"float": 0.1, "nan": float("nan")},
+        {1: "integer key"},
+        {"big": 2**64},
+        {"small": -(2**63) - 1},
+        {"surrogate": "\ud800"},
+    ],
+)
+def test_unsupported_data_falls_back_to_json(data):
+    assert github_backup.json_dumps(data) == github_backup._json_dumps_stdlib(data)
+
+
+def test_json_dumps_without_orjson():
+    with patch.object(github_backup, "orjson", None):
+        assert github_backup.json_dumps(ISSUE) == github_backup._json_dumps_stdlib(
+            ISSUE
+        )
+
+
+def test_json_loads():
+    content = github_backup.json_dumps(ISSUE)
+
+    assert github_backup.json_loads(content) == ISSUE
+    assert github_backup.json_loads(content.encode("utf-8")) == ISSUE
+    assert github_backup.json_loads('{"big": 18446744073709551616}') == {"big": 2**64}
+    with pytest.raises(json.JSONDecodeError):
+        github_backup.json_loads("{truncated")
@@ -4,6 +4,7 @@ import codecs
 import json
 import os
 import tempfile
+from unittest.mock import patch
 
 import pytest
 
@@ -194,5 +195,70 @@ class TestJsonDumpIfChanged:
             assert result is False
 
 
+class TestJsonDumpIfChangedWithIndex:
+    """Test suite for json_dump_if_changed with a FileIndex."""
+
+    def test_unchanged_file_is_not_read(self):
+        """Should decide from the hash in the index without reading the file."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = os.path.join(tmpdir, "test.json")
+            test_data = {"key": "value", "updated_at": "2024-01-01T00:00:00Z"}
+
+            index = github_backup.FileIndex(tmpdir)
+            assert github_backup.json_dump_if_changed(test_data, output_file, index)
+            index.save()
+
+            index = github_backup.FileIndex(tmpdir)
+            with patch.object(github_backup.codecs, "open") as codecs_open:
+                result = github_backup.json_dump_if_changed(
+                    test_data, output_file, index
+                )
+            assert result is False
+            codecs_open.assert_not_called()
+            assert index.get("test.json")["updated_at"] == "2024-01-01T00:00:00Z"
+
+    def test_changed_file_is_written(self):
+        """Should write and re-index a file whose content changed."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = os.path.join(tmpdir, "test.json")
+            index = github_backup.FileIndex(tmpdir)
+            github_backup.json_dump_if_changed({"key": "value1"}, output_file, index)
+
+            result = github_backup.json_dump_if_changed(
+                {"key": "value2"}, output_file, index
+            )
+
+            assert result is True
+            with open(output_file, "rb") as f:
+                assert index.holds("test.json", f.read())
+
+    def test_files_missing_from_index_are_compared(self):
+        """Should fall back to comparing the file and add it to the index."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = os.path.join(tmpdir, "test.json")
+            test_data = {"key": "value"}
+            index = github_backup.FileIndex(tmpdir)
+            github_backup.json_dump_if_changed(test_data, output_file)
+
+            result = github_backup.json_dump_if_changed(test_data, output_file, index)
+
+            assert result is False
+            assert index.get("test.json") is not None
+
+    def test_deleted_file_is_written_again(self):
+        """Should not trust the index for a file that no longer exists."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = os.path.join(tmpdir, "test.json")
+            test_data = {"key": "value"}
+            index = github_backup.FileIndex(tmpdir)
+            github_backup.json_dump_if_changed(test_data, output_file, index)
+            os.remove(output_file)
+
+            result = github_backup.json_dump_if_changed(test_data, output_file, index)
+
+            assert result is True
+            assert os.path.exists(output_file)
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -1,6 +1,9 @@
 """Tests for Link header pagination handling."""
 
 import json
+import re
+import threading
+import time
 from unittest.mock import Mock, patch
 
 import pytest
@@ -76,7 +79,9 @@ def test_cursor_based_pagination(mock_args):
         requests_made.append(url)
         return responses[len(requests_made) - 1]
 
-    with patch("github_backup.github_backup.urlopen", side_effect=mock_urlopen):
+    with patch.object(
+        github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+    ):
         results = list(
             github_backup.retrieve_data_gen(
                 mock_args, "https://api.github.com/repos/owner/repo/issues"
@@ -111,7 +116,9 @@ def test_page_based_pagination(mock_args):
         requests_made.append(url)
         return responses[len(requests_made) - 1]
 
-    with patch("github_backup.github_backup.urlopen", side_effect=mock_urlopen):
+    with patch.object(
+        github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+    ):
         results = list(
             github_backup.retrieve_data_gen(
                 mock_args, "https://api.github.com/repos/owner/repo/pulls"
@@ -141,7 +148,9 @@ def test_no_link_header_stops_pagination(mock_args):
         requests_made.append(request.get_full_url())
         return responses[len(requests_made) - 1]
 
-    with patch("github_backup.github_backup.urlopen", side_effect=mock_urlopen):
+    with patch.object(
+        github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+    ):
         results = list(
             github_backup.retrieve_data_gen(
                 mock_args, "https://api.github.com/repos/owner/repo/labels"
@@ -151,3 +160,133 @@ def test_no_link_header_stops_pagination(mock_args):
     # Verify pagination stopped after first request
     assert len(results) == 50
     assert len(requests_made) == 1
+
+
+def numbered_page_response(url, last_page=5):
+    match = re.search(r"[?&]page=(\d+)", url)
+    page = int(match.group(1)) if match else 1
+    link_header = None
+    if page < last_page:
+        link_header = (
+            '<https://api.github.com/repos/owner/repo/pulls?per_page=100&page={0}>; rel="next", '
+            '<https://api.github.com/repos/owner/repo/pulls?per_page=100&page={1}>; rel="last"'
+        ).format(page + 1, last_page)
+    return MockHTTPResponse(
+        data=[{"pull": page * 1000 + i} for i in range(100)],
+        link_header=link_header,
+    )
+
+
+def test_last_page_link_fetches_pages_concurrently_in_order(mock_args):
+    """With rel="last", the remaining pages are fetched at once and yielded in order."""
+    lock = threading.Lock()
+    active = []
+    peak = []
+    requests_made = []
+
+    def mock_urlopen(request, *args, **kwargs):
+        url = request.get_full_url()
+        with lock:
+            requests_made.append(url)
+            active.append(url)
+            peak.append(len(active))
+        # let later pages finish first
+        time.sleep(0.05 if url.endswith("page=2") else 0.01)
+        with lock:
+            active.remove(url)
+        return numbered_page_response(url)
+
+    with patch.object(github_backup, "page_window", 3):
+        with patch.object(
+            github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+        ):
+            results = list(
+                github_backup.retrieve_data_gen(
+                    mock_args, "https://api.github.com/repos/owner/repo/pulls"
+                )
+            )
+
+    assert [r["pull"] for r in results] == [
+        page * 1000 + i for page in range(1, 6) for i in range(100)
+    ]
+    assert len(requests_made) == 5
+    assert 1 < max(peak) <= 3
+
+
+def test_cursor_pagination_with_last_link_stays_sequential(mock_args):
+    """Cursor based pages can't be addressed directly, each one is followed in turn."""
+    responses = [
+        MockHTTPResponse(
+            data=[{"issue": 1}],
+            link_header=(
+                '<https://api.github.com/repos/owner/repo/issues?per_page=100&after=ABC>; rel="next", '
+                '<https://api.github.com/repos/owner/repo/issues?per_page=100&page=9>; rel="last"'
+            ),
+        ),
+        MockHTTPResponse(data=[{"issue": 2}]),
+    ]
+    requests_made = []
+
+    def mock_urlopen(request, *args, **kwargs):
+        requests_made.append(request.get_full_url())
+        return responses[len(requests_made) - 1]
+
+    with patch.object(
+        github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+    ):
+        results = list(
+            github_backup.retrieve_data_gen(
+                mock_args, "https://api.github.com/repos/owner/repo/issues"
+            )
+        )
+
+    assert results == [{"issue": 1}, {"issue": 2}]
+    assert len(requests_made) == 2
+    assert "after=ABC" in requests_made[1]
+
+
+def test_page_window_of_one_is_sequential(mock_args):
+    requests_made = []
+
+    def mock_urlopen(request, *args, **kwargs):
+        requests_made.append(request.get_full_url())
+        return numbered_page_response(request.get_full_url(), last_page=3)
+
+    with patch.object(github_backup, "page_window", 1):
+        with patch.object(
+            github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+        ):
+            results = list(
+                github_backup.retrieve_data_gen(
+                    mock_args, "https://api.github.com/repos/owner/repo/pulls"
+                )
+            )
+
+    assert len(results) == 300
+    assert [url.rsplit("page=", 1)[-1] for url in requests_made[1:]] == ["2", "3"]
+
+
+def test_caller_stopping_early_gets_no_full_window_fetched(mock_args):
+    requests_made = []
+
+    def mock_urlopen(request, *args, **kwargs):
+        requests_made.append(request.get_full_url())
+        return numbered_page_response(request.get_full_url(), last_page=10)
+
+    with patch.object(github_backup, "page_window", 4):
+        with patch.object(
+            github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+        ):
+            results = github_backup.retrieve_data_gen(
+                mock_args, "https://api.github.com/repos/owner/repo/pulls"
+            )
+            # e.g. stopping at updated_since on the second page
+            for _ in range(150):
+                next(results)
+            results.close()
+
+    assert [url.rsplit("page=", 1)[-1] for url in requests_made[1:]] == ["2"]
+
+
+def test_page_window_is_off_by_default():
+    assert github_backup.parse_args(["owner"]).page_window == 1
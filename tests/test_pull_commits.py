@@ -0,0 +1,92 @@
+"""Tests for reusing the stored commits of unchanged pull requests."""
+
+import json
+from unittest.mock import patch
+
+from github_backup import github_backup
+
+REPOS_TEMPLATE = "https://api.github.com/repos"
+REPOSITORY = {"full_name": "owner/repo", "name": "repo"}
+PULLS = REPOS_TEMPLATE + "/owner/repo/pulls"
+
+
+def make_pull(number, head):
+    return {
+        "number": number,
+        "updated_at": "2024-01-02T00:00:00Z",
+        "head": {"sha": head},
+        "base": {"sha": "base"},
+    }
+
+
+def backup_pulls(tmp_path, listing, *extra):
+    args = github_backup.parse_args(
+        ["owner", "--pulls", "--pull-commits"] + list(extra)
+    )
+    args.since = None
+    requested = []
+
+    def retrieve_data_gen(args, template, query_args=None, single_request=False):
+        if query_args and query_args.get("state") == "closed":
+            return iter([])
+        return iter([dict(pull) for pull in listing])
+
+    def retrieve_data(args, template, query_args=None, single_request=False):
+        requested.append(template)
+        return [{"sha": "fetched"}]
+
+    with patch.object(github_backup, "retrieve_data_gen", retrieve_data_gen):
+        with patch.object(github_backup, "retrieve_data", retrieve_data):
+            github_backup.backup_pulls(args, str(tmp_path), REPOSITORY, REPOS_TEMPLATE)
+    return requested
+
+
+def read_pull(tmp_path, number):
+    with open(str(tmp_path / "pulls" / "{0}.json".format(number))) as f:
+        return json.load(f)
+
+
+def test_commits_are_only_fetched_when_head_or_base_changed(tmp_path):
+    pulls_cwd = tmp_path / "pulls"
+    pulls_cwd.mkdir()
+    for number in (1, 2):
+        with open(str(pulls_cwd / "{0}.json".format(number)), "w") as f:
+            stored = dict(make_pull(number, "old"), commit_data=[{"sha": "stored"}])
+            github_backup.json_dump(stored, f)
+
+    requested = backup_pulls(tmp_path, [make_pull(1, "old"), make_pull(2, "new")])
+
+    assert requested == [PULLS + "/2/commits"]
+    assert read_pull(tmp_path, 1)["commit_data"] == [{"sha": "stored"}]
+    assert read_pull(tmp_path, 2)["commit_data"] == [{"sha": "fetched"}]
+
+
+def test_stored_pulls_are_only_read_when_the_index_has_their_shas(tmp_path):
+    backup_pulls(tmp_path, [make_pull(1, "old"), make_pull(2, "old")])
+    index = github_backup.FileIndex(str(tmp_path / "pulls"))
+    assert index.get("1.json")["shas"] == ["old", "base"]
+    read = []
+    get = github_backup.FileCollection.get
+
+    def counting_get(self, name):
+        read.append(name)
+        return get(self, name)
+
+    with patch.object(github_backup.FileCollection, "get", counting_get):
+        requested = backup_pulls(tmp_path, [make_pull(1, "old"), make_pull(2, "new")])
+
+    assert read == ["1.json"]
+    assert requested == [PULLS + "/2/commits"]
+    assert github_backup.FileIndex(str(tmp_path / "pulls")).get("2.json")["shas"] == [
+        "new",
+        "base",
+    ]
+
+
+def test_commits_are_kept_in_the_sqlite_archive(tmp_path):
+    backup_pulls(tmp_path, [make_pull(1, "old")], "--storage", "sqlite")
+    requested = backup_pulls(
+        tmp_path, [make_pull(1, "old"), make_pull(2, "new")], "--storage", "sqlite"
+    )
+
+    assert requested == [PULLS + "/2/commits"]
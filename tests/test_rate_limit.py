@@ -0,0 +1,224 @@
+"""Tests for the shared rate limit governor."""
+
+from http.client import HTTPMessage
+from unittest.mock import Mock, patch
+from urllib.error import HTTPError
+from urllib.request import Request
+
+import pytest
+
+from github_backup import github_backup
+
+NOW = 1700000000
+
+
+def make_headers(values):
+    headers = HTTPMessage()
+    for name, value in values.items():
+        headers[name] = str(value)
+    return headers
+
+
+def make_request(url="https://api.github.com/repos/owner/repo/issues", token="a"):
+    request = Request(url)
+    request.add_header("Authorization", "token " + token)
+    return request
+
+
+@pytest.fixture
+def clock():
+    """Freeze time.time() and record time.sleep() calls instead of sleeping."""
+    sleeps = []
+    with patch.object(github_backup.time, "time", return_value=NOW):
+        with patch.object(github_backup.time, "sleep", side_effect=sleeps.append):
+            yield sleeps
+
+
+class TestRateLimitGovernor:
+    def test_no_wait_with_budget_left(self, clock):
+        governor = github_backup.RateLimitGovernor()
+        request = make_request()
+        governor.update(
+            request,
+            make_headers(
+                {"x-ratelimit-remaining": 4000, "x-ratelimit-reset": NOW + 60}
+            ),
+        )
+
+        governor.wait(request)
+
+        assert clock == []
+
+    def test_spreads_remaining_budget_until_reset(self, clock):
+        governor = github_backup.RateLimitGovernor(throttle_limit=100)
+        request = make_request()
+        governor.update(
+            request,
+            make_headers({"x-ratelimit-remaining": 10, "x-ratelimit-reset": NOW + 100}),
+        )
+
+        for _ in range(3):
+            governor.wait(request)
+
+        # 100 seconds for 10 requests, 9 and then 8 left for the later slots
+        assert clock == pytest.approx([10.0, 10.0 + 100 / 9.0])
+
+    def test_exhausted_budget_waits_for_reset(self, clock):
+        governor = github_backup.RateLimitGovernor()
+        request = make_request()
+        governor.update(
+            request,
+            make_headers({"x-ratelimit-remaining": 0, "x-ratelimit-reset": NOW + 30}),
+        )
+
+        governor.wait(request)
+
+        assert clock == [31]
+
+    def test_budgets_are_tracked_per_credential_and_resource(self, clock):
+        governor = github_backup.RateLimitGovernor()
+        governor.update(
+            make_request(token="a"),
+            make_headers({"x-ratelimit-remaining": 0, "x-ratelimit-reset": NOW + 30}),
+        )
+
+        governor.wait(make_request(token="b"))
+        governor.wait(make_request("https://api.github.com/search/issues", token="a"))
+
+        assert clock == []
+
+    def test_retry_after_blocks_the_credential(self, clock):
+        governor = github_backup.RateLimitGovernor()
+        request = make_request()
+        exc = HTTPError(
+            request.full_url,
+            429,
+            "Too Many Requests",
+            make_headers({"Retry-After": 42}),
+            None,
+        )
+
+        assert governor.should_retry(request, exc) is True
+        governor.wait(request)
+
+        assert clock == [42]
+
+    def test_other_errors_are_not_retried(self, clock):
+        governor = github_backup.RateLimitGovernor()
+        request = make_request()
+        exc = HTTPError(
+            request.full_url,
+            403,
+            "Forbidden",
+            make_headers({"x-ratelimit-remaining": 4000}),
+            None,
+        )
+
+        assert governor.should_retry(request, exc) is False
+
+
+def test_http_open_retries_after_secondary_rate_limit(clock):
+    request = make_request()
+    response = Mock(headers=make_headers({}))
+    responses = [
+        HTTPError(
+            request.full_url, 403, "Forbidden", make_headers({"Retry-After": 5}), None
+        ),
+        response,
+    ]
+
+    def mock_urlopen(request, redirect_handler=None):
+        result = responses.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    governor = github_backup.RateLimitGovernor()
+    with patch.object(github_backup, "rate_limit_governor", governor):
+        with patch.object(
+            github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+        ):
+            assert github_backup.http_open(request) is response
+
+    assert clock == [5]
+
+
+def test_server_numbers_replace_the_local_estimate(clock):
+    governor = github_backup.RateLimitGovernor(throttle_limit=100)
+    request = make_request()
+    headers = make_headers(
+        {
+            "x-ratelimit-remaining": 4990,
+            "x-ratelimit-used": 10,
+            "x-ratelimit-reset": NOW + 60,
+        }
+    )
+
+    # e.g. 304 responses of the HTTP cache, which don't count
+    for _ in range(4000):
+        governor.wait(request)
+        governor.update(request, headers)
+
+    assert (
+        governor.budget(github_backup.RateLimitGovernor.credential(request), "core")
+        == 4990
+    )
+    assert clock == []
+
+
+def test_late_responses_of_concurrent_requests_are_ignored(clock):
+    governor = github_backup.RateLimitGovernor()
+    request = make_request()
+    for remaining, used in [(4980, 20), (4990, 10)]:
+        governor.update(
+            request,
+            make_headers(
+                {
+                    "x-ratelimit-remaining": remaining,
+                    "x-ratelimit-used": used,
+                    "x-ratelimit-reset": NOW + 60,
+                }
+            ),
+        )
+
+    assert (
+        governor.budget(github_backup.RateLimitGovernor.credential(request), "core")
+        == 4980
+    )
+
+
+@pytest.mark.parametrize(
+    "url,api_host,counted",
+    [
+        ("https://api.github.com/repos/owner/repo/issues", "api.github.com", True),
+        (
+            "https://github.com/owner/repo/releases/download/v1/a.zip",
+            "api.github.com",
+            False,
+        ),
+        ("https://objects.githubusercontent.com/a.zip", "api.github.com", False),
+        (
+            "https://ghe.example.com/api/v3/repos/owner/repo",
+            "ghe.example.com/api/v3",
+            True,
+        ),
+        ("https://ghe.example.com/api/graphql", "ghe.example.com/api/v3", True),
+        (
+            "https://ghe.example.com/owner/repo/files/1/a.png",
+            "ghe.example.com/api/v3",
+            False,
+        ),
+    ],
+)
+def test_only_api_requests_count(clock, url, api_host, counted):
+    governor = github_backup.RateLimitGovernor(api_host=api_host)
+    request = make_request(url)
+    governor.update(
+        request,
+        make_headers({"x-ratelimit-remaining": 1, "x-ratelimit-reset": NOW + 60}),
+    )
+
+    governor.wait(request)
+    governor.wait(request)
+
+    assert clock == ([61] if counted else [])
@@ -0,0 +1,227 @@
+"""Tests for the retry policy shared by API requests and downloads."""
+
+import io
+import json
+import socket
+import ssl
+from http.client import HTTPMessage
+from unittest.mock import Mock, patch
+from http.client import RemoteDisconnected
+from urllib.error import HTTPError, URLError
+
+import pytest
+
+from github_backup import github_backup
+
+
+class MockHTTPResponse:
+    def __init__(self, body):
+        self._body = io.BytesIO(body)
+        self.headers = HTTPMessage()
+        self.reason = "OK"
+
+    def getcode(self):
+        return 200
+
+    def read(self, amt=None):
+        return self._body.read(amt)
+
+
+class DroppedResponse(MockHTTPResponse):
+    def read(self, amt=None):
+        raise ConnectionResetError("Connection reset by peer")
+
+
+@pytest.fixture
+def sleeps():
+    sleeps = []
+    with patch.object(github_backup.time, "sleep", side_effect=sleeps.append):
+        yield sleeps
+
+
+@pytest.fixture
+def statistics():
+    statistics = github_backup.RunStatistics()
+    with patch.object(github_backup, "run_statistics", statistics):
+        yield statistics
+
+
+@pytest.fixture
+def policy():
+    policy = github_backup.RetryPolicy(max_retries=3, budget=10)
+    with patch.object(github_backup, "retry_policy", policy):
+        yield policy
+
+
+def server_error(url, code=502):
+    return HTTPError(url, code, "Server Error", HTTPMessage(), None)
+
+
+def failing(failures, result="ok"):
+    """A callable raising each exception in failures once, then returning result."""
+    failures = list(failures)
+
+    def func():
+        if failures:
+            raise failures.pop(0)
+        return result
+
+    return func
+
+
+class TestRetryPolicy:
+    def test_retries_with_exponential_backoff(self, sleeps, statistics):
+        policy = github_backup.RetryPolicy(max_retries=5, base_delay=1.0)
+        func = failing([TimeoutError(), ConnectionResetError(), server_error("u")])
+
+        assert policy.call(func, "request") == "ok"
+
+        assert len(sleeps) == 3
+        for attempt, delay in enumerate(sleeps):
+            assert 0 <= delay <= 2**attempt
+        assert statistics.get("retries") == 3
+
+    def test_gives_up_after_max_retries(self, sleeps, statistics):
+        policy = github_backup.RetryPolicy(max_retries=2)
+        func = failing([server_error("u", 503)] * 3)
+
+        with pytest.raises(HTTPError):
+            policy.call(func, "request")
+
+        assert len(sleeps) == 2
+        assert statistics.get("retries_exhausted") == 1
+
+    def test_other_errors_are_not_retried(self, sleeps):
+        policy = github_backup.RetryPolicy()
+        func = failing([server_error("u", 404)])
+
+        with pytest.raises(HTTPError):
+            policy.call(func, "request")
+
+        assert sleeps == []
+
+    def test_configured_statuses_are_retried(self, sleeps):
+        policy = github_backup.RetryPolicy(statuses=[404])
+
+        assert policy.call(failing([server_error("u", 404)]), "request") == "ok"
+        with pytest.raises(HTTPError):
+            policy.call(failing([server_error("u", 502)]), "request")
+
+    def test_budget_is_shared_by_all_calls(self, sleeps):
+        policy = github_backup.RetryPolicy(max_retries=5, budget=2)
+
+        assert policy.call(failing([TimeoutError()]), "first") == "ok"
+        assert policy.call(failing([TimeoutError()]), "second") == "ok"
+        with pytest.raises(TimeoutError):
+            policy.call(failing([TimeoutError()]), "third")
+
+        assert len(sleeps) == 2
+
+
+def test_retrieve_data_retries_server_errors(sleeps, policy):
+    args = Mock()
+    args.as_app = False
+    args.token_fine = None
+    args.token_classic = "fake_token"
+    args.username = None
+    args.password = None
+    args.osx_keychain_item_name = None
+    args.osx_keychain_item_account = None
+
+    responses = [
+        server_error("https://api.github.com/repos/owner/repo/labels"),
+        DroppedResponse(b""),
+        MockHTTPResponse(json.dumps([{"label": 1}]).encode("utf-8")),
+    ]
+
+    def mock_urlopen(request, *args, **kwargs):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    with patch.object(
+        github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+    ):
+        results = github_backup.retrieve_data(
+            args, "https://api.github.com/repos/owner/repo/labels"
+        )
+
+    assert results == [{"label": 1}]
+    assert len(sleeps) == 2
+
+
+def test_download_file_retries_dropped_connection(tmp_path, sleeps, policy):
+    responses = [DroppedResponse(b""), MockHTTPResponse(b"asset contents")]
+    path = str(tmp_path / "asset.bin")
+
+    with patch.object(
+        github_backup.connection_pool,
+        "urlopen",
+        side_effect=lambda *args, **kwargs: responses.pop(0),
+    ):
+        github_backup.download_file(
+            "https://api.github.com/repos/owner/repo/releases/assets/1", path, None
+        )
+
+    with open(path, "rb") as f:
+        assert f.read() == b"asset contents"
+    assert len(sleeps) == 1
+
+
+def test_download_file_leaves_no_partial_file(tmp_path, sleeps, policy):
+    def truncated(*args, **kwargs):
+        response = MockHTTPResponse(b"asset")
+        response.headers["Content-Length"] = "14"
+        return response
+
+    path = str(tmp_path / "asset.bin")
+
+    with patch.object(github_backup.connection_pool, "urlopen", side_effect=truncated):
+        github_backup.download_file(
+            "https://api.github.com/repos/owner/repo/releases/assets/1", path, None
+        )
+
+    # every attempt was cut off, the next run tries again
+    assert len(sleeps) == 3
+    assert sorted(p.name for p in tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize(
+    "exc,retried",
+    [
+        (URLError(ConnectionRefusedError("Connection refused")), True),
+        (URLError(socket.timeout("timed out")), True),
+        (RemoteDisconnected("Remote end closed connection"), True),
+        (URLError(ssl.SSLCertVerificationError("certificate verify failed")), False),
+        (URLError(socket.gaierror(-2, "Name or service not known")), False),
+    ],
+)
+def test_only_transient_connection_errors_are_retried(sleeps, policy, exc, retried):
+    func = failing([exc])
+
+    if retried:
+        assert policy.call(func, "request") == "ok"
+    else:
+        with pytest.raises(URLError):
+            policy.call(func, "request")
+    assert len(sleeps) == (1 if retried else 0)
+
+
+def test_truncated_attachment_is_retried_and_not_saved(tmp_path, sleeps, policy):
+    def truncated(*args, **kwargs):
+        response = MockHTTPResponse(b"image")
+        response.headers["Content-Length"] = "14"
+        response.geturl = lambda: "https://example.com/image.png"
+        return response
+
+    path = str(tmp_path / "image.png")
+
+    with patch.object(github_backup.connection_pool, "urlopen", side_effect=truncated):
+        metadata = github_backup.download_attachment_file(
+            "https://github.com/user-attachments/assets/1", path, None
+        )
+
+    assert metadata["success"] is False
+    assert len(sleeps) == 3
+    assert sorted(p.name for p in tmp_path.iterdir()) == []
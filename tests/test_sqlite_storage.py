@@ -0,0 +1,81 @@
+"""Tests for the SQLite storage backend."""
+
+import os
+import sqlite3
+from unittest.mock import patch
+
+from github_backup import github_backup
+
+REPOS_TEMPLATE = "https://api.github.com/repos"
+REPOSITORY = {"full_name": "owner/repo", "name": "repo"}
+
+ISSUES = [
+    {"number": 1, "updated_at": "2024-01-01T00:00:00Z", "title": "Ünïcode 🚀"},
+    {"number": 2, "updated_at": "2024-01-02T00:00:00Z", "labels": []},
+]
+
+
+def fake_retrieve_data(args, template, query_args=None, single_request=False):
+    path = template[len(REPOS_TEMPLATE + "/owner/repo/") :]
+    if path == "issues":
+        return iter([dict(issue) for issue in ISSUES])
+    if path == "labels":
+        return [{"name": "bug", "color": "d73a4a"}]
+    return [{"body": "comment on " + path}]
+
+
+def backup(repo_cwd, *extra):
+    args = github_backup.parse_args(
+        ["owner", "--issues", "--issue-comments", "--labels"] + list(extra)
+    )
+    args.since = None
+    with patch.object(github_backup, "retrieve_data", fake_retrieve_data):
+        with patch.object(github_backup, "retrieve_data_gen", fake_retrieve_data):
+            github_backup.backup_issues(args, repo_cwd, REPOSITORY, REPOS_TEMPLATE)
+            github_backup.backup_labels(args, repo_cwd, REPOSITORY, REPOS_TEMPLATE)
+
+
+def read_tree(directory):
+    contents = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                contents[os.path.relpath(path, directory)] = f.read()
+    return contents
+
+
+def test_collection_upserts_changed_documents(tmp_path):
+    path = str(tmp_path / github_backup.SQLITE_ARCHIVE)
+    store = github_backup.SQLiteCollection(path, "issues")
+
+    assert store.put("1.json", ISSUES[0]) is True
+    assert store.put("1.json", dict(ISSUES[0])) is False
+    assert store.put("1.json", dict(ISSUES[0], title="edited")) is True
+    assert store.get("1.json")["title"] == "edited"
+    assert store.contains("1.json") and not store.contains("2.json")
+    assert store.unchanged("1.json", "2024-01-01T00:00:00Z")
+    assert not store.unchanged("1.json", "2024-02-01T00:00:00Z")
+    store.close()
+
+    connection = sqlite3.connect(path)
+    assert connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    assert connection.execute("SELECT COUNT(*) FROM documents").fetchone() == (1,)
+
+
+def test_export_matches_file_storage(tmp_path):
+    files_cwd = str(tmp_path / "files")
+    sqlite_cwd = str(tmp_path / "sqlite")
+    backup(files_cwd)
+    backup(sqlite_cwd, "--storage", "sqlite")
+
+    # nothing but the database is written
+    for name in os.listdir(sqlite_cwd):
+        assert name.startswith(github_backup.SQLITE_ARCHIVE)
+
+    github_backup.export_sqlite_archives(str(tmp_path / "sqlite"))
+    exported = read_tree(sqlite_cwd)
+    for name in list(exported):
+        if name.startswith(github_backup.SQLITE_ARCHIVE):
+            del exported[name]
+    assert exported == read_tree(files_cwd)
@@ -0,0 +1,250 @@
+"""Tests for spreading API requests over a pool of tokens."""
+
+import time
+from http.client import HTTPMessage
+from unittest.mock import patch
+from urllib.error import HTTPError
+from urllib.request import Request
+
+import pytest
+
+from github_backup import github_backup
+
+REPO_URL = "https://api.github.com/repos/owner/repo/issues"
+
+
+def make_headers(values):
+    headers = HTTPMessage()
+    for name, value in values.items():
+        headers[name] = str(value)
+    return headers
+
+
+def make_token(name):
+    return {
+        "authorization": "token " + name,
+        "clone_auth": "oauth2:" + name,
+        "label": name,
+    }
+
+
+class MockHTTPResponse:
+    headers = make_headers({})
+
+    def read(self):
+        return b"[]"
+
+
+@pytest.fixture
+def governor():
+    governor = github_backup.RateLimitGovernor()
+    with patch.object(github_backup, "rate_limit_governor", governor):
+        yield governor
+
+
+@pytest.fixture
+def pool(governor):
+    pool = github_backup.TokenPool(
+        [make_token("a"), make_token("b"), make_token("c")], "api.github.com"
+    )
+    with patch.object(github_backup, "token_pool", pool):
+        yield pool
+
+
+def report_remaining(governor, token, remaining):
+    request = Request(REPO_URL)
+    request.add_header("Authorization", "token " + token)
+    governor.update(
+        request,
+        make_headers(
+            {
+                "x-ratelimit-remaining": remaining,
+                "x-ratelimit-reset": int(time.time()) + 3600,
+                "x-ratelimit-resource": "core",
+            }
+        ),
+    )
+
+
+def open_with(responses):
+    """Serve one response per token, raising the HTTPError codes given."""
+    seen = []
+
+    def mock_urlopen(request, *args, **kwargs):
+        token = request.get_header("Authorization")[len("token ") :]
+        seen.append(token)
+        code = responses.get(token, 200)
+        if code != 200:
+            raise HTTPError(
+                request.get_full_url(), code, "Error", make_headers({}), None
+            )
+        return MockHTTPResponse()
+
+    return seen, mock_urlopen
+
+
+class TestTokenPool:
+    def test_picks_token_with_most_remaining_budget(self, governor, pool):
+        report_remaining(governor, "a", 100)
+        report_remaining(governor, "b", 4000)
+        report_remaining(governor, "c", 2000)
+
+        request = Request(REPO_URL)
+        index = pool.authorize(request)
+
+        assert index == 1
+        assert request.get_header("Authorization") == "token b"
+
+    def test_unknown_budget_is_tried_first(self, governor, pool):
+        report_remaining(governor, "a", 4000)
+
+        request = Request(REPO_URL)
+        pool.authorize(request)
+
+        assert request.get_header("Authorization") in ("token b", "token c")
+
+    def test_requests_outside_repositories_keep_primary_token(self, pool):
+        request = Request("https://api.github.com/user/repos")
+        request.add_header("Authorization", "token a")
+
+        assert pool.authorize(request) is None
+        assert request.get_header("Authorization") == "token a"
+
+    def test_denied_token_is_retried_and_skipped_for_repository(self, governor, pool):
+        report_remaining(governor, "a", 4000)
+        report_remaining(governor, "b", 3000)
+        report_remaining(governor, "c", 1000)
+        seen, mock_urlopen = open_with({"a": 404})
+
+        with patch.object(
+            github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+        ):
+            github_backup.http_open(Request(REPO_URL))
+            github_backup.http_open(Request(REPO_URL + "/1/comments"))
+
+        assert seen == ["a", "b", "b"]
+        assert pool.clone_auth("Owner/Repo") == "oauth2:b"
+
+    def test_error_is_raised_when_no_token_has_access(self, governor, pool):
+        seen, mock_urlopen = open_with({"a": 404, "b": 404, "c": 404})
+
+        with patch.object(
+            github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+        ):
+            with pytest.raises(HTTPError):
+                github_backup.http_open(Request(REPO_URL))
+
+        assert sorted(seen) == ["a", "b", "c"]
+        assert pool.clone_auth("owner/repo") is None
+
+    def test_rejected_token_is_not_used_again(self, governor, pool):
+        seen, mock_urlopen = open_with({"a": 401})
+        report_remaining(governor, "a", 4000)
+        report_remaining(governor, "b", 3000)
+        report_remaining(governor, "c", 1000)
+
+        with patch.object(
+            github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+        ):
+            github_backup.http_open(Request(REPO_URL))
+            github_backup.http_open(
+                Request("https://api.github.com/repos/other/repo/issues")
+            )
+
+        assert seen == ["a", "b", "b"]
+        assert [token["invalid"] for token in pool.stats()] == [True, False, False]
+
+    def test_endpoint_denied_to_token_with_access_is_only_skipped_there(
+        self, governor, pool
+    ):
+        report_remaining(governor, "a", 4000)
+        report_remaining(governor, "b", 3000)
+        report_remaining(governor, "c", 1000)
+        seen, mock_urlopen = open_with({})
+
+        with patch.object(
+            github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+        ):
+            github_backup.http_open(Request(REPO_URL))
+            denied, mock_urlopen = open_with({"a": 404})
+            with patch.object(
+                github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+            ):
+                github_backup.http_open(
+                    Request("https://api.github.com/repos/owner/repo/hooks")
+                )
+            github_backup.http_open(
+                Request("https://api.github.com/repos/owner/repo/hooks")
+            )
+            github_backup.http_open(Request(REPO_URL + "/1/comments"))
+
+        assert denied == ["a", "b"]
+        assert seen == ["a", "b", "a"]
+
+    def test_endpoint_denied_to_every_token_fails_after_one_request(
+        self, governor, pool
+    ):
+        seen, mock_urlopen = open_with({"a": 404, "b": 404, "c": 404})
+
+        with patch.object(
+            github_backup.connection_pool, "urlopen", side_effect=mock_urlopen
+        ):
+            for _ in range(2):
+                with pytest.raises(HTTPError):
+                    github_backup.http_open(Request(REPO_URL))
+
+        assert len(seen) == 4
+        assert seen[3] in ("a", "b", "c")
+
+
+def test_pool_tokens_from_arguments_and_file(tmp_path):
+    token_file = tmp_path / "tokens"
+    token_file.write_text("github_pat_second\n\nthird\nprimary\n")
+    args = github_backup.parse_args(
+        [
+            "owner",
+            "--token",
+            "primary",
+            "--token-pool",
+            "file://" + str(token_file),
+            "--token-pool",
+            "fourth",
+        ]
+    )
+
+    tokens = github_backup.get_pool_tokens(args)
+
+    assert [token["label"] for token in tokens] == ["#1", "#2", "#3", "#4"]
+    assert [token["clone_auth"] for token in tokens] == [
+        "primary:x-oauth-basic",
+        "oauth2:github_pat_second",
+        "third:x-oauth-basic",
+        "fourth:x-oauth-basic",
+    ]
+    assert tokens[1]["authorization"] == "token github_pat_second"
+
+
+def test_clone_url_is_only_resolved_for_clones(tmp_path):
+    repository = {
+        "full_name": "owner/repo",
+        "name": "repo",
+        "owner": {"login": "owner"},
+        "private": True,
+        "has_wiki": True,
+    }
+
+    def backup(*extra):
+        args = github_backup.parse_args(["owner"] + list(extra))
+        with patch.object(github_backup, "get_github_repo_url") as get_url:
+            get_url.return_value = "https://github.com/owner/repo.git"
+            with patch.object(github_backup, "fetch_repository") as fetch:
+                github_backup.backup_repository(
+                    args, str(tmp_path), repository, "https://api.github.com/repos"
+                )
+        return get_url.call_count, [call.args[1] for call in fetch.call_args_list]
+
+    assert backup() == (0, [])
+    assert backup("--repositories", "--wikis") == (
+        2,
+        ["https://github.com/owner/repo.git", "https://github.com/owner/repo.wiki.git"],
+    )
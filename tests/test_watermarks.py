@@ -0,0 +1,93 @@
+"""Tests for the per-repository incremental watermarks."""
+
+import json
+from unittest.mock import patch
+
+import pytest
+
+from github_backup import github_backup
+
+
+def make_repository(name):
+    return {
+        "full_name": "owner/" + name,
+        "name": name,
+        "has_wiki": False,
+        "clone_url": "https://github.com/owner/" + name + ".git",
+        "updated_at": "2024-01-01T00:00:00Z",
+    }
+
+
+def run_backup(tmp_path, repositories, fail=()):
+    args = github_backup.parse_args(["owner", "--incremental", "--issues", "--pulls"])
+    calls = []
+
+    def backup(resource):
+        def backup_resource(args, repo_cwd, repository, repos_template):
+            calls.append((repository["name"], resource, args.since))
+            if (repository["name"], resource) in fail:
+                raise Exception("API request returned HTTP 500")
+
+        return backup_resource
+
+    with patch.object(github_backup, "backup_issues", backup("issues")):
+        with patch.object(github_backup, "backup_pulls", backup("pulls")):
+            github_backup.backup_repositories(args, str(tmp_path), repositories)
+    return calls
+
+
+def read_watermarks(tmp_path):
+    with open(str(tmp_path / "watermarks.json")) as f:
+        return json.load(f)
+
+
+def test_each_resource_resumes_from_its_own_watermark(tmp_path):
+    first = run_backup(tmp_path, [make_repository("a")])
+    marks = read_watermarks(tmp_path)["owner/a"]
+
+    second = run_backup(tmp_path, [make_repository("a"), make_repository("b")])
+
+    assert first == [("a", "issues", None), ("a", "pulls", None)]
+    assert second == [
+        ("a", "issues", marks["issues"]),
+        ("a", "pulls", marks["pulls"]),
+        # a new repository is backed up completely
+        ("b", "issues", None),
+        ("b", "pulls", None),
+    ]
+
+
+def test_failed_resource_keeps_its_watermark(tmp_path):
+    with pytest.raises(Exception, match="HTTP 500"):
+        run_backup(tmp_path, [make_repository("a")], fail=[("a", "pulls")])
+
+    assert list(read_watermarks(tmp_path)["owner/a"]) == ["issues"]
+    calls = run_backup(tmp_path, [make_repository("a")])
+    assert calls[1] == ("a", "pulls", None)
+
+
+def test_last_update_is_used_for_existing_directories(tmp_path):
+    (tmp_path / "last_update").write_text("2023-06-01T00:00:00Z")
+    (tmp_path / "repositories" / "a" / "issues").mkdir(parents=True)
+
+    calls = run_backup(tmp_path, [make_repository("a")])
+
+    assert calls == [
+        ("a", "issues", "2023-06-01T00:00:00Z"),
+        ("a", "pulls", None),
+    ]
+
+
+def test_watermarks_follow_the_server_clock(tmp_path):
+    clock = github_backup.ServerClock()
+    clock.update({"Date": "Mon, 01 Jan 2024 12:00:00 GMT"})
+    clock.update({"Date": "not a date"})
+
+    with patch.object(github_backup, "server_clock", clock):
+        run_backup(tmp_path, [make_repository("a")])
+
+    # a minute before the server time, however far off the local clock is
+    assert read_watermarks(tmp_path)["owner/a"]["issues"] in (
+        "2024-01-01T11:59:00Z",
+        "2024-01-01T11:59:01Z",
+    )
@@ -0,0 +1,98 @@
+"""Tests for concurrent repository backup workers."""
+
+import logging
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from github_backup import github_backup
+
+
+def make_repositories(count):
+    return [
+        {
+            "full_name": "owner/repo{0}".format(i),
+            "name": "repo{0}".format(i),
+            "updated_at": "2024-01-{0:02d}T00:00:00Z".format(i + 1),
+        }
+        for i in range(count)
+    ]
+
+
+def make_args(*extra):
+    return github_backup.parse_args(["owner"] + list(extra))
+
+
+class TestBackupRepositoriesWorkers:
+    def test_repositories_run_in_parallel(self, tmp_path):
+        args = make_args("--workers", "4")
+        lock = threading.Lock()
+        active = []
+        peak = []
+
+        def slow_backup(args, output_directory, repository, repos_template):
+            with lock:
+                active.append(repository["name"])
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.remove(repository["name"])
+            return True
+
+        with patch.object(github_backup, "backup_repository", side_effect=slow_backup):
+            github_backup.backup_repositories(args, str(tmp_path), make_repositories(8))
+
+        assert 1 < max(peak) <= 4
+
+    def test_log_messages_are_prefixed_with_repository(self, tmp_path, caplog):
+        args = make_args("--workers", "2")
+
+        def backup(args, output_directory, repository, repos_template):
+            github_backup.logger.info("working")
+            return True
+
+        with patch.object(github_backup, "backup_repository", side_effect=backup):
+            with caplog.at_level(logging.INFO, logger=github_backup.logger.name):
+                github_backup.backup_repositories(
+                    args, str(tmp_path), make_repositories(2)
+                )
+
+        messages = [record.getMessage() for record in caplog.records]
+        assert "[owner/repo0] working" in messages
+        assert "[owner/repo1] working" in messages
+        assert "Backed up 2 of 2 repositories (0 unavailable, 0 failed)" in messages
+
+    def test_unavailable_repositories_are_summarized(self, tmp_path, caplog):
+        args = make_args("--workers", "2", "--incremental")
+
+        def backup(args, output_directory, repository, repos_template):
+            return repository["name"] != "repo1"
+
+        with patch.object(github_backup, "backup_repository", side_effect=backup):
+            with caplog.at_level(logging.INFO, logger=github_backup.logger.name):
+                github_backup.backup_repositories(
+                    args, str(tmp_path), make_repositories(3)
+                )
+
+        messages = [record.getMessage() for record in caplog.records]
+        assert "Backed up 2 of 3 repositories (1 unavailable, 0 failed)" in messages
+        # the watermark covers every repository, like a sequential run
+        assert (tmp_path / "last_update").read_text() == "2024-01-03T00:00:00Z"
+
+    def test_failure_is_raised_and_watermark_not_written(self, tmp_path):
+        args = make_args("--workers", "2", "--incremental")
+
+        def backup(args, output_directory, repository, repos_template):
+            if repository["name"] == "repo0":
+                raise Exception("API request returned HTTP 500")
+            return True
+
+        with patch.object(github_backup, "backup_repository", side_effect=backup):
+            with pytest.raises(Exception, match="HTTP 500"):
+                github_backup.backup_repositories(
+                    args, str(tmp_path), make_repositories(3)
+                )
+
+        assert not (tmp_path / "last_update").exists()